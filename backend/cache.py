@@ -0,0 +1,363 @@
+"""Shared cache: namespaced JSON values with TTLs, invalidated across workers.
+
+`Cache.namespace(name, ttl)` gives a CacheNamespace whose `get_or_load(key,
+loader)` returns the cached value or awaits `loader()` and stores its result.
+Two backends hold the entries:
+
+- MemoryBackend keeps them in a dict, so each worker caches on its own.
+- RedisBackend keeps them on a Redis-protocol server (`CACHE_URL`), shared by
+  every worker and dyno. It needs the `redis` package; tests can hand it a
+  `fakeredis.aioredis.FakeRedis` client instead.
+
+Every key carries its namespace's generation, so `invalidate_all()` drops a
+whole namespace (every filter/sort variant of a listing) by bumping one
+counter instead of scanning keys. `invalidate(key)` gives the key a new
+version token, and entries are stamped with the token seen before their
+loader ran, so a load that was already in flight when the key was
+invalidated stores a value nobody will read. In front of a shared backend each worker
+also keeps a short-lived local copy of hot entries and generations
+(`local_ttl`); invalidations are broadcast on a pub/sub channel so the other
+workers drop those copies at once rather than serving them until they expire.
+
+Backend errors never fail a request: reads fall through to the loader and
+failed invalidations are logged (entries still expire after their TTL).
+"""
+import asyncio
+import json
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_MISSING = object()
+
+# Generation counters (one small key per namespace) must outlive every entry
+# stamped with them; a year is as good as forever here
+_GENERATION_TTL = 365 * 86400.0
+
+
+class CacheUnavailable(Exception):
+    """The cache backend could not be reached"""
+
+
+# ---------------------------------------------------------------- backends
+
+class MemoryBackend:
+    """Entries in a dict (per process); pub/sub delivers to this process only"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self._data: Dict[str, Tuple[Any, float]] = {}
+        self._subscribers: Dict[str, list] = {}
+        self.max_keys = max_keys
+
+    def _live(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._live(key)
+        return None if item is None else item[0]
+
+    async def get_many(self, *keys: str) -> List[Optional[str]]:
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: str, ttl: float):
+        if len(self._data) >= self.max_keys and key not in self._data:
+            self._prune()
+        self._data[key] = (value, time.monotonic() + ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def incr(self, key: str, amount: int, ttl: float) -> int:
+        """Add `amount` to a counter; a new counter expires `ttl` seconds after creation"""
+        item = self._live(key)
+        value, expires = (int(item[0]), item[1]) if item else (0, time.monotonic() + ttl)
+        self._data[key] = (value + amount, expires)
+        return value + amount
+
+    async def publish(self, channel: str, message: str):
+        for callback in self._subscribers.get(channel, []):
+            callback(message)
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    async def flush(self, prefix: str):
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            del self._data[key]
+
+    async def close(self):
+        self._subscribers.clear()
+
+    def _prune(self):
+        # Drop what has expired; if that frees nothing, the half closest to expiring
+        now = time.monotonic()
+        stale = [k for k, (_, expires) in self._data.items() if expires <= now]
+        if not stale:
+            stale = sorted(self._data, key=lambda k: self._data[k][1])[: len(self._data) // 2]
+        for key in stale:
+            del self._data[key]
+
+
+class RedisBackend:
+    """Entries on a Redis-protocol server, shared by every worker.
+
+    `client` is a `redis.asyncio.Redis` (or fakeredis) client created with
+    `decode_responses=True`. Subscriptions run on a listener task that
+    resubscribes after connection errors.
+    """
+
+    def __init__(self, client):
+        from redis.exceptions import RedisError
+
+        self.client = client
+        self._errors = (RedisError, OSError)
+        self._listeners: list = []
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_URL is set but the redis package is not installed") from e
+        return cls(redis.from_url(url, decode_responses=True, socket_timeout=1.0, socket_connect_timeout=1.0))
+
+    async def _run(self, command: Awaitable[T]) -> T:
+        try:
+            return await command
+        except self._errors as e:
+            raise CacheUnavailable(str(e)) from e
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._run(self.client.get(key))
+
+    async def get_many(self, *keys: str) -> List[Optional[str]]:
+        return await self._run(self.client.mget(*keys))
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._run(self.client.set(key, value, px=max(1, int(ttl * 1000))))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._run(self.client.delete(*keys))
+
+    async def incr(self, key: str, amount: int, ttl: float) -> int:
+        async def _incr():
+            value = await self.client.incrby(key, amount)
+            if value == amount:
+                await self.client.pexpire(key, max(1, int(ttl * 1000)))
+            return value
+
+        return await self._run(_incr())
+
+    async def publish(self, channel: str, message: str):
+        await self._run(self.client.publish(channel, message))
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]):
+        self._listeners.append(asyncio.create_task(self._listen(channel, callback)))
+
+    async def _listen(self, channel: str, callback: Callable[[str], None]):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(channel)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        callback(message["data"])
+            except self._errors:
+                logger.warning("Cache invalidation channel lost; resubscribing", exc_info=True)
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.aclose()
+
+    async def flush(self, prefix: str):
+        async def _flush():
+            async for key in self.client.scan_iter(match=f"{prefix}*", count=500):
+                await self.client.delete(key)
+
+        await self._run(_flush())
+
+    async def close(self):
+        for task in self._listeners:
+            task.cancel()
+        await self.client.aclose()
+
+
+# ---------------------------------------------------------------- cache
+
+class Cache:
+    """Namespaced cache over a backend; `start()` subscribes to invalidations.
+
+    `local_ttl` (0 disables) is how long a worker serves its own copy of an
+    entry or generation before asking the backend again, bounding staleness
+    if an invalidation message is missed.
+    """
+
+    def __init__(self, backend, prefix: str = "cache", local_ttl: float = 0.0, max_local_keys: int = 10_000):
+        self.backend = backend
+        self.prefix = prefix
+        self.local_ttl = local_ttl
+        self.max_local_keys = max_local_keys
+        self.channel = f"{prefix}:invalidate"
+        # (namespace, key) -> (generation, value, expires); namespace -> (generation, expires)
+        self._local: Dict[Tuple[str, str], Tuple[int, Any, float]] = {}
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        # Bumped by every invalidation seen here; a load only keeps a local copy
+        # if none arrived while it ran
+        self._invalidations = 0
+
+    async def start(self):
+        await self.backend.subscribe(self.channel, self._on_invalidate)
+
+    async def close(self):
+        await self.backend.close()
+
+    def namespace(self, name: str, ttl: float) -> "CacheNamespace":
+        return CacheNamespace(self, name, ttl)
+
+    async def incr(self, key: str, amount: int, ttl: float) -> int:
+        """Shared counter under the cache's prefix (raises CacheUnavailable)"""
+        return await self.backend.incr(f"{self.prefix}:{key}", amount, ttl)
+
+    async def flush(self):
+        """Drop every entry under this cache's prefix, here and in the backend"""
+        self._local.clear()
+        self._generations.clear()
+        await self.backend.flush(f"{self.prefix}:")
+
+    def _on_invalidate(self, message: str):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return
+        self._invalidations += 1
+        namespace = event.get("namespace")
+        if event.get("all"):
+            self._generations.pop(namespace, None)
+            for local_key in [k for k in self._local if k[0] == namespace]:
+                del self._local[local_key]
+        else:
+            for key in event.get("keys", []):
+                self._local.pop((namespace, key), None)
+
+    async def _broadcast(self, event: dict):
+        if self.local_ttl:
+            await self.backend.publish(self.channel, json.dumps(event))
+
+
+class CacheNamespace:
+    """Entries sharing a name, TTL and invalidation scope"""
+
+    def __init__(self, cache: Cache, name: str, ttl: float):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+
+    def _generation_key(self) -> str:
+        return f"{self.cache.prefix}:{self.name}:gen"
+
+    def _version_key(self, key: str) -> str:
+        return f"{self.cache.prefix}:{self.name}:v:{key}"
+
+    def _version_ttl(self) -> float:
+        # Must outlive any entry stamped before the bump (its TTL plus a slow loader),
+        # or the key would fall back to "no version" while such an entry is alive
+        return self.ttl + max(self.ttl, 300.0)
+
+    async def _generation(self) -> int:
+        local = self.cache._generations.get(self.name)
+        if local is not None and local[1] > time.monotonic():
+            return local[0]
+        generation = int(await self.cache.backend.get(self._generation_key()) or 0)
+        if self.cache.local_ttl:
+            self.cache._generations[self.name] = (generation, time.monotonic() + self.cache.local_ttl)
+        return generation
+
+    async def _lookup(self, key: str) -> Tuple[int, str, Any]:
+        """(generation, version, value or _MISSING) for `key`"""
+        generation = await self._generation()
+        local = self.cache._local.get((self.name, key))
+        if local is not None and local[0] == generation and local[2] > time.monotonic():
+            return generation, "", local[1]
+        version, raw = await self.cache.backend.get_many(
+            self._version_key(key), f"{self.cache.prefix}:{self.name}:{generation}:{key}"
+        )
+        version = version or ""
+        entry = json.loads(raw) if raw is not None else None
+        # Entries are [version, value]; one stamped with an older version is stale
+        if not (isinstance(entry, list) and len(entry) == 2 and entry[0] == version):
+            return generation, version, _MISSING
+        self._keep_local(generation, key, entry[1])
+        return generation, version, entry[1]
+
+    def _keep_local(self, generation: int, key: str, value: Any):
+        if not self.cache.local_ttl:
+            return
+        local = self.cache._local
+        if len(local) >= self.cache.max_local_keys:
+            local.clear()
+        local[(self.name, key)] = (generation, value, time.monotonic() + min(self.cache.local_ttl, self.ttl))
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[T]]) -> T:
+        """Cached value for `key`, or `loader()`'s result (stored, JSON-encoded, for `ttl` seconds).
+
+        A None result ("not found") is not stored: the thing may exist a moment
+        later (or already, on a primary a lagging secondary hasn't caught up with).
+        """
+        invalidations = self.cache._invalidations
+        try:
+            generation, version, value = await self._lookup(key)
+        except CacheUnavailable as e:
+            logger.warning("Cache unavailable (%s); loading %s:%s directly", e, self.name, key)
+            return await loader()
+        if value is not _MISSING:
+            return value
+
+        value = await loader()
+        if value is None:
+            return value
+        try:
+            await self.cache.backend.set(
+                f"{self.cache.prefix}:{self.name}:{generation}:{key}", json.dumps([version, value]), self.ttl
+            )
+            if self.cache._invalidations == invalidations:
+                self._keep_local(generation, key, value)
+        except CacheUnavailable as e:
+            logger.warning("Cache unavailable (%s); not storing %s:%s", e, self.name, key)
+        return value
+
+    async def invalidate(self, *keys: str):
+        """Drop `keys` everywhere, including values still being loaded"""
+        if not keys:
+            return
+        self.cache._invalidations += 1
+        for key in keys:
+            self.cache._local.pop((self.name, key), None)
+        try:
+            for key in keys:
+                await self.cache.backend.set(self._version_key(key), secrets.token_hex(8), self._version_ttl())
+            generation = await self._generation()
+            await self.cache.backend.delete(*(f"{self.cache.prefix}:{self.name}:{generation}:{k}" for k in keys))
+            await self.cache._broadcast({"namespace": self.name, "keys": list(keys)})
+        except CacheUnavailable as e:
+            logger.warning("Cache unavailable (%s); %s entries expire after their TTL", e, self.name)
+
+    async def invalidate_all(self):
+        """Drop every entry in the namespace everywhere"""
+        self.cache._on_invalidate(json.dumps({"namespace": self.name, "all": True}))
+        try:
+            await self.cache.backend.incr(self._generation_key(), 1, _GENERATION_TTL)
+            await self.cache._broadcast({"namespace": self.name, "all": True})
+        except CacheUnavailable as e:
+            logger.warning("Cache unavailable (%s); %s entries expire after their TTL", e, self.name)
@@ -0,0 +1,41 @@
+"""Request coalescing ("single flight") for hot reads.
+
+When many requests ask for the same thing at once, e.g. a competition page at
+launch, `SingleFlight.do(key, fn)` runs `fn` once and every concurrent caller
+with the same key awaits that one result (or exception). Nothing is cached:
+the key is forgotten as soon as the call finishes, so the next caller reads
+fresh data.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from metrics import COALESCED_CALLS
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls per key within one process"""
+
+    def __init__(self, group: str):
+        self.group = group
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            # Run in its own task so a caller that disconnects doesn't cancel the
+            # query for everyone else waiting on it
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+            COALESCED_CALLS.labels(self.group, "executed").inc()
+        else:
+            COALESCED_CALLS.labels(self.group, "shared").inc()
+        return await asyncio.shield(call)
+
+    def _forget(self, key: Hashable, done: asyncio.Future):
+        if self._calls.get(key) is done:
+            del self._calls[key]
+        if not done.cancelled():
+            done.exception()  # retrieved here in case every caller went away
@@ -0,0 +1,166 @@
+"""Structured JSON logging.
+
+Records are handed to a QueueHandler and written by a QueueListener thread, so
+stdout/disk I/O never runs on the event loop. AccessLogMiddleware emits one
+sampled access record per request.
+"""
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from metrics import route_template
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+access_logger = logging.getLogger("access")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    # Runs in the logging caller's context, before the record crosses the queue
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class _JsonQueueHandler(QueueHandler):
+    """QueueHandler that keeps `extra` fields and the traceback separate from
+    the message, leaving the JSON rendering to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level: str = "INFO") -> QueueListener:
+    """Route the root logger through a queue to a JSON stdout handler; returns the
+    started listener (stop it on shutdown to flush)"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, stream, respect_handler_level=True)
+
+    handler = _JsonQueueHandler(log_queue)
+    handler.addFilter(_RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener.start()
+    return listener
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "route=rate,route=rate" (e.g. "/api/competitions=0.1,/api/health=0")"""
+    rates = {}
+    for item in spec.split(","):
+        route, sep, rate = item.strip().rpartition("=")
+        if sep and route:
+            rates[route] = float(rate)
+    return rates
+
+
+class AccessLogMiddleware:
+    """ASGI middleware assigning a request ID and logging one structured access
+    record per request.
+
+    Records are sampled per route template; errors (5xx) and requests slower
+    than `always_log_slower_than` seconds are always logged.
+    """
+
+    def __init__(self, app, sample_rates: Optional[Dict[str, float]] = None,
+                 default_rate: float = 1.0, always_log_slower_than: float = 1.0):
+        self.app = app
+        self.sample_rates = sample_rates or {}
+        self.default_rate = default_rate
+        self.always_log_slower_than = always_log_slower_than
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming[:64] or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("X-Request-ID", request_id)
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            latency = time.perf_counter() - start
+            self._log(scope, status, latency)
+            request_id_var.reset(token)
+
+    def _log(self, scope, status: int, latency: float):
+        route = route_template(scope)
+        if status < 500 and latency < self.always_log_slower_than:
+            rate = self.sample_rates.get(route, self.default_rate)
+            if rate <= 0 or (rate < 1 and random.random() >= rate):
+                return
+
+        state = scope.get("state") or {}
+        db_stats = state.get("db_stats")
+        access_logger.info(
+            "%s %s %d",
+            scope["method"],
+            route,
+            status,
+            extra={
+                "method": scope["method"],
+                "route": route,
+                "path": scope["path"],
+                "status": status,
+                "latency_ms": round(latency * 1000, 1),
+                "user_id": state.get("user_id"),
+                "db_calls": db_stats.calls if db_stats else None,
+                "db_ms": round(db_stats.seconds * 1000, 1) if db_stats else None,
+            },
+        )
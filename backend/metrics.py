@@ -0,0 +1,317 @@
+"""Prometheus metrics for the API: HTTP routes, MongoDB commands, Stripe calls
+and event-loop health, plus per-request DB call accounting.
+
+Exposed in text format by the `/metrics` endpoint in server.py.
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template and status",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled")
+
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by collection and command",
+    ["collection", "command"],
+    buckets=MONGO_BUCKETS,
+)
+MONGO_COMMANDS = Counter(
+    "mongo_commands_total",
+    "MongoDB commands by collection, command and outcome",
+    ["collection", "command", "outcome"],
+)
+
+STRIPE_CALL_DURATION = Histogram(
+    "stripe_call_duration_seconds",
+    "Stripe API call latency by operation and outcome",
+    ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "How late the last event-loop lag probe woke up")
+
+REQUESTS_REJECTED = Counter(
+    "http_requests_rejected_total",
+    "Requests refused by admission control (rate limits, load shedding)",
+    ["reason", "rule"],
+)
+
+UPSTREAM_BREAKER_STATE = Gauge(
+    "upstream_circuit_state",
+    "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)",
+    ["upstream"],
+)
+UPSTREAM_CALLS_REJECTED = Counter(
+    "upstream_calls_rejected_total",
+    "Upstream calls or retries refused locally (circuit_open, retry_budget)",
+    ["upstream", "reason"],
+)
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Retried upstream call attempts", ["upstream"])
+
+MONGO_READ_RETRIES = Counter(
+    "mongo_read_retries_total",
+    "Idempotent reads retried after a transient MongoDB error (retry), or failed once retries ran out (exhausted)",
+    ["operation", "outcome"],
+)
+
+COALESCED_CALLS = Counter(
+    "coalesced_calls_total",
+    "Reads routed through request coalescing, by whether the call ran or joined one already in flight",
+    ["group", "outcome"],
+)
+
+
+class RequestDbStats:
+    """DB round trips and time spent in them for one HTTP request"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        # Commands finish on Motor's executor threads, possibly concurrently
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.calls} calls"'
+
+
+# Motor copies the caller's context onto its executor threads, so the command
+# listener sees the stats object of the request that issued the command.
+_request_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+def current_db_stats() -> Optional[RequestDbStats]:
+    return _request_db_stats.get()
+
+
+@contextmanager
+def collect_db_stats():
+    """Attribute DB commands issued inside the block to a fresh RequestDbStats"""
+    stats = RequestDbStats()
+    token = _request_db_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_db_stats.reset(token)
+
+
+# Command arguments that carry the query; their values are reduced to a shape
+_SHAPE_FIELDS = ("filter", "query", "q", "pipeline", "updates", "deletes", "sort")
+
+
+def _shape(value):
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_shape(v) for v in value[:3]]
+    return "?"
+
+
+def _command_shape(command) -> dict:
+    return {k: _shape(command[k]) for k in _SHAPE_FIELDS if k in command}
+
+
+def _command_collection(command_name: str, command) -> str:
+    # Collection-scoped commands carry the collection name as the command's value
+    target = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener recording per-command counts and latency.
+
+    Callbacks run on Motor's executor threads; `succeeded`/`failed` events do
+    not carry the command, so the collection (and, when slow-query logging is
+    on, the query shape) is remembered from `started`.
+    """
+
+    def __init__(self, slow_query_ms: float = 0):
+        self._inflight = {}
+        self._slow_query_seconds = slow_query_ms / 1000
+
+    def started(self, event):
+        collection = _command_collection(event.command_name, event.command)
+        shape = _command_shape(event.command) if self._slow_query_seconds else None
+        self._inflight[(event.connection_id, event.request_id)] = (collection, shape)
+
+    def _finished(self, event, outcome: str):
+        collection, shape = self._inflight.pop((event.connection_id, event.request_id), ("", None))
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name).observe(seconds)
+        MONGO_COMMANDS.labels(collection, event.command_name, outcome).inc()
+
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.record(seconds)
+
+        if self._slow_query_seconds and seconds >= self._slow_query_seconds:
+            logger.warning(
+                "Slow MongoDB command %s.%s took %.1fms: %s",
+                collection,
+                event.command_name,
+                seconds * 1000,
+                shape,
+                extra={
+                    "collection": collection,
+                    "command": event.command_name,
+                    "shape": shape,
+                    "duration_ms": round(seconds * 1000, 1),
+                    "outcome": outcome,
+                },
+            )
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
+
+
+@contextmanager
+def track_stripe(operation: str):
+    """Time a (blocking) Stripe SDK call"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        STRIPE_CALL_DURATION.labels(operation, outcome).observe(time.perf_counter() - start)
+
+
+_route_paths = {}
+
+
+def route_template(scope) -> str:
+    """Path template of the route that handled the request (after routing ran)"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _route_paths:
+        _route_paths.update(
+            (getattr(r, "endpoint", None), r.path) for r in scope["app"].routes if hasattr(r, "path")
+        )
+    return _route_paths.get(endpoint, "unmatched")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency by route template and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], route_template(scope), str(status)
+            ).observe(time.perf_counter() - start)
+
+
+class DbTimingMiddleware:
+    """ASGI middleware counting DB round trips per request.
+
+    Reports them in a `Server-Timing` header and keeps the stats on
+    `request.state.db_stats` for logging. Requests making more than
+    `warn_threshold` calls (0 disables) are logged as likely N+1s.
+    """
+
+    def __init__(self, app, warn_threshold: int = 0):
+        self.app = app
+        self.warn_threshold = warn_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDbStats()
+        scope.setdefault("state", {})["db_stats"] = stats
+        token = _request_db_stats.set(stats)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _request_db_stats.reset(token)
+            if self.warn_threshold and stats.calls > self.warn_threshold:
+                logger.warning(
+                    "%s %s made %d DB calls (threshold %d)",
+                    scope["method"],
+                    route_template(scope),
+                    stats.calls,
+                    self.warn_threshold,
+                    extra={
+                        "method": scope["method"],
+                        "route": route_template(scope),
+                        "db_calls": stats.calls,
+                        "db_ms": round(stats.seconds * 1000, 1),
+                    },
+                )
+
+
+_loop_lag = 0.0
+
+
+def current_loop_lag() -> float:
+    """Event-loop lag seen by the most recent probe, in seconds"""
+    return _loop_lag
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sleep `interval` forever and record how late each wake-up is"""
+    global _loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        _loop_lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(_loop_lag)
+
+
+def render_metrics():
+    """Return (body, content type) for the Prometheus scrape endpoint"""
+    return generate_latest(), CONTENT_TYPE_LATEST
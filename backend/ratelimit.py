@@ -0,0 +1,282 @@
+"""Admission control: per-client token-bucket rate limits and load shedding.
+
+RateLimitMiddleware charges one token per request to the bucket of the
+(client, rule) pair that matches the request's method and path, and answers
+429 with `Retry-After` once the bucket is empty. Buckets live in process
+memory by default; MongoBucketStore keeps them in a collection so limits hold
+across workers, and CacheCounterStore keeps fixed-window counters in the
+shared cache (Redis) for the same without a database write per request.
+
+LoadSheddingMiddleware answers 503 with `Retry-After` while too many requests
+are in flight or the event loop is lagging, so overload degrades into fast
+refusals instead of timeouts.
+"""
+import json
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from cache import CacheUnavailable
+from metrics import REQUESTS_REJECTED, current_loop_lag
+
+logger = logging.getLogger(__name__)
+
+
+class RateRule(NamedTuple):
+    name: str
+    method: str  # "*" matches any method
+    path_prefix: str
+    capacity: float  # burst size, in requests
+    per_seconds: float  # time to refill a full bucket
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+
+def parse_rate_limits(spec: str) -> List[RateRule]:
+    """Parse "METHOD /path/prefix=N/SECONDS,..." (e.g. "POST /api/auth/login=5/60,* /api/admin/=120/60")"""
+    rules = []
+    for item in spec.split(","):
+        route, sep, budget = item.strip().rpartition("=")
+        if not sep or not route:
+            continue
+        method, _, prefix = route.strip().partition(" ")
+        count, _, seconds = budget.partition("/")
+        rules.append(RateRule(route.strip(), method.upper(), prefix.strip(), float(count), float(seconds or 1)))
+    return rules
+
+
+def _reply(detail: str, retry_after: float, extra_headers: Optional[list] = None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ] + (extra_headers or [])
+    return body, headers
+
+
+async def _send_reply(send, status: int, body: bytes, headers: list):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ---------------------------------------------------------------- stores
+
+class MemoryBucketStore:
+    """Token buckets in a dict (per process)"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self.max_keys = max_keys
+
+    async def take(self, key: str, rule: RateRule, cost: float = 1.0) -> Tuple[bool, float, float]:
+        """Charge `cost` tokens; returns (allowed, tokens left, seconds until `cost` tokens are available)"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (rule.capacity, now))
+        tokens = min(rule.capacity, tokens + (now - updated) * rule.refill_rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        if len(self._buckets) >= self.max_keys and key not in self._buckets:
+            self._prune(now)
+        self._buckets[key] = (tokens, now)
+        return allowed, tokens, 0.0 if allowed else (cost - tokens) / rule.refill_rate
+
+    def _prune(self, now: float):
+        # A bucket idle for longer than any refill window is full again and can be forgotten;
+        # if that frees nothing, drop the oldest half
+        idle = [k for k, (_, updated) in self._buckets.items() if now - updated > 3600]
+        if not idle:
+            idle = sorted(self._buckets, key=lambda k: self._buckets[k][1])[: len(self._buckets) // 2]
+        for k in idle:
+            del self._buckets[k]
+
+
+class MongoBucketStore:
+    """Token buckets shared by every worker, refilled and charged in one
+    server-side update pipeline. Expired buckets are removed by a TTL index."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rule: RateRule, cost: float = 1.0) -> Tuple[bool, float, float]:
+        now = time.time()
+        refilled = {"$min": [
+            rule.capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", rule.capacity]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, rule.refill_rate]},
+            ]},
+        ]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", cost]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", cost]}, {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=rule.per_seconds),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        allowed = bucket["allowed"]
+        return allowed, bucket["tokens"], 0.0 if allowed else (cost - bucket["tokens"]) / rule.refill_rate
+
+
+class CacheCounterStore:
+    """Fixed-window counters in the shared cache: up to `capacity` requests
+    per `per_seconds` window, counted with one atomic increment. Cheaper than
+    a token bucket, at the price of allowing a double burst across a window
+    boundary."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def take(self, key: str, rule: RateRule, cost: float = 1.0) -> Tuple[bool, float, float]:
+        now = time.time()
+        window = int(now // rule.per_seconds)
+        used = await self.cache.incr(f"ratelimit:{key}:{window}", math.ceil(cost), rule.per_seconds)
+        allowed = used <= rule.capacity
+        return allowed, max(0.0, rule.capacity - used), 0.0 if allowed else (window + 1) * rule.per_seconds - now
+
+
+# ---------------------------------------------------------------- middleware
+
+def client_ip(scope, trusted_proxies: int = 1) -> str:
+    """The address the nearest of `trusted_proxies` proxies saw the request come from.
+
+    Each proxy appends the address it received from to X-Forwarded-For, so
+    only the right-most `trusted_proxies` hops can be believed; anything left
+    of them was sent by the client. With 0 (no proxy) the socket peer is used.
+    """
+    hops = []
+    if trusted_proxies:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                hops.extend(h.strip() for h in value.decode("latin-1").split(","))
+    hops = [h for h in hops if h]
+    if len(hops) >= trusted_proxies > 0:
+        return hops[-trusted_proxies]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the first matching RateRule per request.
+
+    `identify(scope)` returns a stable client identity (e.g. "user:<id>") or
+    None to fall back to the client IP, taken from X-Forwarded-For as seen by
+    the `trusted_proxies` proxies in front of the app. Store errors fail open.
+    """
+
+    def __init__(self, app, rules: List[RateRule], store=None,
+                 identify: Optional[Callable[[dict], Optional[str]]] = None, trusted_proxies: int = 1):
+        self.app = app
+        self.rules = rules
+        self.store = store or MemoryBucketStore()
+        self.identify = identify
+        self.trusted_proxies = trusted_proxies
+
+    def _match(self, scope) -> Optional[RateRule]:
+        for rule in self.rules:
+            if rule.method in ("*", scope["method"]) and scope["path"].startswith(rule.path_prefix):
+                return rule
+        return None
+
+    async def __call__(self, scope, receive, send):
+        rule = self._match(scope) if scope["type"] == "http" and scope["method"] != "OPTIONS" else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        identity = (self.identify(scope) if self.identify else None) or f"ip:{client_ip(scope, self.trusted_proxies)}"
+        try:
+            allowed, remaining, retry_after = await self.store.take(f"{rule.name}|{identity}", rule)
+        except (PyMongoError, CacheUnavailable):
+            logger.warning("Rate limit store unavailable; allowing request", exc_info=True)
+            await self.app(scope, receive, send)
+            return
+
+        if not allowed:
+            REQUESTS_REJECTED.labels("rate_limited", rule.name).inc()
+            body, headers = _reply("Too many requests", retry_after,
+                                   [(b"x-ratelimit-limit", str(int(rule.capacity)).encode()),
+                                    (b"x-ratelimit-remaining", b"0")])
+            await _send_reply(send, 429, body, headers)
+            return
+        await self.app(scope, receive, send)
+
+
+class LoadSheddingMiddleware:
+    """ASGI middleware refusing new work with 503 while the worker is overloaded.
+
+    Limits of 0 disable a check; `exempt_paths` (health checks, metrics) are
+    always served. Long-lived streams (paths ending in one of `stream_suffixes`,
+    e.g. waiting-room events) mostly sit idle, so they don't count as in flight;
+    they have their own cap, `max_streams`, instead.
+    """
+
+    def __init__(self, app, max_in_flight: int = 0, max_loop_lag: float = 0.0,
+                 exempt_paths: Tuple[str, ...] = ("/api/health", "/metrics"), retry_after: float = 1.0,
+                 stream_suffixes: Tuple[str, ...] = (), max_streams: int = 0):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag
+        self.exempt_paths = exempt_paths
+        self.retry_after = retry_after
+        self.stream_suffixes = stream_suffixes
+        self.max_streams = max_streams
+        self.in_flight = 0
+        self.streams = 0
+
+    def _overloaded(self) -> Optional[str]:
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        if self.max_loop_lag and current_loop_lag() >= self.max_loop_lag:
+            return "loop_lag"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        if self.stream_suffixes and scope["path"].endswith(self.stream_suffixes):
+            await self._stream(scope, receive, send)
+            return
+
+        reason = self._overloaded()
+        if reason:
+            REQUESTS_REJECTED.labels(reason, "").inc()
+            body, headers = _reply("Server busy, retry shortly", self.retry_after)
+            await _send_reply(send, 503, body, headers)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, scope, receive, send):
+        if self.max_streams and self.streams >= self.max_streams:
+            REQUESTS_REJECTED.labels("streams", "").inc()
+            body, headers = _reply("Too many open streams, poll instead", self.retry_after)
+            await _send_reply(send, 503, body, headers)
+            return
+        self.streams += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.streams -= 1
@@ -0,0 +1,308 @@
+"""Deadlines, retries and circuit breaking.
+
+DeadlineMiddleware gives every request a time budget picked by route. The
+deadline is pushed down to MongoDB as a client-side operation timeout
+(`pymongo.timeout`, sent as `maxTimeMS`), so the server stops working on a
+request nobody is waiting for, and it caps the per-call timeout of upstream
+calls made while serving the request.
+
+ReadRetry retries idempotent MongoDB reads through a failover (an Atlas
+primary election, a dropped connection) with jittered exponential backoff,
+for as long as the request's deadline leaves room.
+
+Each dependency (Stripe, the OAuth provider) gets an `Upstream` that runs
+every call under a deadline, retries transient failures with jittered
+exponential backoff while a retry budget allows it, and stops calling the
+service for a while once consecutive failures trip its circuit breaker, so a
+degraded provider costs a fast 503 instead of a pile of stuck requests.
+"""
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from fnmatch import fnmatchcase
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Tuple, Type, TypeVar
+
+import pymongo
+from pymongo.errors import AutoReconnect, OperationFailure, PyMongoError
+
+from metrics import MONGO_READ_RETRIES, UPSTREAM_BREAKER_STATE, UPSTREAM_CALLS_REJECTED, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+# ---------------------------------------------------------------- request deadlines
+
+class RouteDeadline(NamedTuple):
+    method: str  # "*" matches any method
+    path_pattern: str  # fnmatch pattern; "*" also matches "/"
+    seconds: float  # 0 means no deadline (streams, long-running admin work)
+
+
+def parse_deadlines(spec: str) -> List[RouteDeadline]:
+    """Parse "METHOD /path/pattern=SECONDS,..." (e.g. "GET /api/admin/analytics=30,* /api/*/events=0")"""
+    rules = []
+    for item in spec.split(","):
+        route, sep, seconds = item.strip().rpartition("=")
+        if not sep or not route:
+            continue
+        method, _, pattern = route.strip().partition(" ")
+        rules.append(RouteDeadline(method.upper(), pattern.strip(), float(seconds)))
+    return rules
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline (None without one)"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def outside_deadline(fn: Callable[[], Awaitable[T]]) -> T:
+    """Await `fn()` free of the request's deadline and of client disconnects.
+
+    For compensating writes (releasing a reservation, refunding a debit) that
+    must still happen after the request itself ran out of time.
+    """
+    async def _run():
+        return await fn()
+
+    return await asyncio.shield(asyncio.create_task(_run(), context=contextvars.Context()))
+
+
+class DeadlineMiddleware:
+    """ASGI middleware running each request under the budget of the first
+    matching RouteDeadline (or `default_seconds`).
+
+    MongoDB operations past the deadline fail with a PyMongoError whose
+    `timeout` is true; server.py maps those to 504 in one place. Streaming
+    responses are produced inside the deadline too, so give them a budget of 0.
+    """
+
+    def __init__(self, app, rules: List[RouteDeadline], default_seconds: float = 0.0):
+        self.app = app
+        self.rules = rules
+        self.default_seconds = default_seconds
+
+    def _budget(self, scope) -> float:
+        for rule in self.rules:
+            if rule.method in ("*", scope["method"]) and fnmatchcase(scope["path"], rule.path_pattern):
+                return rule.seconds
+        return self.default_seconds
+
+    async def __call__(self, scope, receive, send):
+        seconds = self._budget(scope) if scope["type"] == "http" else 0
+        if not seconds:
+            await self.app(scope, receive, send)
+            return
+
+        token = _deadline.set(time.monotonic() + seconds)
+        try:
+            with pymongo.timeout(seconds):
+                await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+class CircuitOpenError(Exception):
+    """The upstream's circuit is open; the call was not attempted"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} circuit open")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after
+    `reset_timeout` seconds one trial call is let through (half-open) and its
+    outcome closes or re-opens the circuit."""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: int):
+        self.state = state
+        UPSTREAM_BREAKER_STATE.labels(self.name).set(state)
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.trial_in_flight = False
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed", extra={"upstream": self.name})
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Circuit opened", extra={"upstream": self.name, "failures": self.failures})
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+class RetryBudget:
+    """Caps retries at `ratio` of calls (plus `min_per_second`), so retries
+    can't multiply load on an upstream that is already struggling"""
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def deposit(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Upstream:
+    """Call policy for one external dependency.
+
+    `retry_on` lists exception types worth retrying (transient: timeouts,
+    connection errors, 5xx); those also count as failures for the breaker.
+    Any other exception means the upstream answered, and is raised as is.
+    """
+
+    def __init__(self, name: str, timeout: float, max_attempts: int = 3, base_delay: float = 0.2,
+                 max_delay: float = 2.0, retry_on: Tuple[Type[BaseException], ...] = (),
+                 breaker: Optional[CircuitBreaker] = None, budget: Optional[RetryBudget] = None):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = (asyncio.TimeoutError,) + tuple(retry_on)
+        self.breaker = breaker or CircuitBreaker(name)
+        self.budget = budget or RetryBudget()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], retry: bool = True) -> T:
+        """Run `fn()` under the call timeout, capped by the request deadline,
+        retrying transient failures (unless `retry` is False)"""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            left = remaining_time()
+            if left is not None and left <= 0:
+                raise asyncio.TimeoutError()
+            if not self.breaker.allow():
+                UPSTREAM_CALLS_REJECTED.labels(self.name, "circuit_open").inc()
+                raise CircuitOpenError(self.name, self.breaker.retry_after())
+            attempt += 1
+            timeout = self.timeout if left is None else min(self.timeout, left)
+            try:
+                result = await asyncio.wait_for(fn(), timeout=timeout)
+            except self.retry_on as e:
+                if isinstance(e, asyncio.TimeoutError) and timeout < self.timeout:
+                    # The request ran out of time, not the upstream
+                    self.breaker.trial_in_flight = False
+                    raise
+                self.breaker.record_failure()
+                if not retry or attempt >= self.max_attempts:
+                    raise
+                if not self.budget.withdraw():
+                    UPSTREAM_CALLS_REJECTED.labels(self.name, "retry_budget").inc()
+                    raise
+            except BaseException:
+                # The upstream answered (e.g. a 4xx) or we were cancelled: not its fault
+                self.breaker.trial_in_flight = False
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+            UPSTREAM_RETRIES.labels(self.name).inc()
+            # Full jitter: sleep a random time up to the exponential backoff
+            await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+
+
+# ---------------------------------------------------------------- MongoDB reads
+
+# Server error codes seen while a replica set changes primary or shuts a node
+# down (the ones the driver itself treats as retryable)
+_TRANSIENT_ERROR_CODES = frozenset({6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436, 134})
+
+
+def is_transient(exc: PyMongoError) -> bool:
+    """Whether retrying the same read shortly could succeed"""
+    if exc.timeout:
+        # The deadline (or server selection) already used up the time
+        return False
+    if isinstance(exc, AutoReconnect):
+        return True
+    return isinstance(exc, OperationFailure) and exc.code in _TRANSIENT_ERROR_CODES
+
+
+class ReadRetry:
+    """Retry policy for idempotent MongoDB reads.
+
+    `call(operation, fn)` re-runs `fn()` (which must build a fresh cursor or
+    command each time) after transient errors, sleeping a jittered
+    exponential backoff between attempts. It gives up after `max_attempts` or
+    when the next sleep would outlast the request's deadline, and raises the
+    last error.
+    """
+
+    def __init__(self, max_attempts: int = 10, base_delay: float = 0.1, max_delay: float = 2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def call(self, operation: str, fn: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await fn()
+            except PyMongoError as e:
+                if not is_transient(e):
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                left = remaining_time()
+                if attempt >= self.max_attempts or (left is not None and left <= delay):
+                    MONGO_READ_RETRIES.labels(operation, "exhausted").inc()
+                    logger.warning("Read %s failed after %d attempts", operation, attempt,
+                                   extra={"operation": operation, "attempts": attempt})
+                    raise
+            MONGO_READ_RETRIES.labels(operation, "retry").inc()
+            await asyncio.sleep(delay)
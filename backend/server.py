@@ -1,4 +1,5 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, File, UploadFile, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -7,8 +8,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, field_validator
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
@@ -19,9 +20,42 @@ import aiofiles
 import string
 import httpx
 import asyncio
-from pymongo.errors import ServerSelectionTimeoutError
-from pymongo.errors import PyMongoError, AutoReconnect
+import contextvars
+import stripe
+import csv
+import io
+import zlib
+import heapq
+import time
+import secrets
+import hashlib
+from bson import ObjectId
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from pymongo.errors import PyMongoError, BulkWriteError, DuplicateKeyError
+from pymongo import InsertOne, UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 from starlette.responses import StreamingResponse
+from metrics import (
+    DbTimingMiddleware,
+    MetricsMiddleware,
+    MongoCommandMetrics,
+    monitor_event_loop_lag,
+    render_metrics,
+    track_stripe,
+)
+from cache import Cache, MemoryBackend, RedisBackend
+from coalesce import SingleFlight
+from resilience import CircuitOpenError, DeadlineMiddleware, ReadRetry, Upstream, outside_deadline, parse_deadlines
+from logging_config import AccessLogMiddleware, configure_logging, parse_sample_rates
+from ratelimit import (
+    CacheCounterStore,
+    LoadSheddingMiddleware,
+    MemoryBucketStore,
+    MongoBucketStore,
+    RateLimitMiddleware,
+    parse_rate_limits,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -33,9 +67,71 @@ client = AsyncIOMotorClient(
     serverSelectionTimeoutMS=5000,
     connectTimeoutMS=5000,
     socketTimeoutMS=15000,
+    # SLOW_QUERY_MS > 0 logs the shape of any command slower than that
+    event_listeners=[MongoCommandMetrics(slow_query_ms=float(os.environ.get("SLOW_QUERY_MS", "0")))],
 )
 db = client[os.environ['DB_NAME']]
 
+# Idempotent reads ride out failovers (primary elections, dropped connections)
+# by retrying with backoff while the request's deadline allows
+db_reads = ReadRetry(max_attempts=int(os.environ.get("MONGO_READ_RETRY_ATTEMPTS", "10")))
+
+# Read routing: "ROUTE=MODE[:READ_CONCERN],..." per group of read-heavy routes.
+# Reporting reads go to secondaries (no staler than READ_MAX_STALENESS_SECONDS,
+# at least 90) so they don't compete with checkout writes; anything not listed
+# (auth, balances, orders) reads from the primary.
+READ_ROUTING = os.environ.get(
+    "READ_ROUTING",
+    "catalog=secondaryPreferred:local,winners=secondaryPreferred:local,"
+    "analytics=secondaryPreferred:local,exports=secondaryPreferred:local",
+)
+READ_MAX_STALENESS_SECONDS = int(os.environ.get("READ_MAX_STALENESS_SECONDS", "90"))
+
+
+def _parse_read_routing(spec: str) -> Dict[str, tuple]:
+    routes = {}
+    for item in spec.split(","):
+        route, sep, options = item.strip().partition("=")
+        if not sep:
+            continue
+        mode_name, _, level = options.strip().partition(":")
+        mode = read_pref_mode_from_name(mode_name.strip())
+        routes[route.strip()] = (
+            make_read_preference(mode, None, -1 if mode == 0 else READ_MAX_STALENESS_SECONDS),
+            ReadConcern(level.strip() or None),
+        )
+    return routes
+
+
+_read_routes = _parse_read_routing(READ_ROUTING)
+_read_handles: Dict[str, tuple] = {}
+
+
+def read_db(route: str):
+    """`db` with the read preference and read concern configured for `route`"""
+    options = _read_routes.get(route)
+    if options is None:
+        return db
+    cached = _read_handles.get(route)
+    if cached is None or cached[0] is not db:
+        read_preference, read_concern = options
+        cached = _read_handles[route] = (db, db.with_options(read_preference=read_preference, read_concern=read_concern))
+    return cached[1]
+
+# Shared cache: CACHE_URL=redis://... keeps entries in Redis for every worker,
+# otherwise each worker caches in its own memory. Workers keep hot entries
+# for CACHE_LOCAL_TTL_SECONDS and drop them on pub/sub invalidations.
+CACHE_URL = os.environ.get("CACHE_URL", "")
+cache = Cache(
+    RedisBackend.from_url(CACHE_URL) if CACHE_URL else MemoryBackend(),
+    prefix=os.environ.get("CACHE_PREFIX", "grab"),
+    local_ttl=float(os.environ.get("CACHE_LOCAL_TTL_SECONDS", "1")) if CACHE_URL else 0.0,
+)
+# Listings and competition documents; any competition change drops the lot
+competition_cache = cache.namespace("competitions", ttl=float(os.environ.get("COMPETITION_CACHE_TTL_SECONDS", "15")))
+# Users resolved from sessions/JWTs, dropped whenever their profile or balance changes
+user_cache = cache.namespace("users", ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "30")))
+
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'fallback_secret')
 JWT_ALGORITHM = "HS256"
@@ -47,9 +143,58 @@ ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'Olivia1josh2')
 # Stripe Configuration
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', 'sk_test_emergent')
 
+# Upstream call policies: a deadline per call, jittered retries of transient
+# failures within a retry budget, and a circuit breaker per dependency
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get("STRIPE_TIMEOUT_SECONDS", "10"))
+OAUTH_TIMEOUT_SECONDS = float(os.environ.get("OAUTH_TIMEOUT_SECONDS", "5"))
+# The SDK blocks a worker thread; give up on the socket when we give up on the call
+stripe.default_http_client = stripe.http_client.new_default_http_client(timeout=STRIPE_TIMEOUT_SECONDS)
+stripe_upstream = Upstream(
+    "stripe",
+    timeout=STRIPE_TIMEOUT_SECONDS,
+    retry_on=(stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError),
+)
+oauth_upstream = Upstream(
+    "oauth",
+    timeout=OAUTH_TIMEOUT_SECONDS,
+    retry_on=(httpx.TransportError, httpx.HTTPStatusError),
+)
+
+
+async def stripe_call(operation: str, fn, *args, **kwargs):
+    """Run a blocking Stripe SDK call in a thread under the Stripe call policy"""
+    async def _attempt():
+        with track_stripe(operation):
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    return await stripe_upstream.call(_attempt)
+
+
+def _upstream_unavailable(e: CircuitOpenError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Payment provider temporarily unavailable" if e.upstream == "stripe" else "Sign-in provider temporarily unavailable",
+        headers={"Retry-After": str(max(1, int(e.retry_after)))},
+    )
+
 # Create the main app
 app = FastAPI(title="Grab Competitions API")
 
+
+@app.exception_handler(PyMongoError)
+async def database_error_handler(request: Request, exc: PyMongoError):
+    """One mapping for database failures a handler didn't deal with itself"""
+    if isinstance(exc, ServerSelectionTimeoutError):
+        return JSONResponse({"detail": "Database unavailable"}, status_code=503, headers={"Retry-After": "1"})
+    if exc.timeout:
+        # Request deadline spent (maxTimeMS) or the server stopped answering
+        return JSONResponse({"detail": "Database timeout"}, status_code=504)
+    if isinstance(exc, ConnectionFailure):
+        return JSONResponse({"detail": "Database unavailable"}, status_code=503, headers={"Retry-After": "1"})
+    logging.exception("Unhandled database error", exc_info=exc)
+    return JSONResponse({"detail": f"Database error: {type(exc).__name__}"}, status_code=500)
+
+
 APP_VERSION = os.environ.get("RENDER_GIT_COMMIT") or os.environ.get("GIT_COMMIT") or "unknown"
 
 # Create a router with the /api prefix
@@ -153,7 +298,7 @@ class Order(BaseModel):
     ticket_count: int
     amount: float
     balance_used: float = 0.0
-    status: str = "pending"  # pending, completed, failed, refunded
+    status: str = "pending"  # pending, completed, failed, expired, refunded
     stripe_session_id: Optional[str] = None
     tickets: List[str] = []
     created_at: datetime
@@ -203,6 +348,18 @@ def create_jwt_token(user_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# Concurrent requests for the same user share one users lookup
+_user_lookups = SingleFlight("user")
+
+
+async def _find_user(user_id: str) -> Optional[dict]:
+    async def _load():
+        user_doc = await db_reads.call("user", lambda: db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0}))
+        return jsonable_encoder(user_doc)
+
+    return await _user_lookups.do(user_id, lambda: user_cache.get_or_load(user_id, _load))
+
+
 async def get_current_user(request: Request, credentials=Depends(security)) -> Optional[User]:
     """Get current user from JWT token (cookie or header)"""
     token = None
@@ -222,11 +379,9 @@ async def get_current_user(request: Request, credentials=Depends(security)) -> O
             if expires_at.tzinfo is None:
                 expires_at = expires_at.replace(tzinfo=timezone.utc)
             if expires_at > datetime.now(timezone.utc):
-                user_doc = await db.users.find_one(
-                    {"user_id": session_doc["user_id"]},
-                    {"_id": 0}
-                )
+                user_doc = await _find_user(session_doc["user_id"])
                 if user_doc:
+                    request.state.user_id = user_doc["user_id"]
                     return User(**user_doc)
         token = session_token
     
@@ -239,11 +394,9 @@ async def get_current_user(request: Request, credentials=Depends(security)) -> O
     
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_doc = await db.users.find_one(
-            {"user_id": payload["user_id"]},
-            {"_id": 0}
-        )
+        user_doc = await _find_user(payload["user_id"])
         if user_doc:
+            request.state.user_id = user_doc["user_id"]
             return User(**user_doc)
     except jwt.ExpiredSignatureError:
         pass
@@ -265,6 +418,30 @@ async def require_admin(password: str):
         raise HTTPException(status_code=403, detail="Invalid admin password")
 
 
+def build_competition_doc(data: CompetitionCreate) -> dict:
+    """Build a new competition document from validated admin input"""
+    return {
+        "competition_id": f"comp_{uuid.uuid4().hex[:12]}",
+        "title": data.title,
+        "description": data.description,
+        "prize_type": data.prize_type,
+        "prize_value": data.prize_value,
+        "prize_image": data.prize_image,
+        "ticket_price": data.ticket_price,
+        "total_tickets": data.total_tickets,
+        "sold_tickets": 0,
+        "max_tickets_per_user": data.max_tickets_per_user,
+        "end_date": data.end_date.isoformat(),
+        "status": "active",
+        "is_instant_win": data.is_instant_win,
+        "instant_win_prizes": data.instant_win_prizes,
+        "facebook_live_url": data.facebook_live_url,
+        "winner_id": None,
+        "draw_date": None,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
 def _get_admin_password(password: str | None, x_admin_password: str | None) -> str:
     pw = x_admin_password or password
     if not pw:
@@ -272,6 +449,35 @@ def _get_admin_password(password: str | None, x_admin_password: str | None) -> s
     return pw
 
 
+# Every change to users.balance is also appended to `balance_ledger`, right
+# after the balance update. users.balance stays the one-document read for the
+# current balance; the ledger gives statements, periodic per-user snapshots and
+# a reconciliation job that reports users whose balance and ledger disagree.
+def balance_entry(user_id: str, amount: float, kind: str, ref: Optional[str] = None,
+                  entry_id: Optional[str] = None) -> dict:
+    """A ledger movement; pass a deterministic `entry_id` where the write may be replayed"""
+    return {
+        "entry_id": entry_id or f"bal_{uuid.uuid4().hex[:16]}",
+        "user_id": user_id,
+        "amount": round(amount, 2),
+        "kind": kind,  # admin_credit, order, order_rollback, competition_refund, opening_balance
+        "ref": ref,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def record_balance_changes(entries: List[dict]):
+    """Append ledger movements, skipping any already recorded under the same entry_id"""
+    if not entries:
+        return
+    await user_cache.invalidate(*{entry["user_id"] for entry in entries})
+    try:
+        await db.balance_ledger.insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
 # ====================== AUTH ROUTES ======================
 
 @api_router.post("/auth/register")
@@ -352,16 +558,28 @@ async def process_session(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="session_id required")
     
     # Call Emergent auth endpoint
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id}
-        )
-        
-        if resp.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid session")
-        
-        oauth_data = resp.json()
+    async def _fetch_session_data():
+        async with httpx.AsyncClient(timeout=OAUTH_TIMEOUT_SECONDS) as client:
+            resp = await client.get(
+                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+                headers={"X-Session-ID": session_id}
+            )
+        if resp.status_code >= 500:
+            resp.raise_for_status()  # retried
+        return resp
+    
+    try:
+        resp = await oauth_upstream.call(_fetch_session_data)
+    except CircuitOpenError as e:
+        raise _upstream_unavailable(e)
+    except (asyncio.TimeoutError, httpx.HTTPError):
+        logging.exception("OAuth session-data call failed")
+        raise HTTPException(status_code=502, detail="Sign-in provider error")
+    
+    if resp.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    
+    oauth_data = resp.json()
     
     email = oauth_data.get("email")
     name = oauth_data.get("name")
@@ -378,6 +596,7 @@ async def process_session(request: Request, response: Response):
             {"user_id": user_id},
             {"$set": {"name": name, "picture": picture}}
         )
+        await user_cache.invalidate(user_id)
     else:
         user_id = f"user_{uuid.uuid4().hex[:12]}"
         user_doc = {
@@ -481,24 +700,33 @@ async def get_competitions(
     
     sort_by = sort_options.get(sort, [("created_at", -1)])
     
-    competitions = await db.competitions.find(query, {"_id": 0}).sort(sort_by).to_list(100)
-    
-    # Convert datetime strings
-    for comp in competitions:
-        if isinstance(comp.get("end_date"), str):
-            comp["end_date"] = datetime.fromisoformat(comp["end_date"])
-        if isinstance(comp.get("created_at"), str):
-            comp["created_at"] = datetime.fromisoformat(comp["created_at"])
+    async def _load():
+        competitions = await db_reads.call(
+            "competitions", lambda: read_db("catalog").competitions.find(query, {"_id": 0}).sort(sort_by).to_list(100)
+        )
+        
+        # Convert datetime strings
+        for comp in competitions:
+            if isinstance(comp.get("end_date"), str):
+                comp["end_date"] = datetime.fromisoformat(comp["end_date"])
+            if isinstance(comp.get("created_at"), str):
+                comp["created_at"] = datetime.fromisoformat(comp["created_at"])
+        
+        return jsonable_encoder(competitions)
     
-    return competitions
+    key = f"list:{status or ''}:{prize_type or ''}:{sort}"
+    return await _catalog_reads.do(key, lambda: competition_cache.get_or_load(key, _load))
 
-@api_router.get("/competitions/featured")
-async def get_featured_competitions():
-    """Get featured active competitions"""
-    competitions = await db.competitions.find(
+# Launch traffic asks for the same few documents at once; coalesce those reads
+# (results are shared between callers, so handlers must not mutate them)
+_catalog_reads = SingleFlight("catalog")
+
+
+async def _load_featured_competitions() -> List[dict]:
+    competitions = await db_reads.call("featured", lambda: read_db("catalog").competitions.find(
         {"status": "active"},
         {"_id": 0}
-    ).sort([("prize_value", -1)]).limit(6).to_list(6)
+    ).sort([("prize_value", -1)]).limit(6).to_list(6))
     
     for comp in competitions:
         if isinstance(comp.get("end_date"), str):
@@ -506,22 +734,33 @@ async def get_featured_competitions():
         if isinstance(comp.get("created_at"), str):
             comp["created_at"] = datetime.fromisoformat(comp["created_at"])
     
-    return competitions
+    return jsonable_encoder(competitions)
+
+@api_router.get("/competitions/featured")
+async def get_featured_competitions():
+    """Get featured active competitions"""
+    return await _catalog_reads.do(
+        "featured", lambda: competition_cache.get_or_load("featured", _load_featured_competitions)
+    )
 
 @api_router.get("/competitions/{competition_id}")
 async def get_competition(competition_id: str):
     """Get single competition details"""
-    try:
-        competition = await asyncio.wait_for(
-            db.competitions.find_one({"competition_id": competition_id}, {"_id": 0}),
-            timeout=10,
+    async def _load():
+        competition = await db_reads.call(
+            "competition", lambda: read_db("catalog").competitions.find_one({"competition_id": competition_id}, {"_id": 0})
         )
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Database timeout while loading competition")
-    except ServerSelectionTimeoutError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except PyMongoError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
+        if competition is None and read_db("catalog") is not db:
+            # Just created, and the secondary hasn't caught up yet?
+            competition = await db_reads.call(
+                "competition", lambda: db.competitions.find_one({"competition_id": competition_id}, {"_id": 0})
+            )
+        return competition
+
+    competition = await _catalog_reads.do(
+        ("competition", competition_id),
+        lambda: competition_cache.get_or_load(f"id:{competition_id}", _load),
+    )
     
     if not competition:
         raise HTTPException(status_code=404, detail="Competition not found")
@@ -530,13 +769,229 @@ async def get_competition(competition_id: str):
 
 # ====================== TICKET & ORDER ROUTES ======================
 
+# max_tickets_per_user is enforced by a ledger in `ticket_entitlements`: one
+# document per (user_id, competition_id) counting tickets held or reserved by
+# pending orders. An order reserves its tickets with a conditional $inc that
+# only matches below the cap, and gives them back if it fails or expires.
+async def reserve_entitlement(user_id: str, competition_id: str, count: int, cap: int) -> Optional[int]:
+    """Reserve `count` tickets against the per-user cap.
+
+    Returns None if reserved, otherwise how many the user already holds.
+    """
+    key = {"user_id": user_id, "competition_id": competition_id}
+    for _ in range(2):
+        result = await db.ticket_entitlements.update_one(
+            {**key, "reserved": {"$lte": cap - count}},
+            {"$inc": {"reserved": count}},
+        )
+        if result.modified_count:
+            return None
+        entitlement = await db.ticket_entitlements.find_one(key, {"_id": 0, "reserved": 1})
+        if entitlement is not None:
+            return entitlement["reserved"]
+        # First order here since the ledger was introduced: open it at the tickets already held,
+        # which can't be counted while some are still legacy per-ticket documents
+        if await legacy_tickets_pending(competition_id):
+            raise _legacy_migration_in_progress()
+        held = await db.ticket_buckets.aggregate([
+            {"$match": key},
+            {"$group": {"_id": None, "count": {"$sum": "$ticket_count"}}},
+        ]).to_list(1)
+        try:
+            await db.ticket_entitlements.insert_one({**key, "reserved": held[0]["count"] if held else 0})
+        except DuplicateKeyError:
+            pass  # a concurrent order opened it
+    return cap
+
+
+async def legacy_tickets_pending(competition_id: str) -> bool:
+    """True while the bucket_legacy_tickets job still has per-ticket documents for this competition"""
+    return await db.tickets.find_one({"competition_id": competition_id}, {"_id": 1}) is not None
+
+
+def _legacy_migration_in_progress() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Tickets for this competition are still being migrated; try again shortly",
+        headers={"Retry-After": "30"},
+    )
+
+
+async def release_entitlement(user_id: str, competition_id: str, count: int):
+    await outside_deadline(lambda: db.ticket_entitlements.update_one(
+        {"user_id": user_id, "competition_id": competition_id},
+        {"$inc": {"reserved": -count}},
+    ))
+
+
+async def record_ticket_sale(competition_id: str, count: int) -> Optional[dict]:
+    """Add `count` to sold_tickets and mark the competition sold out once it
+    reaches total_tickets, in one server-side update (every sales path uses this)"""
+    competition = await db.competitions.find_one_and_update(
+        {"competition_id": competition_id},
+        [
+            {"$set": {"sold_tickets": {"$add": ["$sold_tickets", count]}}},
+            {"$set": {"status": {"$cond": [
+                {"$and": [{"$eq": ["$status", "active"]}, {"$gte": ["$sold_tickets", "$total_tickets"]}]},
+                "sold_out",
+                "$status",
+            ]}}},
+        ],
+        projection={"_id": 0, "status": 1, "sold_tickets": 1, "total_tickets": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if (competition and competition["status"] == "sold_out"
+            and competition["sold_tickets"] - count < competition["total_tickets"]):
+        logger.info("Competition sold out", extra={"event": "competition.sold_out", "competition_id": competition_id})
+        await competition_cache.invalidate_all()
+    return competition
+
+
+async def close_pending_order(order_id: str, status: str) -> bool:
+    """Move a pending order to `status` (failed, expired) and release its reservation.
+
+    Returns False if the order was no longer pending. Runs outside the request
+    deadline, since it is how a failed request undoes its reservation.
+    """
+    order = await outside_deadline(lambda: db.orders.find_one_and_update(
+        {"order_id": order_id, "status": "pending"},
+        {"$set": {"status": status}},
+        projection={"_id": 0, "user_id": 1, "competition_id": 1, "ticket_count": 1},
+    ))
+    if order is None:
+        return False
+    await release_entitlement(order["user_id"], order["competition_id"], order["ticket_count"])
+    return True
+
+
+# Idempotency-Key support for /orders/create. The first request with a key
+# claims it in `idempotency_keys` (in flight, with a lease) and stores its
+# response when done; repeats wait for that response and replay it instead of
+# creating another order and Checkout Session. Keys are scoped per user and
+# expire through a TTL index.
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_LEASE_SECONDS = 60  # an in-flight claim older than this is taken over (worker died)
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "20"))
+# Refusals that change with time (still queued, in progress, rate limited): a
+# retry with the same key must get a fresh answer, so they are not stored
+IDEMPOTENCY_RETRYABLE_STATUSES = {403, 409, 429}
+
+
+async def _claim_idempotency_key(key: str, fingerprint: str) -> Optional[dict]:
+    """Claim `key` for this request; returns None if claimed, else the stored record"""
+    now = datetime.now(timezone.utc)
+    record = {
+        "key": key,
+        "fingerprint": fingerprint,
+        "status": "in_flight",
+        "response": None,
+        "lease_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+        "created_at": now.isoformat(),
+        "expires_at": now + timedelta(seconds=IDEMPOTENCY_KEY_TTL_SECONDS),
+    }
+    try:
+        await db.idempotency_keys.insert_one(record)
+        return None
+    except DuplicateKeyError:
+        pass
+    # Take over a claim whose owner stopped renewing it
+    taken = await db.idempotency_keys.update_one(
+        {"key": key, "fingerprint": fingerprint, "status": "in_flight", "lease_until": {"$lt": now}},
+        {"$set": {"lease_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+    )
+    if taken.modified_count:
+        return None
+    return await db.idempotency_keys.find_one({"key": key}, {"_id": 0})
+
+
+async def _await_idempotent_response(key: str, record: dict, fingerprint: str) -> JSONResponse:
+    """Wait for the request holding `key` to finish and replay its response"""
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.05
+    while record and record["status"] == "in_flight":
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        record = await db.idempotency_keys.find_one({"key": key}, {"_id": 0})
+    if record is None:
+        # The original failed and released the key; let the client retry
+        raise HTTPException(status_code=409, detail="The original request with this Idempotency-Key failed; retry")
+    response = record["response"]
+    headers = {**(response.get("headers") or {}), "Idempotent-Replayed": "true"}
+    return JSONResponse(response["body"], status_code=response["status_code"], headers=headers)
+
+
+async def _renew_idempotency_lease(key: str):
+    """Keep extending the claim on `key` while its request is still working (e.g. a slow Stripe call)"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+        try:
+            await outside_deadline(lambda: db.idempotency_keys.update_one(
+                {"key": key, "status": "in_flight"},
+                {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+            ))
+        except PyMongoError:
+            logger.warning("Could not renew the lease on Idempotency-Key %s", key, exc_info=True)
+
+
+async def _complete_idempotency_key(key: str, response: dict):
+    # The work is done by now; record it even if the request's deadline is spent
+    await outside_deadline(lambda: db.idempotency_keys.update_one(
+        {"key": key}, {"$set": {"status": "completed", "response": response}}
+    ))
+
+
 @api_router.post("/orders/create")
 async def create_order(
     request: Request,
     data: OrderCreate,
-    user: User = Depends(require_auth)
+    user: User = Depends(require_auth),
+    x_waiting_room_token: str | None = Header(default=None, alias="X-Waiting-Room-Token"),
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
 ):
-    """Create an order and initiate payment"""
+    """Create an order and initiate payment (repeats with the same Idempotency-Key replay the first response)"""
+    if not idempotency_key:
+        return await _place_order(request, data, user, x_waiting_room_token, None)
+
+    key = f"{user.user_id}:{idempotency_key}"
+    fingerprint = f"{data.competition_id}:{data.ticket_count}:{data.use_balance}"
+    record = await _claim_idempotency_key(key, fingerprint)
+    if record is not None:
+        return await _await_idempotent_response(key, record, fingerprint)
+
+    renewal = asyncio.create_task(_renew_idempotency_lease(key))
+    try:
+        result = await _place_order(request, data, user, x_waiting_room_token, key)
+        response = {"status_code": 200, "body": jsonable_encoder(result)}
+    except HTTPException as e:
+        if e.status_code >= 500 or e.status_code in IDEMPOTENCY_RETRYABLE_STATUSES:
+            await outside_deadline(lambda: db.idempotency_keys.delete_one({"key": key}))
+            raise
+        # Validation-style client errors are final answers: a retry gets the same one
+        response = {"status_code": e.status_code, "body": {"detail": e.detail}, "headers": e.headers}
+        await _complete_idempotency_key(key, response)
+        raise
+    except BaseException:
+        await outside_deadline(lambda: db.idempotency_keys.delete_one({"key": key}))
+        raise
+    finally:
+        renewal.cancel()
+
+    await _complete_idempotency_key(key, response)
+    return result
+
+
+async def _place_order(
+    request: Request,
+    data: OrderCreate,
+    user: User,
+    waiting_room_token: Optional[str],
+    idempotency_key: Optional[str],
+) -> dict:
+    """Create an order and initiate payment; returns the response body"""
     if not STRIPE_API_KEY or STRIPE_API_KEY.strip() in {"", "sk_test_emergent"}:
         raise HTTPException(status_code=503, detail="Payments are not configured (missing STRIPE_API_KEY)")
     
@@ -549,9 +1004,20 @@ async def create_order(
     if not competition:
         raise HTTPException(status_code=404, detail="Competition not found")
     
+    order_id = _order_id_for(idempotency_key)
+    if idempotency_key:
+        existing = await db.orders.find_one(
+            {"order_id": order_id, "status": {"$in": ["pending", "completed"]}}, {"_id": 0}
+        )
+        if existing:
+            # An earlier holder of this key got this far before it went away
+            return await _resume_order(request, data, competition, existing, idempotency_key)
+    
     if competition["status"] != "active":
         raise HTTPException(status_code=400, detail="Competition is not active")
     
+    await require_admission(competition, user.user_id, waiting_room_token)
+    
     available_tickets = competition["total_tickets"] - competition["sold_tickets"]
     if data.ticket_count > available_tickets:
         raise HTTPException(status_code=400, detail=f"Only {available_tickets} tickets available")
@@ -559,13 +1025,11 @@ async def create_order(
     if data.ticket_count > competition["max_tickets_per_user"]:
         raise HTTPException(status_code=400, detail=f"Maximum {competition['max_tickets_per_user']} tickets per user")
     
-    # Check user's existing tickets for this competition
-    user_ticket_count = await db.tickets.count_documents({
-        "user_id": user.user_id,
-        "competition_id": data.competition_id
-    })
-    
-    if user_ticket_count + data.ticket_count > competition["max_tickets_per_user"]:
+    # Reserve against the user's per-competition cap (released if the order fails)
+    user_ticket_count = await reserve_entitlement(
+        user.user_id, data.competition_id, data.ticket_count, competition["max_tickets_per_user"]
+    )
+    if user_ticket_count is not None:
         raise HTTPException(
             status_code=400,
             detail=f"You already have {user_ticket_count} tickets. Maximum {competition['max_tickets_per_user']} allowed."
@@ -575,12 +1039,15 @@ async def create_order(
     total_amount = float(competition["ticket_price"]) * data.ticket_count
     balance_used = 0.0
     
-    if data.use_balance and user.balance > 0:
-        balance_used = min(user.balance, total_amount)
-        total_amount -= balance_used
+    if data.use_balance:
+        # The cached user can lag a recent debit: price the order off the stored balance
+        stored = await db.users.find_one({"user_id": user.user_id}, {"_id": 0, "balance": 1})
+        balance = float((stored or {}).get("balance", 0))
+        if balance > 0:
+            balance_used = min(balance, total_amount)
+            total_amount -= balance_used
     
     # Create order
-    order_id = f"order_{uuid.uuid4().hex[:12]}"
     order_doc = {
         "order_id": order_id,
         "user_id": user.user_id,
@@ -594,15 +1061,28 @@ async def create_order(
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
+    try:
+        if idempotency_key:
+            # Takes over the id from an earlier attempt with this key that failed
+            await db.orders.replace_one(
+                {"order_id": order_id, "status": {"$in": ["failed", "expired"]}}, order_doc, upsert=True
+            )
+        else:
+            await db.orders.insert_one(order_doc)
+    except DuplicateKeyError:
+        # Another attempt with this key created the order in the meantime
+        await release_entitlement(user.user_id, data.competition_id, data.ticket_count)
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    except PyMongoError:
+        await release_entitlement(user.user_id, data.competition_id, data.ticket_count)
+        raise
+    
     # If total amount is 0 (fully covered by balance), complete the order directly
     if total_amount <= 0:
         # Balance-only flow: reserve balance, then generate tickets + finalize order.
         # Roll back (refund + delete docs) on failure so the client never sees an error
         # while still receiving tickets.
         try:
-            # Insert order immediately so we can clean it up on rollback
-            await db.orders.insert_one(order_doc)
-
             # Reserve/deduct balance atomically
             if balance_used > 0:
                 result = await db.users.update_one(
@@ -610,11 +1090,9 @@ async def create_order(
                     {"$inc": {"balance": -balance_used}},
                 )
                 if result.modified_count == 0:
-                    await db.orders.update_one(
-                        {"order_id": order_id},
-                        {"$set": {"status": "failed"}},
-                    )
+                    await close_pending_order(order_id, "failed")
                     raise HTTPException(status_code=400, detail="Insufficient balance")
+                await record_balance_changes([balance_entry(user.user_id, -balance_used, "order", order_id)])
 
             # Generate tickets
             tickets = await generate_tickets(
@@ -625,12 +1103,6 @@ async def create_order(
                 competition,
             )
 
-            # Update sold tickets
-            await db.competitions.update_one(
-                {"competition_id": data.competition_id},
-                {"$inc": {"sold_tickets": data.ticket_count}},
-            )
-
             # Mark order complete
             await db.orders.update_one(
                 {"order_id": order_id},
@@ -642,6 +1114,15 @@ async def create_order(
                 },
             )
 
+            # Counted last, so a rollback never leaves the sale behind; the order
+            # stands even if the count can't be written
+            try:
+                await outside_deadline(lambda: record_ticket_sale(data.competition_id, data.ticket_count))
+            except PyMongoError:
+                logger.exception("Ticket sale not counted", extra={
+                    "event": "order.sale_uncounted", "order_id": order_id, "competition_id": data.competition_id,
+                })
+
             return {
                 "order_id": order_id,
                 "status": "completed",
@@ -654,56 +1135,93 @@ async def create_order(
         except Exception as e:
             logging.exception("Balance-only order completion failed")
 
-            # Best-effort rollback
-            try:
-                await db.tickets.delete_many({"order_id": order_id})
-            except Exception:
-                pass
+            # Best-effort rollback, even if the request's deadline is what failed it
+            async def _roll_back():
+                try:
+                    await db.ticket_buckets.delete_many({"order_id": order_id})
+                except Exception:
+                    pass
+
+                if balance_used > 0:
+                    try:
+                        await db.users.update_one(
+                            {"user_id": user.user_id},
+                            {"$inc": {"balance": balance_used}},
+                        )
+                        await record_balance_changes([
+                            balance_entry(user.user_id, balance_used, "order_rollback", order_id)
+                        ])
+                    except Exception:
+                        pass
 
-            if balance_used > 0:
                 try:
-                    await db.users.update_one(
-                        {"user_id": user.user_id},
-                        {"$inc": {"balance": balance_used}},
-                    )
+                    await close_pending_order(order_id, "failed")
                 except Exception:
                     pass
 
-            try:
-                await db.orders.update_one(
-                    {"order_id": order_id},
-                    {"$set": {"status": "failed"}},
-                )
-            except Exception:
-                pass
+            await outside_deadline(_roll_back)
 
             raise HTTPException(status_code=500, detail=f"Order completion error: {type(e).__name__}")
 
-    await db.orders.insert_one(order_doc)
+    return await _start_checkout(request, data, competition, order_doc, idempotency_key)
+
+
+def _order_id_for(idempotency_key: Optional[str]) -> str:
+    # Every attempt under one (user-scoped) Idempotency-Key works on the same
+    # order, so a retry after a lapsed lease reuses its Stripe session too
+    if idempotency_key:
+        return f"order_{hashlib.sha256(idempotency_key.encode()).hexdigest()[:24]}"
+    return f"order_{uuid.uuid4().hex[:12]}"
+
+
+async def _resume_order(request: Request, data: OrderCreate, competition: dict, order: dict, idempotency_key: str) -> dict:
+    """Answer for an Idempotency-Key whose earlier attempt already created `order`"""
+    if order["status"] == "completed":
+        tickets = await find_tickets({"order_id": order["order_id"]})
+        return {"order_id": order["order_id"], "status": "completed", "tickets": tickets, "redirect_url": None}
+    if order["amount"] <= 0:
+        # Balance-only: whether the balance was taken can't be told from here
+        logger.error("Balance-only order %s was interrupted mid-way; needs reconciling", order["order_id"],
+                     extra={"event": "order.interrupted", "order_id": order["order_id"]})
+        raise HTTPException(status_code=409, detail="An earlier attempt with this Idempotency-Key was interrupted")
+    return await _start_checkout(request, data, competition, order, idempotency_key)
+
+
+async def _start_checkout(
+    request: Request,
+    data: OrderCreate,
+    competition: dict,
+    order: dict,
+    idempotency_key: Optional[str],
+) -> dict:
+    """Create (or, for a repeated Idempotency-Key, get back) the order's Checkout Session"""
+    order_id = order["order_id"]
+    total_amount = order["amount"]
+    balance_used = order["balance_used"]
 
-    # Create Stripe checkout session
     origin_url = (data.origin_url or "").strip()
     if not origin_url:
         origin_url = (request.headers.get("origin") or "").strip()
     if not origin_url:
+        await close_pending_order(order_id, "failed")
         raise HTTPException(status_code=400, detail="origin_url is required")
     
     host_url = str(request.base_url).rstrip("/")
     webhook_url = f"{host_url}/api/webhook/stripe"
 
     success_url = f"{origin_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
-    cancel_url = f"{origin_url}/competitions/{data.competition_id}"
+    cancel_url = f"{origin_url}/competitions/{order['competition_id']}"
 
     try:
-        import stripe
-
         stripe.api_key = STRIPE_API_KEY
 
         unit_amount = int(round(float(total_amount) * 100))
         if unit_amount < 1:
             raise HTTPException(status_code=400, detail="Invalid payment amount")
 
-        session = stripe.checkout.Session.create(
+        session = await stripe_call(
+            "checkout.session.create",
+            stripe.checkout.Session.create,
             mode="payment",
             success_url=success_url,
             cancel_url=cancel_url,
@@ -715,7 +1233,7 @@ async def create_order(
                         "currency": "gbp",
                         "unit_amount": unit_amount,
                         "product_data": {
-                            "name": f"Tickets x{data.ticket_count}",
+                            "name": f"Tickets x{order['ticket_count']}",
                             "description": competition.get("title", "Competition tickets"),
                         },
                     },
@@ -723,24 +1241,28 @@ async def create_order(
             ],
             metadata={
                 "order_id": order_id,
-                "user_id": user.user_id,
-                "competition_id": data.competition_id,
-                "ticket_count": str(data.ticket_count),
+                "user_id": order["user_id"],
+                "competition_id": order["competition_id"],
+                "ticket_count": str(order["ticket_count"]),
                 "balance_used": str(balance_used),
                 "webhook_url": webhook_url,
             },
+            # Makes retries safe: every attempt under one Idempotency-Key sends
+            # the same order, so Stripe hands back the session it created first
+            idempotency_key=f"create-order:{idempotency_key or order_id}",
         )
     except HTTPException:
+        await close_pending_order(order_id, "failed")
         raise
     except Exception as e:
-        try:
-            import stripe
-
-            if isinstance(e, stripe.error.StripeError):
-                msg = getattr(e, "user_message", None) or str(e)
-                raise HTTPException(status_code=400, detail=f"Stripe error: {msg}")
-        except HTTPException:
-            raise
+        await close_pending_order(order_id, "failed")
+        if isinstance(e, CircuitOpenError):
+            raise _upstream_unavailable(e)
+        if isinstance(e, asyncio.TimeoutError):
+            raise HTTPException(status_code=504, detail="Payment provider timed out")
+        if isinstance(e, stripe.error.StripeError):
+            msg = getattr(e, "user_message", None) or str(e)
+            raise HTTPException(status_code=400, detail=f"Stripe error: {msg}")
 
         logging.exception("Stripe checkout session creation failed")
         raise HTTPException(status_code=502, detail=f"Payment provider error: {type(e).__name__}")
@@ -754,7 +1276,7 @@ async def create_order(
     # Create payment transaction
     transaction_doc = {
         "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
-        "user_id": user.user_id,
+        "user_id": order["user_id"],
         "order_id": order_id,
         "amount": total_amount,
         "currency": "gbp",
@@ -762,16 +1284,18 @@ async def create_order(
         "stripe_session_id": session.id,
         "metadata": {
             "order_id": order_id,
-            "user_id": user.user_id,
-            "competition_id": data.competition_id,
-            "ticket_count": str(data.ticket_count),
+            "user_id": order["user_id"],
+            "competition_id": order["competition_id"],
+            "ticket_count": str(order["ticket_count"]),
             "balance_used": str(balance_used),
         },
         "created_at": datetime.now(timezone.utc).isoformat(),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.payment_transactions.insert_one(transaction_doc)
+    await db.payment_transactions.update_one(
+        {"stripe_session_id": session.id}, {"$setOnInsert": transaction_doc}, upsert=True
+    )
     
     return {
         "order_id": order_id,
@@ -779,48 +1303,114 @@ async def create_order(
         "redirect_url": session.url
     }
 
+# Tickets are stored as buckets: one document per order (split into blocks of
+# TICKET_BUCKET_SIZE) holding the ticket numbers as an array. A unique multikey
+# index on (competition_id, numbers) keeps numbers unique per competition and
+# keeps single-number lookups indexed. expand_ticket_bucket() turns a bucket
+# back into the per-ticket dicts the API returns.
+TICKET_BUCKET_SIZE = 1000
+
+
+def _bucket_ticket_id(order_id: str, index: int) -> str:
+    return f"ticket_{order_id.split('_', 1)[-1]}_{index}"
+
+
+def expand_ticket_bucket(bucket: dict) -> List[dict]:
+    """Expand a ticket bucket into per-ticket dicts"""
+    wins = {w["index"]: w["prize"] for w in bucket.get("instant_wins") or []}
+    ticket_ids = bucket.get("ticket_ids")  # set on buckets migrated from per-ticket documents
+    first = bucket.get("first_index", 0)
+    return [
+        {
+            "ticket_id": ticket_ids[i] if ticket_ids else _bucket_ticket_id(bucket["order_id"], first + i),
+            "ticket_number": number,
+            "user_id": bucket["user_id"],
+            "competition_id": bucket["competition_id"],
+            "order_id": bucket["order_id"],
+            "is_instant_win": i in wins,
+            "instant_win_prize": wins.get(i),
+            "created_at": bucket["created_at"],
+        }
+        for i, number in enumerate(bucket["numbers"])
+    ]
+
+
+async def find_tickets(query: dict, limit: Optional[int] = None, collection=None) -> List[dict]:
+    """Find tickets by bucket fields (user_id, competition_id, order_id), expanded"""
+    tickets: List[dict] = []
+    coll = collection if collection is not None else db.ticket_buckets
+    async for bucket in coll.find(query, {"_id": 0}).sort([("_id", 1)]):
+        tickets.extend(expand_ticket_bucket(bucket))
+        if limit is not None and len(tickets) >= limit:
+            return tickets[:limit]
+    return tickets
+
+
+async def _insert_ticket_bucket(bucket: dict, issued: set):
+    """Insert a bucket, re-rolling any numbers another order already holds"""
+    for _ in range(5):
+        try:
+            await db.ticket_buckets.insert_one(bucket)
+            return
+        except DuplicateKeyError:
+            taken = set()
+            async for other in db.ticket_buckets.find(
+                {"competition_id": bucket["competition_id"], "numbers": {"$in": bucket["numbers"]}},
+                {"_id": 0, "numbers": 1},
+            ):
+                taken.update(other["numbers"])
+            for i, number in enumerate(bucket["numbers"]):
+                if number in taken:
+                    replacement = generate_ticket_number()
+                    while replacement in issued or replacement in taken:
+                        replacement = generate_ticket_number()
+                    issued.add(replacement)
+                    bucket["numbers"][i] = replacement
+    raise RuntimeError("Could not allocate unique ticket numbers")
+
+
 async def generate_tickets(user_id: str, competition_id: str, order_id: str, count: int, competition: dict) -> List[dict]:
     """Generate tickets for an order"""
-    tickets = []
     instant_win_prizes = competition.get("instant_win_prizes", []) or []
+    created_at = datetime.now(timezone.utc).isoformat()
+    issued: set = set()
+    buckets = []
     
-    for _ in range(count):
-        ticket_number = generate_ticket_number()
-        
-        # Check for unique ticket number
-        while await db.tickets.find_one({"competition_id": competition_id, "ticket_number": ticket_number}):
+    for first in range(0, count, TICKET_BUCKET_SIZE):
+        numbers = []
+        instant_wins = []
+        for i in range(min(TICKET_BUCKET_SIZE, count - first)):
             ticket_number = generate_ticket_number()
+            while ticket_number in issued:
+                ticket_number = generate_ticket_number()
+            issued.add(ticket_number)
+            numbers.append(ticket_number)
+            
+            # Check for instant win
+            if competition.get("is_instant_win") and instant_win_prizes:
+                # Random chance for instant win (e.g., 1 in 50)
+                if random.randint(1, 50) == 1:
+                    # Pick a random prize
+                    prize = random.choice(instant_win_prizes)
+                    if prize.get("remaining", 0) > 0:
+                        instant_wins.append({"index": i, "prize": dict(prize)})
+                        # Decrement remaining
+                        for p in instant_win_prizes:
+                            if p == prize:
+                                p["remaining"] = p.get("remaining", 0) - 1
         
-        is_instant_win = False
-        instant_win_prize = None
-        
-        # Check for instant win
-        if competition.get("is_instant_win") and instant_win_prizes:
-            # Random chance for instant win (e.g., 1 in 50)
-            if random.randint(1, 50) == 1:
-                # Pick a random prize
-                prize = random.choice(instant_win_prizes)
-                if prize.get("remaining", 0) > 0:
-                    is_instant_win = True
-                    instant_win_prize = prize
-                    # Decrement remaining
-                    for p in instant_win_prizes:
-                        if p == prize:
-                            p["remaining"] = p.get("remaining", 0) - 1
-        
-        ticket_doc = {
-            "ticket_id": f"ticket_{uuid.uuid4().hex[:12]}",
-            "ticket_number": ticket_number,
+        bucket = {
+            "order_id": order_id,
             "user_id": user_id,
             "competition_id": competition_id,
-            "order_id": order_id,
-            "is_instant_win": is_instant_win,
-            "instant_win_prize": instant_win_prize,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "first_index": first,
+            "ticket_count": len(numbers),
+            "numbers": numbers,
+            "instant_wins": instant_wins,
+            "created_at": created_at
         }
-        
-        await db.tickets.insert_one(ticket_doc)
-        tickets.append(ticket_doc)
+        await _insert_ticket_bucket(bucket, issued)
+        buckets.append(bucket)
     
     # Update instant win prizes in competition
     if competition.get("is_instant_win"):
@@ -828,8 +1418,28 @@ async def generate_tickets(user_id: str, competition_id: str, order_id: str, cou
             {"competition_id": competition_id},
             {"$set": {"instant_win_prizes": instant_win_prizes}}
         )
+        await competition_cache.invalidate_all()
     
-    return tickets
+    return [ticket for bucket in buckets for ticket in expand_ticket_bucket(bucket)]
+
+
+async def pick_winning_ticket(competition_id: str) -> Optional[dict]:
+    """Pick a uniformly random ticket by walking bucket sizes, without loading every ticket"""
+    sizes = await db.ticket_buckets.find(
+        {"competition_id": competition_id},
+        {"_id": 1, "ticket_count": 1},
+    ).sort([("_id", 1)]).to_list(None)
+    total = sum(b["ticket_count"] for b in sizes)
+    if not total:
+        return None
+    
+    pick = random.randrange(total)
+    for b in sizes:
+        if pick < b["ticket_count"]:
+            bucket = await db.ticket_buckets.find_one({"_id": b["_id"]})
+            return expand_ticket_bucket(bucket)[pick]
+        pick -= b["ticket_count"]
+    return None
 
 @api_router.get("/checkout/status/{session_id}")
 async def get_checkout_status(session_id: str, user: User = Depends(require_auth)):
@@ -851,10 +1461,7 @@ async def get_checkout_status(session_id: str, user: User = Depends(require_auth
             {"order_id": transaction["order_id"]},
             {"_id": 0}
         )
-        tickets = await db.tickets.find(
-            {"order_id": transaction["order_id"]},
-            {"_id": 0}
-        ).to_list(100)
+        tickets = await find_tickets({"order_id": transaction["order_id"]})
         return {
             "status": "completed",
             "payment_status": "paid",
@@ -862,18 +1469,27 @@ async def get_checkout_status(session_id: str, user: User = Depends(require_auth
             "tickets": tickets
         }
     
+    if transaction["status"] == "refunded":
+        return {"status": "refunded", "payment_status": "paid", "order": None, "tickets": []}
+    
     # Check with Stripe
     try:
-        import stripe
-
         stripe.api_key = STRIPE_API_KEY
-        session = stripe.checkout.Session.retrieve(session_id)
+        session = await stripe_call("checkout.session.retrieve", stripe.checkout.Session.retrieve, session_id)
         payment_status = getattr(session, "payment_status", None)
         status = getattr(session, "status", None)
+    except CircuitOpenError as e:
+        raise _upstream_unavailable(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Payment provider timed out")
     except Exception as e:
         logging.exception("Stripe checkout status fetch failed")
         raise HTTPException(status_code=502, detail=f"Payment provider error: {type(e).__name__}")
 
+    if status == "expired":
+        # Abandoned checkout: give the tickets back to the user's allowance
+        await close_pending_order(transaction["order_id"], "expired")
+
     if payment_status == "paid" and transaction["status"] != "completed":
         # Complete the order
         order = await db.orders.find_one({"stripe_session_id": session_id}, {"_id": 0})
@@ -884,21 +1500,72 @@ async def get_checkout_status(session_id: str, user: User = Depends(require_auth
                 {"_id": 0}
             )
             
-            # Generate tickets
-            tickets = await generate_tickets(
-                order["user_id"],
-                order["competition_id"],
-                order["order_id"],
-                order["ticket_count"],
-                competition
-            )
+            claimed = None
+            if competition and competition.get("status") != "cancelled":
+                # Only a pending order completes: one that was cancelled or expired
+                # meanwhile (or that another poll is completing) is left alone
+                claimed = await db.orders.update_one(
+                    {"order_id": order["order_id"], "status": "pending"},
+                    {"$set": {"status": "completed"}},
+                )
+            if claimed is None or not claimed.modified_count:
+                current = await db.orders.find_one({"order_id": order["order_id"]}, {"_id": 0})
+                if current and current["status"] == "completed":
+                    return {
+                        "status": "completed",
+                        "payment_status": "paid",
+                        "order": current,
+                        "tickets": await find_tickets({"order_id": order["order_id"]}),
+                    }
+                # Paid for something we can no longer sell: give the money back
+                await _refund_checkout(session, order)
+                return {"status": "refunded", "payment_status": "paid", "order": None, "tickets": []}
             
-            # Deduct balance if used
+            # Deduct balance if used; never below zero, whatever the order was priced against
             if order["balance_used"] > 0:
-                await db.users.update_one(
-                    {"user_id": order["user_id"]},
+                debited = await db.users.update_one(
+                    {"user_id": order["user_id"], "balance": {"$gte": order["balance_used"]}},
                     {"$inc": {"balance": -order["balance_used"]}}
                 )
+                if not debited.modified_count:
+                    await db.orders.update_one(
+                        {"order_id": order["order_id"], "status": "completed"},
+                        {"$set": {"status": "pending"}},
+                    )
+                    # The card only paid part of the price: give that part back
+                    await _refund_checkout(session, order)
+                    return {"status": "refunded", "payment_status": "paid", "order": None, "tickets": []}
+                await record_balance_changes([
+                    balance_entry(order["user_id"], -order["balance_used"], "order", order["order_id"])
+                ])
+            
+            # Generate tickets
+            try:
+                tickets = await generate_tickets(
+                    order["user_id"],
+                    order["competition_id"],
+                    order["order_id"],
+                    order["ticket_count"],
+                    competition
+                )
+            except BaseException:
+                # Hand the order (and the balance it took) back to the next poll
+                async def _release():
+                    await db.ticket_buckets.delete_many({"order_id": order["order_id"]})
+                    if order["balance_used"] > 0:
+                        await db.users.update_one(
+                            {"user_id": order["user_id"]},
+                            {"$inc": {"balance": order["balance_used"]}},
+                        )
+                        await record_balance_changes([
+                            balance_entry(order["user_id"], order["balance_used"], "order_rollback", order["order_id"])
+                        ])
+                    await db.orders.update_one(
+                        {"order_id": order["order_id"], "status": "completed", "tickets": []},
+                        {"$set": {"status": "pending"}},
+                    )
+                await outside_deadline(_release)
+                raise
             
             # Update order
             await db.orders.update_one(
@@ -911,22 +1578,7 @@ async def get_checkout_status(session_id: str, user: User = Depends(require_auth
                 }
             )
             
-            # Update competition sold tickets
-            await db.competitions.update_one(
-                {"competition_id": order["competition_id"]},
-                {"$inc": {"sold_tickets": order["ticket_count"]}}
-            )
-            
-            # Check if sold out
-            updated_comp = await db.competitions.find_one(
-                {"competition_id": order["competition_id"]},
-                {"_id": 0}
-            )
-            if updated_comp["sold_tickets"] >= updated_comp["total_tickets"]:
-                await db.competitions.update_one(
-                    {"competition_id": order["competition_id"]},
-                    {"$set": {"status": "sold_out"}}
-                )
+            await record_ticket_sale(order["competition_id"], order["ticket_count"])
             
             # Update transaction
             await db.payment_transactions.update_one(
@@ -953,69 +1605,546 @@ async def get_checkout_status(session_id: str, user: User = Depends(require_auth
         "tickets": []
     }
 
-@api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request):
-    """Handle Stripe webhooks"""
-    if not STRIPE_API_KEY or STRIPE_API_KEY.strip() in {"", "sk_test_emergent"}:
-        raise HTTPException(status_code=503, detail="Payments are not configured (missing STRIPE_API_KEY)")
+async def _refund_checkout(session, order: dict):
+    """Refund a paid Checkout Session whose order can't be fulfilled (cancelled competition, closed order)"""
+    try:
+        stripe.api_key = STRIPE_API_KEY
+        await stripe_call(
+            "refund.create",
+            stripe.Refund.create,
+            payment_intent=getattr(session, "payment_intent", None),
+            idempotency_key=f"refund-order:{order['order_id']}",
+        )
+    except CircuitOpenError as e:
+        raise _upstream_unavailable(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Payment provider timed out")
+    except Exception as e:
+        logging.exception("Stripe refund for order %s failed", order["order_id"])
+        raise HTTPException(status_code=502, detail=f"Payment provider error: {type(e).__name__}")
+
+    # A competition cancelled after this order was placed: close it first so its allowance is released
+    await close_pending_order(order["order_id"], "cancelled")
+    now = datetime.now(timezone.utc).isoformat()
+    await db.orders.update_one(
+        {"order_id": order["order_id"], "status": {"$ne": "completed"}},
+        {"$set": {"status": "refunded", "refunded_at": now}},
+    )
+    await db.payment_transactions.update_one(
+        {"stripe_session_id": session.id},
+        {"$set": {"status": "refunded", "updated_at": now}},
+    )
+    logger.warning("Refunded a payment for an order that can no longer be fulfilled", extra={
+        "event": "order.refunded_unfulfillable", "order_id": order["order_id"],
+    })
 
-    import stripe
 
-    stripe.api_key = STRIPE_API_KEY
+# Stripe webhooks are verified, stored in `webhook_events` (unique on the Stripe
+# event id, so redeliveries are no-ops) and acknowledged straight away. A pool
+# of WEBHOOK_WORKERS tasks handles them from an in-process queue; failures are
+# retried with exponential backoff by a sweep that also picks up events whose
+# worker died or whose queue slot was full.
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_SWEEP_SECONDS = 5
+WEBHOOK_LEASE_SECONDS = 60
+
+_webhook_queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=1000)
 
-    payload = await request.body()
-    sig_header = request.headers.get("Stripe-Signature")
-    webhook_secret = os.environ.get("STRIPE_WEBHOOK_SECRET", "").strip()
 
+def _webhook_backoff(attempts: int) -> float:
+    # 2s, 4s, 8s ... capped at 10 minutes, with jitter so retries don't line up
+    return min(600.0, 2.0 ** attempts) * random.uniform(0.75, 1.25)
+
+
+def _enqueue_webhook_event(event_id: str):
     try:
-        if webhook_secret and sig_header:
-            event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
-        else:
-            event = None
+        _webhook_queue.put_nowait(event_id)
+    except asyncio.QueueFull:
+        pass  # stays pending; the sweep picks it up
 
-        # If we can't validate the event (missing secret), acknowledge to prevent retries.
-        if not event:
-            return {"received": True, "verified": False}
 
-        event_type = event.get("type")
+async def _handle_stripe_event(event: dict):
+    event_type = event.get("type")
 
-        if event_type == "checkout.session.completed":
-            session = event.get("data", {}).get("object", {})
-            session_id = session.get("id")
+    if event_type == "checkout.session.completed":
+        session = event.get("data", {}).get("object", {})
+        session_id = session.get("id")
 
-            if session_id:
-                transaction = await db.payment_transactions.find_one(
+        if session_id:
+            transaction = await db.payment_transactions.find_one(
+                {"stripe_session_id": session_id},
+                {"_id": 0}
+            )
+            # Order completion is handled by /checkout/status polling; webhook is best-effort.
+            if transaction and transaction.get("status") != "completed":
+                await db.payment_transactions.update_one(
                     {"stripe_session_id": session_id},
-                    {"_id": 0}
+                    {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
                 )
-                # Order completion is handled by /checkout/status polling; webhook is best-effort.
-                if transaction and transaction.get("status") != "completed":
-                    await db.payment_transactions.update_one(
-                        {"stripe_session_id": session_id},
-                        {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
-                    )
 
-        return {"received": True, "verified": True}
+    elif event_type == "checkout.session.expired":
+        session_id = event.get("data", {}).get("object", {}).get("id")
+        transaction = await db.payment_transactions.find_one(
+            {"stripe_session_id": session_id},
+            {"_id": 0, "order_id": 1}
+        )
+        if transaction:
+            await close_pending_order(transaction["order_id"], "expired")
+
+
+async def _process_webhook_event(event_id: str):
+    """Claim a stored event, handle it, and record the outcome (or schedule a retry)"""
+    now = datetime.now(timezone.utc)
+    record = await db.webhook_events.find_one_and_update(
+        {
+            "event_id": event_id,
+            "$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "processing", "lease_until": {"$lt": now}},
+            ],
+        },
+        {"$set": {"status": "processing", "lease_until": now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)},
+         "$inc": {"attempts": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if record is None:
+        return  # handled, not due yet, or claimed by another worker
+
+    try:
+        await _handle_stripe_event(record["event"])
+    except Exception as e:
+        logging.exception("Webhook event %s failed (attempt %d)", event_id, record["attempts"])
+        failed = record["attempts"] >= WEBHOOK_MAX_ATTEMPTS
+        await db.webhook_events.update_one(
+            {"event_id": event_id},
+            {"$set": {
+                "status": "failed" if failed else "pending",
+                "last_error": f"{type(e).__name__}: {e}",
+                "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=_webhook_backoff(record["attempts"])),
+            }},
+        )
+        return
+
+    await db.webhook_events.update_one(
+        {"event_id": event_id},
+        {"$set": {"status": "done", "processed_at": datetime.now(timezone.utc).isoformat()}},
+    )
+
+
+async def _webhook_worker():
+    while True:
+        event_id = await _webhook_queue.get()
+        try:
+            await _process_webhook_event(event_id)
+        except PyMongoError:
+            logger.exception("Webhook event %s could not be claimed or recorded", event_id)
+        finally:
+            _webhook_queue.task_done()
+
+
+async def requeue_due_webhook_events() -> int:
+    """Queue events due a retry or whose lease ran out, up to the free queue slots; returns how many"""
+    free = _webhook_queue.maxsize - _webhook_queue.qsize()
+    if free <= 0:
+        # limit(0) would mean no limit: leave them for the next sweep
+        return 0
+    now = datetime.now(timezone.utc)
+    queued = 0
+    async for record in db.webhook_events.find(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "processing", "lease_until": {"$lt": now}},
+        ]},
+        {"_id": 0, "event_id": 1},
+    ).limit(free):
+        _enqueue_webhook_event(record["event_id"])
+        queued += 1
+    return queued
+
+
+async def _webhook_sweep():
+    while True:
+        await asyncio.sleep(WEBHOOK_SWEEP_SECONDS)
+        try:
+            await requeue_due_webhook_events()
+        except PyMongoError:
+            logger.exception("Webhook retry sweep failed")
+
+
+# Checkout Sessions expire after at most 24h. An order still pending well past
+# that lost its expired webhook and was never polled, so it would hold the
+# user's ticket allowance forever; the sweep asks Stripe and closes it.
+PENDING_ORDER_SWEEP_SECONDS = int(os.environ.get("PENDING_ORDER_SWEEP_SECONDS", "900"))  # 0 disables the sweep
+PENDING_ORDER_MAX_AGE_SECONDS = int(os.environ.get("PENDING_ORDER_MAX_AGE_SECONDS", str(25 * 3600)))
+PENDING_ORDER_BATCH_SIZE = 100
+# An order the sweep couldn't close this many times (Stripe errors, a paid or
+# open session) is left for a person, so it stops taking the oldest batch slot
+PENDING_ORDER_MAX_SWEEP_ATTEMPTS = 5
+
+
+async def expire_stale_pending_orders(max_age_seconds: int = PENDING_ORDER_MAX_AGE_SECONDS) -> int:
+    """Close pending orders older than `max_age_seconds` whose Checkout Session expired; returns how many"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)).isoformat()
+    # Balance-only orders never reach Stripe; one left pending may already have
+    # taken the balance, so it is for reconciliation rather than this sweep
+    orders = await db.orders.find(
+        {
+            "status": "pending",
+            "amount": {"$gt": 0},
+            "created_at": {"$lt": cutoff},
+            "stale_sweep_attempts": {"$not": {"$gte": PENDING_ORDER_MAX_SWEEP_ATTEMPTS}},
+        },
+        {"_id": 0, "order_id": 1, "stripe_session_id": 1, "stale_sweep_attempts": 1},
+    ).sort([("created_at", 1)]).limit(PENDING_ORDER_BATCH_SIZE).to_list(PENDING_ORDER_BATCH_SIZE)
+
+    expired = 0
+    for order in orders:
+        status = None
+        if order.get("stripe_session_id"):
+            try:
+                stripe.api_key = STRIPE_API_KEY
+                session = await stripe_call(
+                    "checkout.session.retrieve", stripe.checkout.Session.retrieve, order["stripe_session_id"]
+                )
+                status = getattr(session, "status", None)
+            except Exception as e:
+                # Unknown session, open circuit, timeout: try the rest of the batch
+                status = f"unreadable ({type(e).__name__})"
+                logger.warning("Could not check the Checkout Session of stale order %s", order["order_id"],
+                               exc_info=True)
+            if status != "expired":
+                # Paid (completion still pending a status poll), somehow still open, or unreadable
+                await _count_stale_sweep_attempt(order, status)
+                continue
+        # No session id: the request died before creating one, so nothing can be paid
+        if await close_pending_order(order["order_id"], "expired"):
+            expired += 1
+            logger.info("Stale pending order expired", extra={
+                "event": "order.expired_stale", "order_id": order["order_id"], "session_status": status,
+            })
+    return expired
+
+
+async def _count_stale_sweep_attempt(order: dict, status: Optional[str]):
+    await db.orders.update_one({"order_id": order["order_id"]}, {"$inc": {"stale_sweep_attempts": 1}})
+    if (order.get("stale_sweep_attempts") or 0) + 1 >= PENDING_ORDER_MAX_SWEEP_ATTEMPTS:
+        logger.error("Stale pending order %s still not closable (Checkout Session %s); leaving it for review",
+                     order["order_id"], status, extra={"event": "order.stale_unresolved", "order_id": order["order_id"]})
+    else:
+        logger.warning("Stale pending order %s has a %s Checkout Session; leaving it", order["order_id"], status)
+
+
+async def _pending_order_sweep():
+    while True:
+        await asyncio.sleep(PENDING_ORDER_SWEEP_SECONDS)
+        try:
+            await expire_stale_pending_orders()
+        except Exception:
+            logger.exception("Stale pending order sweep failed")
+
+
+@api_router.post("/webhook/stripe")
+async def stripe_webhook(request: Request):
+    """Verify and store a Stripe webhook event; it is handled in the background"""
+    if not STRIPE_API_KEY or STRIPE_API_KEY.strip() in {"", "sk_test_emergent"}:
+        raise HTTPException(status_code=503, detail="Payments are not configured (missing STRIPE_API_KEY)")
+
+    stripe.api_key = STRIPE_API_KEY
+
+    payload = await request.body()
+    sig_header = request.headers.get("Stripe-Signature")
+    webhook_secret = os.environ.get("STRIPE_WEBHOOK_SECRET", "").strip()
+
+    # If we can't validate the event (missing secret), acknowledge to prevent retries.
+    if not (webhook_secret and sig_header):
+        return {"received": True, "verified": False}
+
+    try:
+        event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
     except Exception as e:
         logging.exception("Webhook error")
         raise HTTPException(status_code=400, detail=f"Webhook error: {type(e).__name__}")
 
+    now = datetime.now(timezone.utc)
+    try:
+        await db.webhook_events.insert_one({
+            "event_id": event["id"],
+            "type": event.get("type"),
+            "event": json.loads(payload),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "lease_until": None,
+            "last_error": None,
+            "received_at": now.isoformat(),
+        })
+    except DuplicateKeyError:
+        return {"received": True, "verified": True, "duplicate": True}
+
+    _enqueue_webhook_event(event["id"])
+    return {"received": True, "verified": True}
+
+# ====================== WAITING ROOM ======================
+
+# Hot launches can put a competition behind a virtual waiting room: buyers join
+# a per-competition queue, get a token and a position, and are admitted to
+# checkout at `admit_per_second`. The room document holds a join sequence and
+# an admission counter that refills at that rate; joins advance both in one
+# update pipeline, so every worker agrees without a background task. Polls
+# only read the room and work out the refill themselves (`_admitted_by`).
+WAITING_ROOM_ADMISSION_SECONDS = int(os.environ.get("WAITING_ROOM_ADMISSION_SECONDS", "600"))
+WAITING_ROOM_ENTRY_TTL_SECONDS = int(os.environ.get("WAITING_ROOM_ENTRY_TTL_SECONDS", str(6 * 3600)))
+WAITING_ROOM_SSE_SECONDS = int(os.environ.get("WAITING_ROOM_SSE_SECONDS", "300"))
+
+
+class WaitingRoomSettings(BaseModel):
+    enabled: bool
+    admit_per_second: float = Field(default=5.0, gt=0)
+
+
+def _refill_admissions(now: float) -> dict:
+    # Credit accrues at `rate` but never past the queue length, so an idle room
+    # cannot bank admissions for the next surge
+    return {"$set": {
+        "admitted": {"$min": [
+            "$seq",
+            {"$add": [
+                "$admitted",
+                {"$multiply": [{"$max": [0, {"$subtract": [now, "$updated"]}]}, "$rate"]},
+            ]},
+        ]},
+        "updated": now,
+    }}
+
+
+def _admitted_by(room: dict, now: float) -> float:
+    # What _refill_admissions would store at `now`; seq only moves on joins,
+    # which refill first, so computing it on read gives the same answer
+    return min(room["seq"], room["admitted"] + max(0.0, now - room["updated"]) * room["rate"])
+
+
+async def _waiting_room_status(entry: dict) -> dict:
+    """Queue status for an entry; marks it admitted once its turn has come"""
+    now = time.time()
+    if entry.get("admitted_until"):
+        admitted = entry["admitted_until"] > now
+        return {"admitted": admitted, "expired": not admitted, "position": entry["position"], "ahead": 0,
+                "admitted_until": entry["admitted_until"], "retry_after": None}
+
+    # A read, not a write: every poll and SSE tick lands here
+    room = await db.waiting_rooms.find_one({"_id": entry["competition_id"]})
+    if room is None or room.get("disabled"):
+        return {"admitted": True, "expired": False, "position": entry["position"], "ahead": 0,
+                "admitted_until": None, "retry_after": None}
+
+    admitted_count = _admitted_by(room, now)
+    if admitted_count >= entry["position"]:
+        admitted_until = now + WAITING_ROOM_ADMISSION_SECONDS
+        await db.waiting_room_entries.update_one(
+            {"token": entry["token"], "admitted_until": None},
+            {"$set": {"admitted_until": admitted_until}},
+        )
+        return {"admitted": True, "expired": False, "position": entry["position"], "ahead": 0,
+                "admitted_until": admitted_until, "retry_after": None}
+
+    wait = (entry["position"] - admitted_count) / room["rate"]
+    return {
+        "admitted": False,
+        "expired": False,
+        "position": entry["position"],
+        "ahead": max(0, entry["position"] - 1 - int(admitted_count)),
+        "estimated_wait_seconds": round(wait),
+        "admitted_until": None,
+        # Poll about four times over the expected wait, but not more than every 2s
+        "retry_after": min(30, max(2, round(wait / 4))),
+    }
+
+
+async def require_admission(competition: dict, user_id: str, token: Optional[str]):
+    """Gate checkout for competitions behind a waiting room"""
+    if not (competition.get("waiting_room") or {}).get("enabled"):
+        return
+    if not token:
+        raise HTTPException(status_code=403, detail="Join the waiting room first")
+    entry = await db.waiting_room_entries.find_one(
+        {"token": token, "competition_id": competition["competition_id"], "user_id": user_id},
+        {"_id": 0},
+    )
+    if not entry:
+        raise HTTPException(status_code=403, detail="Invalid waiting room token")
+    status = await _waiting_room_status(entry)
+    if not status["admitted"]:
+        detail = "Waiting room admission expired; join the queue again" if status["expired"] else f"Still queued ({status['ahead']} ahead)"
+        raise HTTPException(status_code=403, detail=detail)
+
+
+@api_router.post("/competitions/{competition_id}/queue")
+async def join_waiting_room(competition_id: str, user: User = Depends(require_auth)):
+    """Join a competition's waiting room (returns the token to check out with)"""
+    competition = await db.competitions.find_one(
+        {"competition_id": competition_id},
+        {"_id": 0, "competition_id": 1, "waiting_room": 1},
+    )
+    if competition is None:
+        raise HTTPException(status_code=404, detail="Competition not found")
+    if not (competition.get("waiting_room") or {}).get("enabled"):
+        return {"token": None, "admitted": True, "position": None, "ahead": 0}
+
+    entry = await db.waiting_room_entries.find_one(
+        {"competition_id": competition_id, "user_id": user.user_id}, {"_id": 0}
+    )
+    if entry is not None and entry.get("admitted_until") and entry["admitted_until"] <= time.time():
+        # The admission window lapsed: back of the queue, same token
+        position, now = await _take_waiting_room_slot(competition_id)
+        requeued = await db.waiting_room_entries.find_one_and_update(
+            {"token": entry["token"], "admitted_until": entry["admitted_until"]},
+            {"$set": {
+                "position": position,
+                "admitted_until": None,
+                "joined_at": now,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=WAITING_ROOM_ENTRY_TTL_SECONDS),
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        # None: a concurrent join re-queued it first, or the entry expired away
+        entry = requeued or await db.waiting_room_entries.find_one(
+            {"competition_id": competition_id, "user_id": user.user_id}, {"_id": 0}
+        )
+    if entry is None:
+        position, now = await _take_waiting_room_slot(competition_id)
+        entry = {
+            "token": secrets.token_urlsafe(24),
+            "competition_id": competition_id,
+            "user_id": user.user_id,
+            "position": position,
+            "admitted_until": None,
+            "joined_at": now,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=WAITING_ROOM_ENTRY_TTL_SECONDS),
+        }
+        try:
+            await db.waiting_room_entries.insert_one(dict(entry))
+        except DuplicateKeyError:
+            # A concurrent join from the same user won; its slot stands
+            entry = await db.waiting_room_entries.find_one(
+                {"competition_id": competition_id, "user_id": user.user_id}, {"_id": 0}
+            )
+
+    status = await _waiting_room_status(entry)
+    return {"token": entry["token"], **status}
+
+
+async def _take_waiting_room_slot(competition_id: str) -> Tuple[int, float]:
+    """Next queue position in the room, and the time it was taken"""
+    now = time.time()
+    room = await db.waiting_rooms.find_one_and_update(
+        {"_id": competition_id},
+        [_refill_admissions(now), {"$set": {"seq": {"$add": ["$seq", 1]}}}],
+        return_document=ReturnDocument.AFTER,
+    )
+    if room is None:
+        raise HTTPException(status_code=409, detail="Waiting room is not open")
+    return room["seq"], now
+
+
+async def _find_waiting_room_entry(competition_id: str, token: str) -> dict:
+    entry = await db.waiting_room_entries.find_one(
+        {"token": token, "competition_id": competition_id}, {"_id": 0}
+    )
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Waiting room token not found")
+    return entry
+
+
+@api_router.get("/competitions/{competition_id}/queue")
+async def get_waiting_room_status(competition_id: str, token: str, response: Response):
+    """Poll a waiting room position (honour Retry-After between polls)"""
+    status = await _waiting_room_status(await _find_waiting_room_entry(competition_id, token))
+    if status["retry_after"]:
+        response.headers["Retry-After"] = str(status["retry_after"])
+    return status
+
+
+@api_router.get("/competitions/{competition_id}/queue/events")
+async def stream_waiting_room_status(competition_id: str, token: str):
+    """Server-sent events with the queue status until admitted (clients reconnect after a timeout)"""
+    entry = await _find_waiting_room_entry(competition_id, token)
+
+    async def events():
+        deadline = time.monotonic() + WAITING_ROOM_SSE_SECONDS
+        while True:
+            status = await _waiting_room_status(entry)
+            yield f"data: {json.dumps(status)}\n\n"
+            if status["admitted"] or status["expired"] or time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(status["retry_after"])
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api_router.put("/admin/competitions/{competition_id}/waiting-room")
+async def configure_waiting_room(
+    competition_id: str,
+    data: WaitingRoomSettings,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Open, retune or close a competition's waiting room (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+
+    settings = data.model_dump() if data.enabled else None
+    result = await db.competitions.update_one(
+        {"competition_id": competition_id},
+        {"$set": {"waiting_room": settings}},
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Competition not found")
+    await competition_cache.invalidate_all()
+
+    # Keep the queue and positions when retuning; closing lets everyone through
+    await db.waiting_rooms.update_one(
+        {"_id": competition_id},
+        {
+            "$set": {"rate": data.admit_per_second, "disabled": not data.enabled},
+            "$setOnInsert": {"seq": 0, "admitted": 0, "updated": time.time()},
+        },
+        upsert=True,
+    )
+    return {"competition_id": competition_id, "waiting_room": settings}
+
 # ====================== USER DASHBOARD ROUTES ======================
 
 @api_router.get("/user/entries")
-async def get_user_entries(user: User = Depends(require_auth)):
-    """Get user's competition entries"""
+async def get_user_entries(include_archived: bool = False, user: User = Depends(require_auth)):
+    """Get user's competition entries (archived history with ?include_archived=true)"""
     # Get unique competition IDs from user's tickets
     pipeline = [
         {"$match": {"user_id": user.user_id}},
         {"$group": {
             "_id": "$competition_id",
-            "ticket_count": {"$sum": 1},
-            "tickets": {"$push": "$ticket_number"}
+            "ticket_count": {"$sum": "$ticket_count"},
+            "tickets": {"$push": "$numbers"}
         }}
     ]
     
-    entries = await db.tickets.aggregate(pipeline).to_list(100)
+    entries = await db.ticket_buckets.aggregate(pipeline).to_list(100)
+    
+    if include_archived:
+        archived = await db.ticket_archive.aggregate(pipeline).to_list(100)
+        merged = {entry["_id"]: entry for entry in entries}
+        for entry in archived:
+            if entry["_id"] in merged:
+                merged[entry["_id"]]["ticket_count"] += entry["ticket_count"]
+                merged[entry["_id"]]["tickets"] += entry["tickets"]
+            else:
+                merged[entry["_id"]] = entry
+        entries = list(merged.values())
     
     result = []
     for entry in entries:
@@ -1027,34 +2156,34 @@ async def get_user_entries(user: User = Depends(require_auth)):
             result.append({
                 "competition": competition,
                 "ticket_count": entry["ticket_count"],
-                "tickets": entry["tickets"]
+                "tickets": [n for numbers in entry["tickets"] for n in numbers]
             })
     
     return result
 
 @api_router.get("/user/tickets")
-async def get_user_tickets(user: User = Depends(require_auth)):
-    """Get all user's tickets"""
-    tickets = await db.tickets.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).to_list(1000)
+async def get_user_tickets(include_archived: bool = False, user: User = Depends(require_auth)):
+    """Get all user's tickets (archived history with ?include_archived=true)"""
+    tickets = await find_tickets({"user_id": user.user_id}, limit=1000)
+    
+    if include_archived and len(tickets) < 1000:
+        tickets += await _archived_user_tickets(user.user_id, limit=1000 - len(tickets))
     
     return tickets
 
 @api_router.get("/user/wins")
 async def get_user_wins(user: User = Depends(require_auth)):
     """Get user's wins"""
-    wins = await db.winners.find(
+    wins = await db_reads.call("user_wins", lambda: db.winners.find(
         {"user_id": user.user_id},
         {"_id": 0}
-    ).to_list(100)
+    ).to_list(100))
     
     # Also include instant wins
-    instant_wins = await db.tickets.find(
-        {"user_id": user.user_id, "is_instant_win": True},
-        {"_id": 0}
-    ).to_list(100)
+    instant_wins = [
+        t for t in await find_tickets({"user_id": user.user_id, "instant_wins.0": {"$exists": True}})
+        if t["is_instant_win"]
+    ][:100]
     
     return {
         "main_wins": wins,
@@ -1064,10 +2193,10 @@ async def get_user_wins(user: User = Depends(require_auth)):
 @api_router.get("/user/orders")
 async def get_user_orders(user: User = Depends(require_auth)):
     """Get user's orders"""
-    orders = await db.orders.find(
+    orders = await db_reads.call("user_orders", lambda: db.orders.find(
         {"user_id": user.user_id},
         {"_id": 0}
-    ).sort([("created_at", -1)]).to_list(100)
+    ).sort([("created_at", -1)]).to_list(100))
     
     return orders
 
@@ -1076,15 +2205,17 @@ async def get_user_orders(user: User = Depends(require_auth)):
 @api_router.get("/winners")
 async def get_winners():
     """Get all winners"""
-    winners = await db.winners.find({}, {"_id": 0}).sort([("announced_at", -1)]).to_list(100)
+    winners = await db_reads.call(
+        "winners", lambda: read_db("winners").winners.find({}, {"_id": 0}).sort([("announced_at", -1)]).to_list(100)
+    )
     
     # Get competition details for each winner
     result = []
     for winner in winners:
-        competition = await db.competitions.find_one(
+        competition = await db_reads.call("competition", lambda: read_db("winners").competitions.find_one(
             {"competition_id": winner["competition_id"]},
             {"_id": 0}
-        )
+        ))
         result.append({
             **winner,
             "competition": competition
@@ -1101,6 +2232,22 @@ class AdminAuth(BaseModel):
 class BalanceUpdate(BaseModel):
     amount: float
 
+
+# Largest credit (or debit) a single bulk-balance row may apply
+BULK_BALANCE_MAX_AMOUNT = float(os.environ.get("BULK_BALANCE_MAX_AMOUNT", "10000"))
+
+
+class BulkBalanceRow(BaseModel):
+    user_id: str
+    amount: float = Field(allow_inf_nan=False, ge=-BULK_BALANCE_MAX_AMOUNT, le=BULK_BALANCE_MAX_AMOUNT)
+
+    @field_validator("amount")
+    @classmethod
+    def _non_zero(cls, amount: float) -> float:
+        if amount == 0:
+            raise ValueError("amount must not be zero")
+        return amount
+
 # Image upload helper
 async def save_upload_file(upload_file: UploadFile, subfolder: str = "images") -> str:
     # Create upload directory if it doesn't exist
@@ -1146,37 +2293,13 @@ async def create_competition(
     """Create a new competition (admin only)"""
     await require_admin(_get_admin_password(password, x_admin_password))
     
-    competition_id = f"comp_{uuid.uuid4().hex[:12]}"
-    competition_doc = {
-        "competition_id": competition_id,
-        "title": data.title,
-        "description": data.description,
-        "prize_type": data.prize_type,
-        "prize_value": data.prize_value,
-        "prize_image": data.prize_image,
-        "ticket_price": data.ticket_price,
-        "total_tickets": data.total_tickets,
-        "sold_tickets": 0,
-        "max_tickets_per_user": data.max_tickets_per_user,
-        "end_date": data.end_date.isoformat(),
-        "status": "active",
-        "is_instant_win": data.is_instant_win,
-        "instant_win_prizes": data.instant_win_prizes,
-        "facebook_live_url": data.facebook_live_url,
-        "winner_id": None,
-        "draw_date": None,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
+    competition_doc = build_competition_doc(data)
+    competition_id = competition_doc["competition_id"]
     
-    try:
-        await asyncio.wait_for(db.competitions.insert_one(competition_doc), timeout=10)
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Database timeout while creating competition")
-    except ServerSelectionTimeoutError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except (AutoReconnect, PyMongoError):
-        raise HTTPException(status_code=503, detail="Database unavailable")
+    await db.competitions.insert_one(competition_doc)
+    await competition_cache.invalidate_all()
     
+    schedule_competition_end(competition_id, competition_doc["end_date"])
     return {"competition_id": competition_id, "message": "Competition created"}
 
 @api_router.post("/admin/competitions/{competition_id}/instant-win")
@@ -1199,17 +2322,14 @@ async def instant_win_competition(
     if competition.get("winner_id"):
         raise HTTPException(status_code=400, detail="Winner already selected")
     
-    # Get all tickets for this competition
-    tickets = await db.tickets.find(
-        {"competition_id": competition_id},
-        {"_id": 0}
-    ).to_list(10000)
-    
-    if not tickets:
-        raise HTTPException(status_code=400, detail="No tickets sold")
+    if await legacy_tickets_pending(competition_id):
+        raise _legacy_migration_in_progress()
     
     # Random selection
-    winning_ticket = random.choice(tickets)
+    winning_ticket = await pick_winning_ticket(competition_id)
+    
+    if not winning_ticket:
+        raise HTTPException(status_code=400, detail="No tickets sold")
     
     # Get winner user
     winner_user = await db.users.find_one(
@@ -1244,6 +2364,7 @@ async def instant_win_competition(
             }
         }
     )
+    await competition_cache.invalidate_all()
     
     return {
         "winner_id": winner_id,
@@ -1253,32 +2374,164 @@ async def instant_win_competition(
     }
 
 
-@api_router.get("/admin/competitions/{competition_id}/tickets.txt")
-async def download_competition_tickets_txt(
+# Ticket export formats: media type and header line (if any) per format
+EXPORT_FORMATS = {
+    "txt": ("text/plain; charset=utf-8", None),
+    "csv": ("text/csv; charset=utf-8", ["ticket_number", "user_id", "user_name", "user_email", "order_id", "is_instant_win", "created_at", "cursor"]),
+    "ndjson": ("application/x-ndjson", None),
+}
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "200"))  # ticket buckets per batch
+EXPORT_USER_CACHE_SIZE = 50000
+
+
+def _parse_export_resume(after: str | None, range_header: str | None) -> Optional[tuple]:
+    """Resolve the resume token from `?after=` or a `Range: tickets=<token>-` header.
+
+    A token is `<bucket _id>.<index in bucket>` of the last ticket received.
+    """
+    token = after
+    if not token and range_header:
+        unit, _, spec = range_header.partition("=")
+        if unit.strip() != "tickets" or not spec.strip().endswith("-"):
+            raise HTTPException(status_code=416, detail="Unsupported range, use 'tickets=<cursor>-'")
+        token = spec.strip()[:-1]
+    if not token:
+        return None
+    bucket_id, _, index = token.partition(".")
+    if not ObjectId.is_valid(bucket_id) or not index.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid resume token")
+    return ObjectId(bucket_id), int(index)
+
+
+def _format_export_batch(export_format: str, tickets: List[dict], owners: Dict[str, dict]) -> str:
+    """Render one batch of ticket docs in the requested export format"""
+    if export_format == "txt":
+        return "".join(f"{t['ticket_number']}\n" for t in tickets if t.get("ticket_number"))
+
+    rows = []
+    for t in tickets:
+        owner = owners.get(t.get("user_id")) or {}
+        rows.append({
+            "ticket_number": t.get("ticket_number"),
+            "user_id": t.get("user_id"),
+            "user_name": owner.get("name"),
+            "user_email": owner.get("email"),
+            "order_id": t.get("order_id"),
+            "is_instant_win": bool(t.get("is_instant_win")),
+            "created_at": t.get("created_at"),
+            "cursor": t["cursor"],
+        })
+
+    if export_format == "ndjson":
+        return "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FORMATS["csv"][1], lineterminator="\n")
+    writer.writerows(rows)
+    return buf.getvalue()
+
+
+async def _iter_ticket_export(competition_id: str, export_format: str, after: Optional[tuple], compress: bool, collection):
+    """Stream a competition's tickets bucket batch by batch, joining owners with one $in query per batch"""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def _emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return gz.compress(data) if gz else data
+
+    header = EXPORT_FORMATS[export_format][1]
+    if header and after is None:
+        yield _emit(",".join(header) + "\n")
+
+    query: Dict[str, Any] = {"competition_id": competition_id}
+    if after is not None:
+        query["_id"] = {"$gte": after[0]}
+
+    cursor = collection.find(query).sort([("_id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+    owners: Dict[str, dict] = {}
+
+    while True:
+        buckets = await cursor.to_list(EXPORT_BATCH_SIZE)
+        if not buckets:
+            break
+
+        tickets = []
+        for bucket in buckets:
+            skip = after[1] + 1 if after is not None and bucket["_id"] == after[0] else 0
+            for i, ticket in enumerate(expand_ticket_bucket(bucket)[skip:], start=skip):
+                ticket["cursor"] = f"{bucket['_id']}.{i}"
+                tickets.append(ticket)
+
+        if export_format != "txt":
+            if len(owners) > EXPORT_USER_CACHE_SIZE:
+                owners.clear()
+            missing = {t.get("user_id") for t in tickets} - owners.keys()
+            missing.discard(None)
+            if missing:
+                async for u in read_db("exports").users.find(
+                    {"user_id": {"$in": list(missing)}},
+                    {"_id": 0, "user_id": 1, "name": 1, "email": 1},
+                ):
+                    owners[u["user_id"]] = u
+
+        chunk = _emit(_format_export_batch(export_format, tickets, owners))
+        if chunk:
+            yield chunk
+
+    if gz:
+        yield gz.flush()
+
+
+@api_router.get("/admin/competitions/{competition_id}/tickets.{export_format}")
+async def download_competition_tickets(
     competition_id: str,
+    export_format: str,
+    request: Request,
+    gzip: bool = False,
+    after: str | None = None,
     x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
     password: str | None = None,
 ):
-    """Download all ticket numbers for a competition as a .txt file (admin only)"""
+    """Export all tickets for a competition as txt, csv or ndjson (admin only).
+
+    csv/ndjson rows include the owner's name/email and a `cursor` token; pass the
+    last token received as `?after=` (or `Range: tickets=<cursor>-`) to resume.
+    """
     await require_admin(_get_admin_password(password, x_admin_password))
 
-    competition = await db.competitions.find_one({"competition_id": competition_id}, {"_id": 0})
-    if not competition:
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail="Unsupported export format")
+
+    resume_from = _parse_export_resume(after, request.headers.get("range"))
+
+    reporting = read_db("exports")
+    competition = await reporting.competitions.find_one({"competition_id": competition_id}, {"_id": 0, "tickets_archived": 1})
+    if competition is None:
         raise HTTPException(status_code=404, detail="Competition not found")
+    # Archived buckets keep their _id, so resume tokens stay valid across archival
+    collection = reporting.ticket_archive if competition.get("tickets_archived") else reporting.ticket_buckets
 
-    async def _iter_lines():
-        cursor = db.tickets.find(
-            {"competition_id": competition_id},
-            {"_id": 0, "ticket_number": 1},
-        )
-        async for doc in cursor:
-            tn = doc.get("ticket_number")
-            if tn:
-                yield f"{tn}\n".encode("utf-8")
+    media_type = EXPORT_FORMATS[export_format][0]
+    filename = f"{competition_id}_tickets.{export_format}"
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    headers = {
+        "Content-Disposition": f"attachment; filename=\"{filename}\"",
+        "Accept-Ranges": "tickets",
+    }
+    status_code = 200
+    if resume_from is not None:
+        status_code = 206
+        headers["Content-Range"] = f"tickets {resume_from[0]}.{resume_from[1]}-*"
 
-    filename = f"{competition_id}_tickets.txt"
-    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    return StreamingResponse(_iter_lines(), media_type="text/plain; charset=utf-8", headers=headers)
+    return StreamingResponse(
+        _iter_ticket_export(competition_id, export_format, resume_from, gzip, collection),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
+    )
 
 @api_router.put("/admin/competitions/{competition_id}")
 async def update_competition(
@@ -1305,6 +2558,11 @@ async def update_competition(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Competition not found")
+    await competition_cache.invalidate_all()
+    
+    if "end_date" in update_data or update_data.get("status") == "active":
+        competition = await db.competitions.find_one({"competition_id": competition_id}, {"_id": 0, "end_date": 1})
+        schedule_competition_end(competition_id, competition["end_date"])
     
     return {"message": "Competition updated"}
 
@@ -1321,8 +2579,15 @@ async def delete_competition(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Competition not found")
+    await competition_cache.invalidate_all()
+    
+    job = await start_job(
+        "purge_competition_tickets",
+        {"competition_id": competition_id},
+        f"purge:{competition_id}",
+    )
     
-    return {"message": "Competition deleted"}
+    return {"message": "Competition deleted", "purge_job_id": job["job_id"]}
 
 @api_router.get("/admin/competitions")
 async def get_all_competitions_admin(
@@ -1332,21 +2597,7 @@ async def get_all_competitions_admin(
     """Get all competitions for admin"""
     await require_admin(_get_admin_password(password, x_admin_password))
 
-    try:
-        competitions = await asyncio.wait_for(
-            db.competitions.find({}, {"_id": 0}).sort([("created_at", -1)]).to_list(1000),
-            timeout=10,
-        )
-        return competitions
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Database timeout while listing competitions")
-    except ServerSelectionTimeoutError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except (AutoReconnect, PyMongoError):
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except Exception as e:
-        logging.exception("Admin competitions list failed")
-        raise HTTPException(status_code=500, detail=f"Admin competitions list error: {type(e).__name__}")
+    return await db_reads.call("admin_competitions", lambda: db.competitions.find({}, {"_id": 0}).sort([("created_at", -1)]).to_list(1000))
 
 @api_router.get("/admin/users")
 async def get_all_users(
@@ -1356,21 +2607,7 @@ async def get_all_users(
     """Get all users (admin only)"""
     await require_admin(_get_admin_password(password, x_admin_password))
 
-    try:
-        users = await asyncio.wait_for(
-            db.users.find({}, {"_id": 0, "password": 0}).to_list(1000),
-            timeout=10,
-        )
-        return users
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Database timeout while listing users")
-    except ServerSelectionTimeoutError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except (AutoReconnect, PyMongoError):
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except Exception as e:
-        logging.exception("Admin users list failed")
-        raise HTTPException(status_code=500, detail=f"Admin users list error: {type(e).__name__}")
+    return await db_reads.call("admin_users", lambda: db.users.find({}, {"_id": 0, "password": 0}).to_list(1000))
 
 @api_router.get("/admin/orders")
 async def get_all_orders(
@@ -1380,45 +2617,41 @@ async def get_all_orders(
     """Get all orders (admin only)"""
     await require_admin(_get_admin_password(password, x_admin_password))
 
-    try:
-        orders = await asyncio.wait_for(
-            db.orders.find({}, {"_id": 0}).sort([("created_at", -1)]).to_list(1000),
-            timeout=10,
-        )
-        return orders
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Database timeout while listing orders")
-    except ServerSelectionTimeoutError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except (AutoReconnect, PyMongoError):
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except Exception as e:
-        logging.exception("Admin orders list failed")
-        raise HTTPException(status_code=500, detail=f"Admin orders list error: {type(e).__name__}")
+    return await db_reads.call("admin_orders", lambda: db.orders.find({}, {"_id": 0}).sort([("created_at", -1)]).to_list(1000))
+
+ENTRANTS_PAGE_SIZE = 1000
+
 
 @api_router.get("/admin/competition/{competition_id}/entrants")
-async def get_competition_entrants(competition_id: str, password: str):
-    """Get entrants for a competition (admin only)"""
+async def get_competition_entrants(competition_id: str, password: str, after: Optional[str] = None):
+    """Get entrants for a competition (admin only).
+
+    At most ENTRANTS_PAGE_SIZE entrants, ordered by user_id; pass the last
+    user_id as `?after=` for the next page (the tickets export lists everything).
+    """
     await require_admin(password)
     
-    tickets = await db.tickets.find(
-        {"competition_id": competition_id},
-        {"_id": 0}
-    ).to_list(10000)
+    pipeline: List[dict] = [
+        {"$match": {"competition_id": competition_id, **({"user_id": {"$gt": after}} if after else {})}},
+        {"$group": {"_id": "$user_id", "tickets": {"$push": "$numbers"}}},
+        {"$sort": {"_id": 1}},
+        {"$limit": ENTRANTS_PAGE_SIZE},
+    ]
+    holdings = await db.ticket_buckets.aggregate(pipeline).to_list(ENTRANTS_PAGE_SIZE)
     
-    # Get user info for each ticket
-    entrants = {}
-    for ticket in tickets:
-        user_id = ticket["user_id"]
-        if user_id not in entrants:
-            user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
-            entrants[user_id] = {
-                "user": user,
-                "tickets": []
-            }
-        entrants[user_id]["tickets"].append(ticket["ticket_number"])
+    # Get user info for all entrants at once
+    users = {
+        u["user_id"]: u
+        async for u in db.users.find(
+            {"user_id": {"$in": [h["_id"] for h in holdings]}},
+            {"_id": 0, "password": 0}
+        )
+    }
     
-    return list(entrants.values())
+    return [
+        {"user": users.get(h["_id"]), "tickets": [n for numbers in h["tickets"] for n in numbers]}
+        for h in holdings
+    ]
 
 @api_router.post("/admin/competition/{competition_id}/draw")
 async def draw_winner(competition_id: str, admin: AdminAuth):
@@ -1436,17 +2669,15 @@ async def draw_winner(competition_id: str, admin: AdminAuth):
     if competition.get("winner_id"):
         raise HTTPException(status_code=400, detail="Winner already drawn")
     
-    # Get all tickets for this competition
-    tickets = await db.tickets.find(
-        {"competition_id": competition_id},
-        {"_id": 0}
-    ).to_list(10000)
-    
-    if not tickets:
-        raise HTTPException(status_code=400, detail="No tickets sold")
+    # A draw over the buckets alone would leave out unconverted legacy tickets
+    if await legacy_tickets_pending(competition_id):
+        raise _legacy_migration_in_progress()
     
     # Random selection
-    winning_ticket = random.choice(tickets)
+    winning_ticket = await pick_winning_ticket(competition_id)
+    
+    if not winning_ticket:
+        raise HTTPException(status_code=400, detail="No tickets sold")
     
     # Get winner user
     winner_user = await db.users.find_one(
@@ -1481,6 +2712,7 @@ async def draw_winner(competition_id: str, admin: AdminAuth):
             }
         }
     )
+    await competition_cache.invalidate_all()
     
     return {
         "winner_id": winner_id,
@@ -1507,8 +2739,868 @@ async def add_user_balance(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await record_balance_changes([balance_entry(user_id, data.amount, "admin_credit")])
+    
     return {"message": f"Added £{data.amount} to user balance"}
 
+# ====================== ADMIN BULK OPERATIONS ======================
+
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "1000"))
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+async def _read_bulk_rows(request: Request) -> List[dict]:
+    """Parse a bulk request body: a JSON array (or {"items": [...]}) or CSV with a header row"""
+    body = await request.body()
+    if "csv" in request.headers.get("content-type", ""):
+        reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+        # Empty CSV cells mean "not provided" so model defaults apply
+        return [{k: v for k, v in row.items() if v not in ("", None)} for row in reader]
+
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or CSV")
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or CSV")
+    return data
+
+
+def _row_error(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in exc.errors())
+    return str(exc)
+
+
+def _bulk_write_errors(exc: BulkWriteError) -> Dict[int, str]:
+    """Map op index within a chunk -> error message"""
+    return {err["index"]: err.get("errmsg", "write error") for err in exc.details.get("writeErrors", [])}
+
+
+async def _bulk_response(events, stream: bool):
+    """Either stream every progress event as NDJSON, or return only the final summary"""
+    if stream:
+        async def _lines():
+            async for event in events:
+                yield (json.dumps(event, default=str) + "\n").encode("utf-8")
+
+        return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+    summary = None
+    async for event in events:
+        summary = event
+    return summary
+
+
+async def _run_bulk(rows: List[Any], parse_row, build_ops, collection: str, on_applied=None):
+    """Validate rows, apply them chunk by chunk with unordered bulk_write and yield progress.
+
+    `parse_row(raw)` returns a validated item or raises ValueError/ValidationError.
+    `build_ops(chunk)` receives [(row_index, item)] and returns
+    (ops, op_rows, results) where `op_rows[i]` is the row index of `ops[i]`
+    and `results` holds per-row results decided without a write (e.g. not found).
+    `on_applied(results)`, if given, is awaited with the results of each chunk's successful writes.
+
+    A database error other than per-row write errors stops the run: that
+    chunk's rows are reported as failed (noting when some may have been
+    written) and the rows after it as not attempted.
+    """
+    results: List[Optional[dict]] = [None] * len(rows)
+    processed = 0
+
+    for start, chunk in _chunks(rows, BULK_CHUNK_SIZE):
+        valid = []
+        for offset, raw in enumerate(chunk):
+            index = start + offset
+            try:
+                valid.append((index, parse_row(raw)))
+            except (ValueError, TypeError) as e:
+                results[index] = {"row": index, "status": "error", "error": _row_error(e)}
+
+        aborted = False
+        if valid:
+            try:
+                ops, op_rows, decided = await build_ops(valid)
+            except PyMongoError as e:
+                logging.exception("Bulk %s: preparing rows %d-%d failed", collection, start, start + len(chunk) - 1)
+                ops, op_rows, decided = [], [], {
+                    index: {"status": "error", "error": f"Database error: {type(e).__name__}"} for index, _ in valid
+                }
+                aborted = True
+            for index, result in decided.items():
+                results[index] = {"row": index, **result}
+
+            errors: Dict[int, str] = {}
+            if ops:
+                try:
+                    await db[collection].bulk_write(ops, ordered=False)
+                except BulkWriteError as e:
+                    errors = _bulk_write_errors(e)
+                except PyMongoError as e:
+                    logging.exception("Bulk %s: writing rows %d-%d failed", collection, start, start + len(chunk) - 1)
+                    error = f"Database error, may have been partly applied: {type(e).__name__}"
+                    errors = {op_index: error for op_index in range(len(ops))}
+                    aborted = True
+
+            applied = []
+            for op_index, (index, result) in enumerate(op_rows):
+                if op_index in errors:
+                    results[index] = {"row": index, "status": "error", "error": errors[op_index]}
+                else:
+                    results[index] = {"row": index, **result}
+                    applied.append(result)
+            if on_applied and applied:
+                try:
+                    await on_applied(applied)
+                except PyMongoError:
+                    # The rows were written; only the follow-up (e.g. ledger entries) is missing
+                    logging.exception("Bulk %s: follow-up for rows %d-%d failed", collection, start, start + len(chunk) - 1)
+                    aborted = True
+
+        processed += len(chunk)
+        yield {"event": "progress", "processed": processed, "total": len(rows)}
+        if aborted:
+            for index in range(processed, len(rows)):
+                results[index] = {"row": index, "status": "not_attempted"}
+            break
+
+    failed = sum(1 for r in results if r and r["status"] == "error")
+    not_attempted = sum(1 for r in results if r and r["status"] == "not_attempted")
+    yield {
+        "event": "done",
+        "total": len(rows),
+        "succeeded": len(rows) - failed - not_attempted,
+        "failed": failed,
+        "not_attempted": not_attempted,
+        "results": results,
+    }
+
+
+@api_router.post("/admin/competitions/bulk")
+async def bulk_create_competitions(
+    request: Request,
+    stream: bool = False,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Create many competitions from a JSON array or CSV upload (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+    rows = await _read_bulk_rows(request)
+
+    def _parse(raw):
+        if not isinstance(raw, dict):
+            raise ValueError("Row must be an object")
+        if isinstance(raw.get("instant_win_prizes"), str):
+            raw = {**raw, "instant_win_prizes": json.loads(raw["instant_win_prizes"])}
+        return CompetitionCreate(**raw)
+
+    async def _ops(valid):
+        ops, op_rows = [], []
+        for index, data in valid:
+            doc = build_competition_doc(data)
+            schedule_competition_end(doc["competition_id"], doc["end_date"])
+            ops.append(InsertOne(doc))
+            op_rows.append((index, {"status": "created", "competition_id": doc["competition_id"]}))
+        return ops, op_rows, {}
+
+    async def _created(applied):
+        await competition_cache.invalidate_all()
+
+    return await _bulk_response(_run_bulk(rows, _parse, _ops, "competitions", on_applied=_created), stream)
+
+
+@api_router.post("/admin/users/bulk-balance")
+async def bulk_add_user_balance(
+    request: Request,
+    stream: bool = False,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Credit many user balances from a JSON array or CSV of user_id,amount (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+    rows = await _read_bulk_rows(request)
+
+    def _parse(raw):
+        if not isinstance(raw, dict):
+            raise ValueError("Row must be an object")
+        return BulkBalanceRow(**raw)
+
+    async def _ops(valid):
+        user_ids = list({row.user_id for _, row in valid})
+        existing = {
+            u["user_id"]
+            async for u in db.users.find({"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1})
+        }
+        ops, op_rows, decided = [], [], {}
+        for index, row in valid:
+            if row.user_id not in existing:
+                decided[index] = {"status": "error", "error": "User not found", "user_id": row.user_id}
+                continue
+            ops.append(UpdateOne({"user_id": row.user_id}, {"$inc": {"balance": row.amount}}))
+            op_rows.append((index, {"status": "credited", "user_id": row.user_id, "amount": row.amount}))
+        return ops, op_rows, decided
+
+    async def _record(applied):
+        await record_balance_changes([balance_entry(r["user_id"], r["amount"], "admin_credit") for r in applied])
+
+    return await _bulk_response(_run_bulk(rows, _parse, _ops, "users", on_applied=_record), stream)
+
+# ====================== ADMIN JOBS ======================
+# Long-running admin work runs as a background task that checkpoints into
+# `admin_jobs`. A lease keeps two workers from running the same job, and jobs
+# whose lease lapsed (crash, redeploy) are picked up again at startup.
+
+JOB_CHUNK_SIZE = int(os.environ.get("JOB_CHUNK_SIZE", "500"))
+JOB_LEASE_SECONDS = 60
+WORKER_ID = f"worker_{uuid.uuid4().hex[:12]}"
+
+_running_jobs: Dict[str, asyncio.Task] = {}
+
+
+def _lease_until() -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat()
+
+
+async def start_job(kind: str, params: dict, dedupe_key: Optional[str] = None) -> dict:
+    """Persist a new job and start running it in this worker.
+
+    Jobs sharing a `dedupe_key` are the same job: the existing one is
+    returned (and resumed if it stalled or failed) instead of a duplicate.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "job_id": f"job_{uuid.uuid4().hex[:12]}",
+        "kind": kind,
+        "params": params,
+        "status": "running",
+        "progress": {},
+        "checkpoint": None,
+        "error": None,
+        "worker_id": None,
+        "lease_until": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+    if dedupe_key:
+        job["dedupe_key"] = dedupe_key
+    try:
+        await db.admin_jobs.insert_one(job)
+    except DuplicateKeyError:
+        existing = await db.admin_jobs.find_one({"dedupe_key": dedupe_key}, {"_id": 0})
+        return await resume_job(existing)
+    job.pop("_id", None)
+    await spawn_job(job)
+    return job
+
+
+async def resume_job(job: dict) -> dict:
+    """Restart a failed job from its checkpoint, or make sure a running one has a worker"""
+    if job["status"] == "failed":
+        job = await db.admin_jobs.find_one_and_update(
+            {"job_id": job["job_id"], "status": "failed"},
+            {"$set": {"status": "running", "error": None, "lease_until": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        ) or job
+    if job["status"] == "running":
+        await spawn_job(job)
+    return job
+
+
+async def spawn_job(job: dict) -> bool:
+    """Claim the job's lease and run it; False if another worker holds it"""
+    task = _running_jobs.get(job["job_id"])
+    if task and not task.done():
+        return True
+
+    now = datetime.now(timezone.utc).isoformat()
+    claimed = await db.admin_jobs.find_one_and_update(
+        {
+            "job_id": job["job_id"],
+            "status": "running",
+            "$or": [{"lease_until": {"$lt": now}}, {"worker_id": WORKER_ID}],
+        },
+        {"$set": {"worker_id": WORKER_ID, "lease_until": _lease_until()}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not claimed:
+        return False
+
+    # A fresh context, so a job started by a request doesn't inherit its deadline
+    _running_jobs[job["job_id"]] = asyncio.create_task(_run_job(claimed), context=contextvars.Context())
+    return True
+
+
+async def checkpoint_job(job_id: str, checkpoint: dict, progress: dict):
+    """Record progress and renew the lease"""
+    await db.admin_jobs.update_one(
+        {"job_id": job_id, "worker_id": WORKER_ID},
+        {"$set": {
+            "checkpoint": checkpoint,
+            "progress": progress,
+            "lease_until": _lease_until(),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }},
+    )
+
+
+async def _run_job(job: dict):
+    try:
+        await JOB_HANDLERS[job["kind"]](job)
+        update = {"status": "completed"}
+    except Exception as e:
+        logging.exception("Admin job %s failed", job["job_id"])
+        update = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    finally:
+        _running_jobs.pop(job["job_id"], None)
+
+    update["updated_at"] = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.admin_jobs.update_one({"job_id": job["job_id"], "worker_id": WORKER_ID}, {"$set": update})
+    except PyMongoError:
+        logging.exception("Could not record admin job %s result", job["job_id"])
+
+
+async def _expire_checkout_session(session_id: str):
+    try:
+        stripe.api_key = STRIPE_API_KEY
+        await stripe_call("checkout.session.expire", stripe.checkout.Session.expire, session_id)
+    except Exception:
+        # Already completed or expired, or Stripe is unreachable: a payment that
+        # still lands is refunded when its status is checked
+        logger.warning("Could not expire Checkout Session %s", session_id, exc_info=True)
+
+
+async def _cancel_competition_job(job: dict):
+    """Refund every completed order of a cancelled competition to user balances.
+
+    Orders are streamed in _id order, JOB_CHUNK_SIZE at a time. Each chunk's
+    refunds are summed per user and applied with one bulk_write on users and
+    one on orders. Every chunk has a sequence number. A user's credit is guarded
+    by `refund_marks.<job_id>`, so re-running a chunk after a crash never
+    credits anyone twice.
+    """
+    job_id = job["job_id"]
+    competition_id = job["params"]["competition_id"]
+    checkpoint = job.get("checkpoint") or {}
+    progress = {"orders_refunded": 0, "user_credits": 0, "amount_refunded": 0.0, **(job.get("progress") or {})}
+    after = checkpoint.get("after")
+    seq = checkpoint.get("seq", 0)
+    mark = f"refund_marks.{job_id}"
+
+    while True:
+        query: Dict[str, Any] = {
+            "competition_id": competition_id,
+            # Orders this job already flipped stay in the scan so a retried chunk matches the original
+            "$or": [{"status": "completed"}, {"refund_job_id": job_id}],
+        }
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+
+        orders = await db.orders.find(
+            query,
+            {"_id": 1, "order_id": 1, "user_id": 1, "amount": 1, "balance_used": 1},
+        ).sort([("_id", 1)]).limit(JOB_CHUNK_SIZE).to_list(JOB_CHUNK_SIZE)
+        if not orders:
+            break
+
+        seq += 1
+        credits: Dict[str, float] = {}
+        for order in orders:
+            refund = float(order.get("amount") or 0) + float(order.get("balance_used") or 0)
+            credits[order["user_id"]] = credits.get(order["user_id"], 0.0) + refund
+
+        user_ops = [
+            UpdateOne(
+                {"user_id": user_id, mark: {"$not": {"$gte": seq}}},
+                {"$inc": {"balance": round(amount, 2)}, "$set": {mark: seq}},
+            )
+            for user_id, amount in credits.items()
+        ]
+        user_result = await db.users.bulk_write(user_ops, ordered=False)
+        await record_balance_changes([
+            balance_entry(user_id, amount, "competition_refund", competition_id,
+                          entry_id=f"refund_{job_id}_{seq}_{user_id}")
+            for user_id, amount in credits.items()
+        ])
+
+        refunded_at = datetime.now(timezone.utc).isoformat()
+        order_ops = [
+            UpdateOne(
+                {"_id": order["_id"], "status": "completed"},
+                {"$set": {"status": "refunded", "refund_job_id": job_id, "refunded_at": refunded_at}},
+            )
+            for order in orders
+        ]
+        order_result = await db.orders.bulk_write(order_ops, ordered=False)
+
+        progress["orders_refunded"] += order_result.modified_count
+        progress["user_credits"] += user_result.modified_count
+        progress["amount_refunded"] = round(progress["amount_refunded"] + sum(credits.values()), 2)
+        after = str(orders[-1]["_id"])
+        await checkpoint_job(job_id, {"after": after, "seq": seq}, progress)
+
+    # Checkout sessions that never completed can no longer buy into this competition.
+    # Expire them at Stripe too; one paid anyway is refunded by the status check.
+    while True:
+        pending = await db.orders.find(
+            {"competition_id": competition_id, "status": "pending"},
+            {"_id": 0, "order_id": 1, "stripe_session_id": 1},
+        ).limit(JOB_CHUNK_SIZE).to_list(JOB_CHUNK_SIZE)
+        if not pending:
+            break
+        for order in pending:
+            if order.get("stripe_session_id"):
+                await _expire_checkout_session(order["stripe_session_id"])
+            await close_pending_order(order["order_id"], "cancelled")
+
+
+async def _archive_competition_tickets_job(job: dict):
+    """Move a drawn competition's ticket buckets into `ticket_archive`.
+
+    Buckets are copied by _id (upsert) before the hot copies are deleted, so a
+    batch replayed after a crash does not duplicate archived tickets.
+    """
+    competition_id = job["params"]["competition_id"]
+    progress = {"tickets_archived": 0, **(job.get("progress") or {})}
+
+    while True:
+        buckets = await db.ticket_buckets.find(
+            {"competition_id": competition_id}
+        ).sort([("_id", 1)]).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not buckets:
+            break
+
+        await db.ticket_archive.bulk_write(
+            [ReplaceOne({"_id": bucket["_id"]}, bucket, upsert=True) for bucket in buckets],
+            ordered=False,
+        )
+        await db.ticket_buckets.delete_many({"_id": {"$in": [b["_id"] for b in buckets]}})
+
+        progress["tickets_archived"] += sum(b["ticket_count"] for b in buckets)
+        await checkpoint_job(job["job_id"], None, progress)
+
+    await db.competitions.update_one(
+        {"competition_id": competition_id},
+        {"$set": {"tickets_archived": True, "tickets_archived_at": datetime.now(timezone.utc).isoformat()}},
+    )
+
+
+async def _purge_competition_tickets_job(job: dict):
+    """Delete a deleted competition's tickets (hot and archived) in batches"""
+    competition_id = job["params"]["competition_id"]
+    progress = {"tickets_purged": 0, **(job.get("progress") or {})}
+
+    for collection in (db.ticket_buckets, db.ticket_archive):
+        while True:
+            batch = await collection.find(
+                {"competition_id": competition_id}, {"_id": 1, "ticket_count": 1}
+            ).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+            if not batch:
+                break
+            await collection.delete_many({"_id": {"$in": [b["_id"] for b in batch]}})
+            progress["tickets_purged"] += sum(b["ticket_count"] for b in batch)
+            await checkpoint_job(job["job_id"], None, progress)
+    await db.ticket_entitlements.delete_many({"competition_id": competition_id})
+
+
+async def _bucket_legacy_tickets_job(job: dict):
+    """Fold per-ticket documents from the old `tickets` collection into buckets.
+
+    Works a batch of whole orders at a time: buckets are upserted with
+    $setOnInsert and only then are the legacy documents removed, so a replay
+    after a crash is a no-op for orders already converted. Tickets whose
+    number another order already holds go to `ticket_conflicts`.
+    """
+    progress = {"tickets_converted": 0, "tickets_conflicting": 0, **(job.get("progress") or {})}
+
+    while True:
+        seed = await db.tickets.find({}, {"_id": 0, "order_id": 1}).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not seed:
+            break
+        order_ids = list({t.get("order_id") for t in seed})
+
+        orders: Dict[str, List[dict]] = {}
+        async for ticket in db.tickets.find({"order_id": {"$in": order_ids}}).sort([("_id", 1)]):
+            orders.setdefault(ticket.get("order_id"), []).append(ticket)
+
+        ops, blocks = [], []
+        for order_id, tickets in orders.items():
+            for first in range(0, len(tickets), TICKET_BUCKET_SIZE):
+                block = tickets[first:first + TICKET_BUCKET_SIZE]
+                ops.append(_legacy_bucket_upsert(order_id, first, block))
+                blocks.append((order_id, first, block))
+        conflicts = 0
+        try:
+            await db.ticket_buckets.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in write_errors):
+                raise
+            # Legacy numbers already held by another bucket; the rest of the batch was written
+            for err in write_errors:
+                conflicts += await _bucket_around_conflicts(job["job_id"], *blocks[err["index"]])
+        result = await db.tickets.delete_many({"order_id": {"$in": order_ids}})
+
+        progress["tickets_converted"] += result.deleted_count - conflicts
+        progress["tickets_conflicting"] += conflicts
+        await checkpoint_job(job["job_id"], None, progress)
+
+    # Draws that ended competitions put off while their tickets were being converted
+    async for competition in db.competitions.find({"draw_deferred": True, "winner_id": None}, {"_id": 0}):
+        await _auto_draw(competition)
+        await db.competitions.update_one(
+            {"competition_id": competition["competition_id"]}, {"$unset": {"draw_deferred": ""}}
+        )
+
+
+def _legacy_bucket_upsert(order_id: str, first: int, block: List[dict]) -> UpdateOne:
+    return UpdateOne(
+        {"order_id": order_id, "first_index": first},
+        {"$setOnInsert": {
+            "user_id": block[0]["user_id"],
+            "competition_id": block[0]["competition_id"],
+            "ticket_count": len(block),
+            "numbers": [t["ticket_number"] for t in block],
+            "ticket_ids": [t["ticket_id"] for t in block],
+            "instant_wins": [
+                {"index": i, "prize": t.get("instant_win_prize")}
+                for i, t in enumerate(block) if t.get("is_instant_win")
+            ],
+            "created_at": block[0]["created_at"],
+        }},
+        upsert=True,
+    )
+
+
+async def _bucket_around_conflicts(job_id: str, order_id: str, first: int, block: List[dict]) -> int:
+    """Bucket a legacy block without the numbers another order already holds.
+
+    Those tickets are copied to `ticket_conflicts` for an admin to resolve
+    (refund or renumber) instead of failing the job. Returns how many there were.
+    """
+    taken = set()
+    async for bucket in db.ticket_buckets.find(
+        {
+            "competition_id": block[0]["competition_id"],
+            "numbers": {"$in": [t["ticket_number"] for t in block]},
+            "order_id": {"$ne": order_id},
+        },
+        {"_id": 0, "numbers": 1},
+    ):
+        taken.update(bucket["numbers"])
+
+    kept = [t for t in block if t["ticket_number"] not in taken]
+    conflicting = [t for t in block if t["ticket_number"] in taken]
+    if kept:
+        await db.ticket_buckets.bulk_write([_legacy_bucket_upsert(order_id, first, kept)])
+    for ticket in conflicting:
+        ticket = {k: v for k, v in ticket.items() if k != "_id"}
+        await db.ticket_conflicts.update_one(
+            {"ticket_id": ticket["ticket_id"]},
+            {"$setOnInsert": {**ticket, "reason": "duplicate_number", "job_id": job_id}},
+            upsert=True,
+        )
+    if conflicting:
+        logger.warning(
+            "Legacy order %s: %d ticket(s) with numbers already taken moved to ticket_conflicts",
+            order_id, len(conflicting), extra={"event": "legacy_ticket_conflict"},
+        )
+    return len(conflicting)
+
+
+async def _open_balance_ledger_job(job: dict):
+    """Record an opening_balance entry for balances that predate the ledger.
+
+    Users are walked in _id order; the entry is the balance minus whatever the
+    ledger already holds for the user, under a per-user entry_id so a rerun
+    never opens a balance twice.
+    """
+    progress = {"users_checked": 0, "balances_opened": 0, **(job.get("progress") or {})}
+    after = (job.get("checkpoint") or {}).get("after")
+
+    while True:
+        query: Dict[str, Any] = {"balance": {"$ne": 0}}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        users = await db.users.find(
+            query, {"_id": 1, "user_id": 1, "balance": 1}
+        ).sort([("_id", 1)]).limit(JOB_CHUNK_SIZE).to_list(JOB_CHUNK_SIZE)
+        if not users:
+            break
+
+        sums = {
+            row["_id"]: row["amount"]
+            async for row in db.balance_ledger.aggregate([
+                {"$match": {"user_id": {"$in": [u["user_id"] for u in users]}}},
+                {"$group": {"_id": "$user_id", "amount": {"$sum": "$amount"}}},
+            ])
+        }
+        entries = []
+        for user in users:
+            opening = float(user.get("balance") or 0) - sums.get(user["user_id"], 0.0)
+            if abs(opening) >= 0.005:
+                entries.append(balance_entry(user["user_id"], opening, "opening_balance",
+                                             entry_id=f"opening_{user['user_id']}"))
+        await record_balance_changes(entries)
+
+        progress["users_checked"] += len(users)
+        progress["balances_opened"] += len(entries)
+        after = str(users[-1]["_id"])
+        await checkpoint_job(job["job_id"], {"after": after}, progress)
+
+
+async def _snapshot_balances_job(job: dict):
+    """Snapshot the running balance of every user with ledger movements in [since, cutoff).
+
+    Movements are summed per user on the server and read in user_id order in
+    JOB_CHUNK_SIZE batches; each new snapshot is the user's previous one plus
+    that sum. All snapshots of a run share `as_of` = cutoff.
+    """
+    params = job["params"]
+    since = ObjectId(params["since"]) if params.get("since") else None
+    cutoff = ObjectId(params["cutoff"])
+    progress = {"snapshots": 0, **(job.get("progress") or {})}
+    after = (job.get("checkpoint") or {}).get("after")
+
+    if after is None and since is not None:
+        # Snapshots left by a run that failed part way overlap this window
+        await db.balance_snapshots.delete_many({"as_of": {"$gt": since, "$lt": cutoff}})
+
+    window: Dict[str, Any] = {"$lt": cutoff}
+    if since is not None:
+        window["$gte"] = since
+    match: Dict[str, Any] = {"_id": window}
+    if after:
+        match["user_id"] = {"$gt": after}
+
+    async def _write(batch: List[dict]):
+        previous = {
+            row["_id"]: row["balance"]
+            async for row in db.balance_snapshots.aggregate([
+                {"$match": {"user_id": {"$in": [b["_id"] for b in batch]}, "as_of": {"$lt": cutoff}}},
+                {"$sort": {"as_of": -1}},
+                {"$group": {"_id": "$user_id", "balance": {"$first": "$balance"}}},
+            ])
+        }
+        taken_at = datetime.now(timezone.utc).isoformat()
+        try:
+            await db.balance_snapshots.insert_many([
+                {
+                    "user_id": b["_id"],
+                    "balance": round(previous.get(b["_id"], 0.0) + b["amount"], 2),
+                    "entries": b["entries"],
+                    "as_of": cutoff,
+                    "taken_at": taken_at,
+                }
+                for b in batch
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Replayed batch after a crash: those users already have this run's snapshot
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        progress["snapshots"] += len(batch)
+        await checkpoint_job(job["job_id"], {"after": batch[-1]["_id"]}, progress)
+
+    batch: List[dict] = []
+    async for row in db.balance_ledger.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$user_id", "amount": {"$sum": "$amount"}, "entries": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ], allowDiskUse=True):
+        batch.append(row)
+        if len(batch) >= JOB_CHUNK_SIZE:
+            await _write(batch)
+            batch = []
+    if batch:
+        await _write(batch)
+
+
+async def _reconcile_balances_job(job: dict):
+    """Check every user's latest snapshot against the ledger, and users.balance
+    against that snapshot plus the movements after it.
+
+    Users are read JOB_CHUNK_SIZE at a time; each chunk needs one aggregate on
+    snapshots and one on the ledger. Up to 100 mismatches are kept in progress.
+    """
+    cutoff = ObjectId(job["params"]["cutoff"]) if job["params"].get("cutoff") else None
+    progress = {"users_checked": 0, "snapshot_mismatches": 0, "balance_mismatches": 0, "mismatches": [],
+                **(job.get("progress") or {})}
+    after = (job.get("checkpoint") or {}).get("after")
+
+    while True:
+        query: Dict[str, Any] = {"_id": {"$gt": ObjectId(after)}} if after else {}
+        users = await db.users.find(
+            query, {"_id": 1, "user_id": 1, "balance": 1}
+        ).sort([("_id", 1)]).limit(JOB_CHUNK_SIZE).to_list(JOB_CHUNK_SIZE)
+        if not users:
+            break
+        user_ids = [u["user_id"] for u in users]
+
+        snapshots: Dict[str, float] = {}
+        if cutoff is not None:
+            snapshots = {
+                row["_id"]: row["balance"]
+                async for row in db.balance_snapshots.aggregate([
+                    {"$match": {"user_id": {"$in": user_ids}, "as_of": {"$lte": cutoff}}},
+                    {"$sort": {"as_of": -1}},
+                    {"$group": {"_id": "$user_id", "balance": {"$first": "$balance"}}},
+                ])
+            }
+        before_cutoff = {"$lt": ["$_id", cutoff]} if cutoff is not None else False
+        sums = {
+            row["_id"]: row
+            async for row in db.balance_ledger.aggregate([
+                {"$match": {"user_id": {"$in": user_ids}}},
+                {"$group": {
+                    "_id": "$user_id",
+                    "snapshotted": {"$sum": {"$cond": [before_cutoff, "$amount", 0]}},
+                    "since": {"$sum": {"$cond": [before_cutoff, 0, "$amount"]}},
+                }},
+            ])
+        }
+
+        for user in users:
+            uid = user["user_id"]
+            snapshot = snapshots.get(uid, 0.0)
+            ledger = sums.get(uid) or {"snapshotted": 0.0, "since": 0.0}
+            problems = {}
+            if abs(snapshot - ledger["snapshotted"]) >= 0.005:
+                progress["snapshot_mismatches"] += 1
+                problems["snapshot"] = {"snapshot": snapshot, "ledger": round(ledger["snapshotted"], 2)}
+            expected = snapshot + ledger["since"]
+            if abs(float(user.get("balance") or 0) - expected) >= 0.005:
+                progress["balance_mismatches"] += 1
+                problems["balance"] = {"balance": user.get("balance"), "ledger": round(expected, 2)}
+            if problems and len(progress["mismatches"]) < 100:
+                progress["mismatches"].append({"user_id": uid, **problems})
+
+        progress["users_checked"] += len(users)
+        after = str(users[-1]["_id"])
+        await checkpoint_job(job["job_id"], {"after": after}, progress)
+
+
+JOB_HANDLERS = {
+    "cancel_competition": _cancel_competition_job,
+    "archive_competition_tickets": _archive_competition_tickets_job,
+    "purge_competition_tickets": _purge_competition_tickets_job,
+    "bucket_legacy_tickets": _bucket_legacy_tickets_job,
+    "open_balance_ledger": _open_balance_ledger_job,
+    "snapshot_balances": _snapshot_balances_job,
+    "reconcile_balances": _reconcile_balances_job,
+}
+
+
+@api_router.post("/admin/competitions/{competition_id}/cancel")
+async def cancel_competition(
+    competition_id: str,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Cancel a competition and refund all entrants to their balance (admin only).
+
+    Returns the background job; calling again returns (and resumes) the same job,
+    or starts it if an earlier call cancelled the competition but died before
+    creating it.
+    """
+    await require_admin(_get_admin_password(password, x_admin_password))
+
+    dedupe_key = f"cancel:{competition_id}"
+    existing = await db.admin_jobs.find_one({"dedupe_key": dedupe_key}, {"_id": 0})
+    if existing:
+        return await resume_job(existing)
+
+    competition = await db.competitions.find_one_and_update(
+        {"competition_id": competition_id, "winner_id": None, "status": {"$ne": "cancelled"}},
+        {"$set": {"status": "cancelled"}},
+        projection={"_id": 0, "competition_id": 1},
+    )
+    if not competition:
+        current = await db.competitions.find_one({"competition_id": competition_id}, {"_id": 0, "status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Competition not found")
+        if current.get("status") != "cancelled":
+            raise HTTPException(status_code=400, detail="Winner already drawn")
+    await competition_cache.invalidate_all()
+
+    return await start_job("cancel_competition", {"competition_id": competition_id}, dedupe_key)
+
+
+# ====================== TICKET ARCHIVAL ======================
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get("ARCHIVE_INTERVAL_SECONDS", "3600"))  # 0 disables the sweep
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))  # ticket buckets per batch
+
+
+async def archive_drawn_competitions(older_than_days: int) -> List[dict]:
+    """Start an archival job for every competition drawn more than `older_than_days` ago"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+    jobs = []
+    async for comp in db.competitions.find(
+        {"draw_date": {"$lt": cutoff}, "tickets_archived": {"$ne": True}},
+        {"_id": 0, "competition_id": 1},
+    ):
+        competition_id = comp["competition_id"]
+        jobs.append(await start_job(
+            "archive_competition_tickets",
+            {"competition_id": competition_id},
+            f"archive:{competition_id}",
+        ))
+    return jobs
+
+
+async def _archive_loop():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            await archive_drawn_competitions(ARCHIVE_AFTER_DAYS)
+        except Exception:
+            # Anything escaping here would end the sweep for the life of the worker
+            logger.exception("Ticket archival sweep failed")
+
+
+async def _archived_user_tickets(user_id: str, limit: int = 1000) -> List[dict]:
+    """A user's archived tickets, flagged with `archived: True`"""
+    tickets = await find_tickets({"user_id": user_id}, limit=limit, collection=db.ticket_archive)
+    for ticket in tickets:
+        ticket["archived"] = True
+    return tickets
+
+
+@api_router.post("/admin/maintenance/archive-tickets")
+async def trigger_ticket_archival(
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Archive tickets of competitions drawn more than N days ago now (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+    jobs = await archive_drawn_competitions(older_than_days)
+    return {"jobs": jobs}
+
+
+@api_router.get("/admin/jobs/{job_id}")
+async def get_admin_job(
+    job_id: str,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Get progress of a background admin job (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+
+    job = await db.admin_jobs.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @api_router.get("/admin/analytics")
 async def get_analytics(
     password: str | None = None,
@@ -1516,44 +3608,285 @@ async def get_analytics(
 ):
     """Get platform analytics (admin only)"""
     await require_admin(_get_admin_password(password, x_admin_password))
+    reporting = read_db("analytics")
 
-    try:
-        total_users = await asyncio.wait_for(db.users.count_documents({}), timeout=10)
-        total_competitions = await asyncio.wait_for(db.competitions.count_documents({}), timeout=10)
-        active_competitions = await asyncio.wait_for(
-            db.competitions.count_documents({"status": "active"}),
-            timeout=10,
+    total_users = await db_reads.call("analytics", lambda: reporting.users.count_documents({}))
+    total_competitions = await db_reads.call("analytics", lambda: reporting.competitions.count_documents({}))
+    active_competitions = await db_reads.call(
+        "analytics", lambda: reporting.competitions.count_documents({"status": "active"})
+    )
+    total_orders = await db_reads.call("analytics", lambda: reporting.orders.count_documents({"status": "completed"}))
+    ticket_total = await db_reads.call("analytics", lambda: reporting.ticket_buckets.aggregate(
+        [{"$group": {"_id": None, "total": {"$sum": "$ticket_count"}}}]
+    ).to_list(1))
+    total_tickets = ticket_total[0]["total"] if ticket_total else 0
+
+    pipeline = [
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]
+    revenue_result = await db_reads.call("analytics", lambda: reporting.orders.aggregate(pipeline).to_list(1))
+    total_revenue = revenue_result[0]["total"] if revenue_result else 0
+
+    return {
+        "total_users": total_users,
+        "total_competitions": total_competitions,
+        "active_competitions": active_competitions,
+        "total_orders": total_orders,
+        "total_tickets": total_tickets,
+        "total_revenue": total_revenue
+    }
+
+# ====================== BALANCE LEDGER ======================
+
+BALANCE_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get("BALANCE_SNAPSHOT_INTERVAL_SECONDS", "86400"))  # 0 disables
+# Snapshots stop this far behind now so movements still being written land in the next run
+BALANCE_SNAPSHOT_LAG_SECONDS = 60
+
+
+async def _last_balance_snapshot_cutoff() -> Optional[str]:
+    last = await db.admin_jobs.find_one(
+        {"kind": "snapshot_balances", "status": "completed"},
+        {"_id": 0, "params": 1},
+        sort=[("created_at", -1)],
+    )
+    return last["params"]["cutoff"] if last else None
+
+
+async def start_balance_snapshot() -> dict:
+    """Start (or join) the snapshot run covering movements since the last completed one"""
+    since = await _last_balance_snapshot_cutoff()
+    cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=BALANCE_SNAPSHOT_LAG_SECONDS))
+    return await start_job(
+        "snapshot_balances",
+        {"since": since, "cutoff": str(cutoff)},
+        f"balance-snapshot:{since or 'initial'}",
+    )
+
+
+async def _balance_snapshot_loop():
+    while True:
+        await asyncio.sleep(BALANCE_SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            await start_balance_snapshot()
+        except PyMongoError:
+            logger.exception("Balance snapshot run failed to start")
+
+
+async def _iter_balance_statement(user_id: str, since: Optional[datetime]):
+    """NDJSON statement: opening balance, every movement with the running balance, closing balance.
+
+    With `since`, the statement opens at the user's latest snapshot taken at or
+    before that time instead of at the first movement.
+    """
+    opening, as_of = 0.0, None
+    if since is not None:
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        snapshot = await db.balance_snapshots.find_one(
+            {"user_id": user_id, "as_of": {"$lte": ObjectId.from_datetime(since)}},
+            {"_id": 0, "balance": 1, "as_of": 1},
+            sort=[("as_of", -1)],
         )
-        total_orders = await asyncio.wait_for(
-            db.orders.count_documents({"status": "completed"}),
-            timeout=10,
+        if snapshot:
+            opening, as_of = snapshot["balance"], snapshot["as_of"]
+
+    yield json.dumps({
+        "type": "opening",
+        "balance": opening,
+        "as_of": as_of.generation_time.isoformat() if as_of else None,
+    }) + "\n"
+
+    query: Dict[str, Any] = {"user_id": user_id}
+    if as_of is not None:
+        query["_id"] = {"$gte": as_of}
+    balance = opening
+    async for entry in db.balance_ledger.find(query, {"_id": 0}).sort([("_id", 1)]).batch_size(500):
+        balance += entry["amount"]
+        yield json.dumps({"type": "entry", **entry, "balance": round(balance, 2)}) + "\n"
+
+    yield json.dumps({"type": "closing", "balance": round(balance, 2)}) + "\n"
+
+
+@api_router.get("/user/balance/statement")
+async def get_balance_statement(since: Optional[datetime] = None, user: User = Depends(require_auth)):
+    """Stream the user's balance statement as NDJSON"""
+    return StreamingResponse(_iter_balance_statement(user.user_id, since), media_type="application/x-ndjson")
+
+
+@api_router.get("/admin/users/{user_id}/balance/statement")
+async def get_user_balance_statement(
+    user_id: str,
+    since: Optional[datetime] = None,
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Stream a user's balance statement as NDJSON (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+    return StreamingResponse(_iter_balance_statement(user_id, since), media_type="application/x-ndjson")
+
+
+@api_router.post("/admin/maintenance/balance-snapshot")
+async def trigger_balance_snapshot(
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Snapshot running balances now (admin only)"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+    return await start_balance_snapshot()
+
+
+@api_router.post("/admin/maintenance/reconcile-balances")
+async def trigger_balance_reconciliation(
+    x_admin_password: str | None = Header(default=None, alias="X-Admin-Password"),
+    password: str | None = None,
+):
+    """Check balances and snapshots against the ledger (admin only); mismatches are in the job's progress"""
+    await require_admin(_get_admin_password(password, x_admin_password))
+    return await start_job("reconcile_balances", {"cutoff": await _last_balance_snapshot_cutoff()})
+
+
+# ====================== COMPETITION LIFECYCLE ======================
+
+# Active competitions are ended when their end_date passes. Each worker keeps
+# a min-heap of (end timestamp, competition_id), rebuilt from an indexed query
+# at startup and pushed to on create/update, and sleeps until the earliest
+# one. Entries are never removed in place: when one comes due the competition
+# is re-read, so a moved or deleted competition just leaves a stale entry. The
+# flip is conditional, so with several workers exactly one ends (and draws)
+# each competition.
+AUTO_END_COMPETITIONS = os.environ.get("AUTO_END_COMPETITIONS", "1") == "1"
+AUTO_DRAW_ON_END = os.environ.get("AUTO_DRAW_ON_END", "0") == "1"
+# Picks up competitions created through another worker
+LIFECYCLE_RESYNC_SECONDS = int(os.environ.get("LIFECYCLE_RESYNC_SECONDS", "600"))
+
+_end_heap: List[tuple] = []
+_end_heap_changed = asyncio.Event()
+
+
+def _end_timestamp(end_date) -> float:
+    if isinstance(end_date, str):
+        end_date = datetime.fromisoformat(end_date)
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=timezone.utc)
+    return end_date.timestamp()
+
+
+def schedule_competition_end(competition_id: str, end_date):
+    """Wake the lifecycle scheduler at `end_date` for this competition"""
+    heapq.heappush(_end_heap, (_end_timestamp(end_date), competition_id))
+    _end_heap_changed.set()
+
+
+async def _rebuild_end_heap():
+    _end_heap.clear()
+    async for comp in db.competitions.find(
+        {"status": "active"}, {"_id": 0, "competition_id": 1, "end_date": 1}
+    ):
+        try:
+            _end_heap.append((_end_timestamp(comp["end_date"]), comp["competition_id"]))
+        except (TypeError, ValueError):
+            logger.error("Competition %s has an unreadable end_date %r; not scheduling it",
+                         comp["competition_id"], comp.get("end_date"))
+    heapq.heapify(_end_heap)
+
+
+async def _auto_draw(competition: dict):
+    if await legacy_tickets_pending(competition["competition_id"]):
+        # Drawn by the bucket_legacy_tickets job once every ticket is in a bucket
+        await db.competitions.update_one(
+            {"competition_id": competition["competition_id"]}, {"$set": {"draw_deferred": True}}
         )
-        total_tickets = await asyncio.wait_for(db.tickets.count_documents({}), timeout=10)
+        logger.warning("Draw deferred until legacy tickets are migrated", extra={
+            "event": "competition.draw_deferred", "competition_id": competition["competition_id"],
+        })
+        return
+    winning_ticket = await pick_winning_ticket(competition["competition_id"])
+    if not winning_ticket:
+        return
+    # The ticket may belong to an account deleted since; the draw still stands
+    winner_user = await db.users.find_one(
+        {"user_id": winning_ticket["user_id"]},
+        {"_id": 0, "password": 0}
+    ) or {}
+    winner_id = f"winner_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc).isoformat()
+    # Record the winner before claiming the draw, as draw_winner does, so a
+    # claimed competition always has its winners record
+    await db.winners.insert_one({
+        "winner_id": winner_id,
+        "competition_id": competition["competition_id"],
+        "user_id": winning_ticket["user_id"],
+        "user_email": winner_user.get("email"),
+        "user_name": winner_user.get("name"),
+        "ticket_number": winning_ticket["ticket_number"],
+        "prize_type": competition["prize_type"],
+        "prize_value": competition["prize_value"],
+        "announced_at": now,
+    })
+    claimed = await db.competitions.update_one(
+        {"competition_id": competition["competition_id"], "winner_id": None},
+        {"$set": {"winner_id": winner_id, "draw_date": now}},
+    )
+    if not claimed.modified_count:
+        # An admin drew at the same moment; theirs stands
+        await db.winners.delete_one({"winner_id": winner_id})
+        return
+    await competition_cache.invalidate_all()
+    logger.info("Competition drawn", extra={
+        "event": "competition.drawn", "competition_id": competition["competition_id"], "winner_id": winner_id,
+    })
 
-        pipeline = [
-            {"$match": {"status": "completed"}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]
-        revenue_result = await asyncio.wait_for(db.orders.aggregate(pipeline).to_list(1), timeout=10)
-        total_revenue = revenue_result[0]["total"] if revenue_result else 0
 
-        return {
-            "total_users": total_users,
-            "total_competitions": total_competitions,
-            "active_competitions": active_competitions,
-            "total_orders": total_orders,
-            "total_tickets": total_tickets,
-            "total_revenue": total_revenue
-        }
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Database timeout while computing analytics")
-    except ServerSelectionTimeoutError:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except (AutoReconnect, PyMongoError):
-        raise HTTPException(status_code=503, detail="Database unavailable")
-    except Exception as e:
-        logging.exception("Admin analytics failed")
-        raise HTTPException(status_code=500, detail=f"Admin analytics error: {type(e).__name__}")
+async def end_competition_if_due(competition_id: str) -> bool:
+    """End an active competition whose end_date has passed; True if this call ended it"""
+    competition = await db.competitions.find_one({"competition_id": competition_id}, {"_id": 0})
+    if not competition or competition["status"] != "active":
+        return False
+    if _end_timestamp(competition["end_date"]) > time.time():
+        return False  # end_date moved later; a newer heap entry covers it
+    result = await db.competitions.update_one(
+        {"competition_id": competition_id, "status": "active", "end_date": competition["end_date"]},
+        {"$set": {"status": "ended"}},
+    )
+    if not result.modified_count:
+        return False
+    logger.info("Competition ended", extra={"event": "competition.ended", "competition_id": competition_id})
+    await competition_cache.invalidate_all()
+    if AUTO_DRAW_ON_END and not competition.get("winner_id"):
+        await _auto_draw(competition)
+    return True
+
+
+async def _lifecycle_loop():
+    resync_at = 0.0
+    while True:
+        try:
+            if time.monotonic() >= resync_at:
+                await _rebuild_end_heap()
+                resync_at = time.monotonic() + LIFECYCLE_RESYNC_SECONDS
+            _end_heap_changed.clear()
+            while _end_heap and _end_heap[0][0] <= time.time():
+                _, competition_id = heapq.heappop(_end_heap)
+                try:
+                    await end_competition_if_due(competition_id)
+                except Exception:
+                    # One bad competition must not stop the others; if it is still
+                    # active, the next resync schedules it again
+                    logger.exception("Ending competition %s failed", competition_id)
+        except PyMongoError:
+            logger.exception("Competition lifecycle pass failed")
+            await asyncio.sleep(5)
+            continue
+
+        wait = LIFECYCLE_RESYNC_SECONDS
+        if _end_heap:
+            wait = min(wait, max(0.0, _end_heap[0][0] - time.time()))
+        try:
+            await asyncio.wait_for(_end_heap_changed.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+
 
 # ====================== HEALTHCHECK ======================
 
@@ -1587,7 +3920,78 @@ async def serve_image(filename: str):
     from fastapi.responses import FileResponse
     return FileResponse(file_path)
 
-# CORS Middleware
+@app.get("/metrics")
+async def prometheus_metrics(authorization: str | None = Header(default=None)):
+    """Prometheus scrape endpoint (bearer METRICS_TOKEN required when set)"""
+    token = os.environ.get("METRICS_TOKEN", "").strip()
+    if token and authorization != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+def _rate_limit_identity(scope) -> Optional[str]:
+    """Rate-limit key for requests carrying one of our JWTs (no DB lookup)"""
+    request = Request(scope)
+    token = request.cookies.get("session_token")
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        return None
+    try:
+        return f"user:{jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])['user_id']}"
+    except (jwt.InvalidTokenError, KeyError):
+        return None
+
+# Per-client token buckets: "METHOD /path/prefix=REQUESTS/SECONDS", first match wins.
+RATE_LIMITS = os.environ.get(
+    "RATE_LIMITS",
+    "POST /api/orders/create=10/60,POST /api/auth/login=20/60,POST /api/auth/register=5/300,* /api/admin/=300/60",
+)
+# RATE_LIMIT_BACKEND=mongo shares token buckets through MongoDB; =cache (the
+# default with CACHE_URL) counts fixed windows in the shared cache instead.
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "cache" if CACHE_URL else "memory")
+if RATE_LIMIT_BACKEND == "mongo":
+    rate_limit_store = MongoBucketStore(db.rate_limits)
+elif RATE_LIMIT_BACKEND == "cache":
+    rate_limit_store = CacheCounterStore(cache)
+else:
+    rate_limit_store = MemoryBucketStore()
+# Proxies in front of the app that append to X-Forwarded-For (Render's router is one)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+app.add_middleware(
+    RateLimitMiddleware,
+    rules=parse_rate_limits(RATE_LIMITS),
+    store=rate_limit_store,
+    identify=_rate_limit_identity,
+    trusted_proxies=TRUSTED_PROXY_HOPS,
+)
+
+# Shed load with 503 + Retry-After before the worker falls behind (0 disables a check)
+app.add_middleware(
+    LoadSheddingMiddleware,
+    max_in_flight=int(os.environ.get("SHED_MAX_IN_FLIGHT", "200")),
+    max_loop_lag=float(os.environ.get("SHED_MAX_LOOP_LAG_MS", "1000")) / 1000,
+    # Waiting-room SSE clients wait up to WAITING_ROOM_SSE_SECONDS; they must not starve checkout
+    stream_suffixes=("/queue/events",),
+    max_streams=int(os.environ.get("SHED_MAX_STREAMS", "2000")),
+)
+
+# Per-route request deadlines: "METHOD /path/pattern=SECONDS", first match wins,
+# 0 disables. Pushed down to MongoDB as maxTimeMS; streamed responses need 0.
+REQUEST_DEADLINES = os.environ.get(
+    "REQUEST_DEADLINES",
+    "GET /api/admin/competitions/*/tickets.*=0,GET /api/competitions/*/queue/events=0,"
+    "GET /api/*/balance/statement=0,POST /api/admin/*/bulk*=300,GET /api/admin/analytics=30,"
+    "POST /api/orders/create=25,GET /api/checkout/status/*=25,POST /api/auth/session=20",
+)
+app.add_middleware(
+    DeadlineMiddleware,
+    rules=parse_deadlines(REQUEST_DEADLINES),
+    default_seconds=float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "10")),
+)
+
+# CORS Middleware (outside admission control, so 429/503 responses carry CORS headers)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1603,14 +4007,138 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Per-request DB call accounting (Server-Timing header, N+1 warnings)
+app.add_middleware(DbTimingMiddleware, warn_threshold=int(os.environ.get("DB_CALLS_WARN_THRESHOLD", "25")))
+
+# Structured access log with request IDs; sampled per route via
+# ACCESS_LOG_SAMPLE_RATES="/api/competitions=0.1,/api/health=0"
+app.add_middleware(
+    AccessLogMiddleware,
+    sample_rates=parse_sample_rates(os.environ.get("ACCESS_LOG_SAMPLE_RATES", "")),
+    default_rate=float(os.environ.get("ACCESS_LOG_SAMPLE_RATE", "1.0")),
 )
+
+# Request metrics (outermost, so latency covers every other middleware)
+app.add_middleware(MetricsMiddleware)
+
+# Configure logging: JSON records written off the event loop by a queue listener
+log_listener = configure_logging(os.environ.get("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
+# (collection, keys, options) for every index hot queries or invariants rely on.
+# Unique indexes back correctness (ticket numbers, idempotency keys, webhook
+# dedupe, ledger entries): startup fails without them. The rest only cost speed.
+INDEXES = [
+    # Ticket numbers are unique per competition and stay indexed inside buckets
+    ("ticket_buckets", [("competition_id", 1), ("numbers", 1)], {"unique": True}),
+    # Exports, draws and archival page through a competition's buckets in _id order
+    ("ticket_buckets", [("competition_id", 1), ("_id", 1)], {}),
+    ("ticket_buckets", [("user_id", 1), ("competition_id", 1)], {}),
+    ("ticket_buckets", "order_id", {}),
+    ("tickets", "order_id", {}),
+    # Draws and entitlement checks wait while a competition still has legacy tickets
+    ("tickets", "competition_id", {}),
+    ("ticket_conflicts", "ticket_id", {"unique": True}),
+    # Cancellation refunds stream a competition's orders in _id order
+    ("orders", [("competition_id", 1), ("_id", 1)], {}),
+    ("orders", "order_id", {"unique": True}),
+    ("orders", [("status", 1), ("created_at", 1)], {}),
+    ("admin_jobs", "job_id", {"unique": True}),
+    ("admin_jobs", "dedupe_key", {"unique": True, "partialFilterExpression": {"dedupe_key": {"$type": "string"}}}),
+    ("ticket_archive", [("competition_id", 1), ("_id", 1)], {}),
+    ("ticket_archive", "user_id", {}),
+    ("ticket_entitlements", [("user_id", 1), ("competition_id", 1)], {"unique": True}),
+    ("balance_ledger", "entry_id", {"unique": True}),
+    ("idempotency_keys", "key", {"unique": True}),
+    ("webhook_events", "event_id", {"unique": True}),
+    ("webhook_events", [("status", 1), ("next_attempt_at", 1)], {}),
+    ("idempotency_keys", "expires_at", {"expireAfterSeconds": 0}),
+    ("balance_ledger", [("user_id", 1), ("_id", 1)], {}),
+    ("balance_snapshots", [("user_id", 1), ("as_of", -1)], {"unique": True}),
+    # Lifecycle scheduler rebuilds its heap of end dates from active competitions
+    ("competitions", [("status", 1), ("end_date", 1)], {}),
+    ("waiting_room_entries", "token", {"unique": True}),
+    ("waiting_room_entries", [("competition_id", 1), ("user_id", 1)], {"unique": True}),
+    ("waiting_room_entries", "expires_at", {"expireAfterSeconds": 0}),
+]
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create each index on its own; refuse to start if a unique index can't be built"""
+    missing_unique = []
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except PyMongoError:
+            logger.exception("Index creation failed", extra={
+                "event": "index.create_failed", "collection": collection, "keys": str(keys),
+            })
+            if options.get("unique"):
+                missing_unique.append(f"{collection} {keys}")
+    if isinstance(rate_limit_store, MongoBucketStore):
+        try:
+            await rate_limit_store.ensure_indexes()
+        except PyMongoError:
+            logger.exception("Index creation failed", extra={"event": "index.create_failed"})
+    if missing_unique:
+        # Duplicates would be accepted silently without these: don't serve traffic
+        raise RuntimeError(f"Unique indexes could not be created: {', '.join(missing_unique)}")
+
+
+@app.on_event("startup")
+async def resume_admin_jobs():
+    """Pick up admin jobs whose worker went away before finishing"""
+    try:
+        async for job in db.admin_jobs.find({"status": "running"}, {"_id": 0}):
+            await spawn_job(job)
+        # Convert any per-ticket documents left from before ticket buckets
+        if await db.tickets.find_one({}, {"_id": 1}):
+            await start_job("bucket_legacy_tickets", {}, "bucket-legacy-tickets")
+        # Opening entries for balances that predate the balance ledger (runs once)
+        await start_job("open_balance_ledger", {}, "open-balance-ledger")
+    except PyMongoError:
+        logger.exception("Could not resume admin jobs")
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    app.state.loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("startup")
+async def start_archive_sweep():
+    if ARCHIVE_INTERVAL_SECONDS > 0:
+        app.state.archive_task = asyncio.create_task(_archive_loop())
+
+@app.on_event("startup")
+async def start_webhook_workers():
+    app.state.webhook_tasks = [asyncio.create_task(_webhook_worker()) for _ in range(WEBHOOK_WORKERS)]
+    app.state.webhook_tasks.append(asyncio.create_task(_webhook_sweep()))
+    if PENDING_ORDER_SWEEP_SECONDS > 0:
+        app.state.webhook_tasks.append(asyncio.create_task(_pending_order_sweep()))
+
+@app.on_event("startup")
+async def start_balance_snapshots():
+    if BALANCE_SNAPSHOT_INTERVAL_SECONDS > 0:
+        app.state.balance_snapshot_task = asyncio.create_task(_balance_snapshot_loop())
+
+@app.on_event("startup")
+async def start_competition_lifecycle():
+    if AUTO_END_COMPETITIONS:
+        app.state.lifecycle_task = asyncio.create_task(_lifecycle_loop())
+
+@app.on_event("startup")
+async def start_cache():
+    await cache.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
 
+@app.on_event("shutdown")
+async def close_cache():
+    await cache.close()
+
+@app.on_event("shutdown")
+async def flush_logs():
+    log_listener.stop()
+
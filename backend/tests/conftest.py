@@ -0,0 +1,88 @@
+"""Fixtures running the app in-process against the offline stand-ins in tools/.
+
+The app is imported once per session (it reads its configuration at import
+time); every test starts from an empty fake database. Tests are plain
+functions that drive coroutines through the session's event loop with `run`.
+"""
+import asyncio
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.harness import ADMIN_PASSWORD, asgi_client, load_server, reset_database  # noqa: E402
+
+ADMIN_HEADERS = {"X-Admin-Password": ADMIN_PASSWORD}
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def offline_app():
+    return load_server()
+
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def server(offline_app, run):
+    server, _ = offline_app
+    run(reset_database(server))
+    return server
+
+
+@pytest.fixture
+def stripe(offline_app):
+    return offline_app[1]
+
+
+@pytest.fixture
+def client(server, run):
+    http = asgi_client(server)
+    yield http
+    run(http.aclose())
+
+
+async def create_competition(client, **fields) -> str:
+    body = {
+        "title": "Test prize",
+        "description": "A prize",
+        "prize_type": "cash",
+        "prize_value": 100,
+        "prize_image": "https://example.test/prize.png",
+        "ticket_price": 1,
+        "total_tickets": 100,
+        "end_date": "2030-01-01T00:00:00+00:00",
+        **fields,
+    }
+    response = await client.post("/api/admin/competitions", json=body, headers=ADMIN_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()["competition_id"]
+
+
+async def register_user(client, balance: float = 0, name: str = "Player") -> dict:
+    """Register a user (credited with `balance`); returns {"user_id", "headers"}"""
+    response = await client.post("/api/auth/register", json={
+        "email": f"{uuid.uuid4().hex[:10]}@example.com",
+        "password": "correct-horse",
+        "name": name,
+    })
+    assert response.status_code == 200, response.text
+    user_id = response.json()["user"]["user_id"]
+    if balance:
+        credited = await client.post(
+            f"/api/admin/user/{user_id}/add-balance", json={"amount": balance}, headers=ADMIN_HEADERS
+        )
+        assert credited.status_code == 200, credited.text
+    return {"user_id": user_id, "headers": {"Authorization": f"Bearer {response.json()['token']}"}}
@@ -0,0 +1,88 @@
+import json
+from datetime import timedelta
+
+from conftest import ADMIN_HEADERS, create_competition, register_user
+
+
+def _statement(response) -> list:
+    assert response.status_code == 200, response.text
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+async def _buy_with_balance(client, user, competition_id, count):
+    response = await client.post(
+        "/api/orders/create",
+        json={"competition_id": competition_id, "ticket_count": count, "use_balance": True},
+        headers=user["headers"],
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def _snapshot_now(server, monkeypatch):
+    # A cutoff a little ahead of now, so the movements just written are covered
+    monkeypatch.setattr(server, "BALANCE_SNAPSHOT_LAG_SECONDS", -2)
+    job = await server.start_balance_snapshot()
+    await server._running_jobs[job["job_id"]]
+    return job
+
+
+def test_statement_runs_every_movement_to_the_stored_balance(server, client, run):
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client, balance=5)
+        order = await _buy_with_balance(client, user, competition_id, 2)
+        statement = _statement(await client.get("/api/user/balance/statement", headers=user["headers"]))
+        stored = (await server.db.users.find_one({"user_id": user["user_id"]}))["balance"]
+        return order, statement, stored
+
+    order, statement, stored = run(scenario())
+    opening, *entries, closing = statement
+    assert (opening["type"], opening["balance"]) == ("opening", 0.0)
+    assert [(e["kind"], e["amount"], e["balance"]) for e in entries] == [("admin_credit", 5, 5), ("order", -2, 3)]
+    assert entries[1]["ref"] == order["order_id"]
+    assert closing == {"type": "closing", "balance": 3} and stored == 3
+
+
+def test_statement_since_opens_at_the_latest_snapshot(server, client, run, monkeypatch):
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client, balance=10)
+        await _buy_with_balance(client, user, competition_id, 4)
+        job = await _snapshot_now(server, monkeypatch)
+        since = (server.datetime.now(server.timezone.utc) + timedelta(seconds=5)).isoformat()
+        statement = _statement(await client.get(
+            f"/api/admin/users/{user['user_id']}/balance/statement",
+            params={"since": since},
+            headers=ADMIN_HEADERS,
+        ))
+        snapshot = await server.db.balance_snapshots.find_one({"user_id": user["user_id"]})
+        return job, statement, snapshot
+
+    job, statement, snapshot = run(scenario())
+    assert (snapshot["balance"], snapshot["entries"]) == (6, 2)
+    assert str(snapshot["as_of"]) == job["params"]["cutoff"]
+    assert statement[0]["type"] == "opening" and statement[0]["balance"] == 6
+    assert statement[-1] == {"type": "closing", "balance": 6}
+
+
+def test_reconciliation_reports_a_balance_that_drifted_from_the_ledger(server, client, run, monkeypatch):
+    async def scenario():
+        competition_id = await create_competition(client)
+        honest = await register_user(client, balance=5)
+        drifted = await register_user(client, balance=5)
+        await _buy_with_balance(client, drifted, competition_id, 1)
+        await _snapshot_now(server, monkeypatch)
+        # Written behind the ledger's back
+        await server.db.users.update_one({"user_id": drifted["user_id"]}, {"$inc": {"balance": 7}})
+
+        job = (await client.post("/api/admin/maintenance/reconcile-balances", headers=ADMIN_HEADERS)).json()
+        await server._running_jobs[job["job_id"]]
+        finished = (await client.get(f"/api/admin/jobs/{job['job_id']}", headers=ADMIN_HEADERS)).json()
+        return honest, drifted, finished
+
+    honest, drifted, finished = run(scenario())
+    assert finished["status"] == "completed"
+    progress = finished["progress"]
+    assert (progress["snapshot_mismatches"], progress["balance_mismatches"]) == (0, 1)
+    assert progress["mismatches"] == [{"user_id": drifted["user_id"], "balance": {"balance": 11, "ledger": 4}}]
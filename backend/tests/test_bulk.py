@@ -0,0 +1,50 @@
+from pymongo.errors import AutoReconnect
+
+from conftest import ADMIN_HEADERS, register_user
+
+
+def test_bulk_balance_reports_failed_and_unattempted_rows_after_database_error(server, client, run, monkeypatch):
+    monkeypatch.setattr(server, "BULK_CHUNK_SIZE", 2)
+    users = server.db.users
+    real_bulk_write = users.bulk_write
+    calls = []
+
+    async def flaky_bulk_write(ops, **kwargs):
+        calls.append(len(ops))
+        if len(calls) == 2:
+            raise AutoReconnect("primary stepped down")
+        return await real_bulk_write(ops, **kwargs)
+
+    monkeypatch.setattr(users, "bulk_write", flaky_bulk_write)
+
+    async def scenario():
+        user_ids = [(await register_user(client))["user_id"] for _ in range(5)]
+        return await client.post(
+            "/api/admin/users/bulk-balance",
+            json=[{"user_id": user_id, "amount": 5} for user_id in user_ids],
+            headers=ADMIN_HEADERS,
+        )
+
+    response = run(scenario())
+    assert response.status_code == 200, response.text
+    summary = response.json()
+    assert [r["status"] for r in summary["results"]] == ["credited", "credited", "error", "error", "not_attempted"]
+    assert (summary["succeeded"], summary["failed"], summary["not_attempted"]) == (2, 2, 1)
+    assert calls == [2, 2]
+
+
+def test_bulk_balance_rejects_non_finite_zero_and_oversized_amounts(server, client, run):
+    async def scenario():
+        user_id = (await register_user(client))["user_id"]
+        response = await client.post(
+            "/api/admin/users/bulk-balance",
+            content=f"user_id,amount\n{user_id},nan\n{user_id},inf\n{user_id},0\n{user_id},1e9\n{user_id},2.5\n",
+            headers={**ADMIN_HEADERS, "Content-Type": "text/csv"},
+        )
+        balance = (await server.db.users.find_one({"user_id": user_id}))["balance"]
+        return response, balance
+
+    response, balance = run(scenario())
+    summary = response.json()
+    assert [r["status"] for r in summary["results"]] == ["error"] * 4 + ["credited"]
+    assert balance == 2.5
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from cache import Cache, MemoryBackend, RedisBackend
+from ratelimit import CacheCounterStore, RateRule
+
+
+def test_not_found_is_not_cached(run):
+    namespace = Cache(MemoryBackend()).namespace("competitions", ttl=60)
+
+    async def scenario():
+        async def missing():
+            return None
+
+        async def created():
+            return {"competition_id": "c1"}
+
+        return await namespace.get_or_load("id:c1", missing), await namespace.get_or_load("id:c1", created)
+
+    assert run(scenario()) == (None, {"competition_id": "c1"})
+
+
+def test_invalidate_during_a_load_drops_the_loaded_value(run):
+    namespace = Cache(MemoryBackend()).namespace("users", ttl=60)
+
+    async def scenario():
+        async def load_while_invalidated():
+            # The row changes (and is invalidated) while this stale read is in flight
+            await namespace.invalidate("u1")
+            return {"balance": 0}
+
+        async def fresh():
+            return {"balance": 10}
+
+        stale = await namespace.get_or_load("u1", load_while_invalidated)
+        return stale, await namespace.get_or_load("u1", fresh)
+
+    assert run(scenario()) == ({"balance": 0}, {"balance": 10})
+
+
+def _redis_workers(count, **options):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return [
+        Cache(RedisBackend(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)), **options)
+        for _ in range(count)
+    ]
+
+
+def test_invalidation_reaches_other_workers_local_copies(run):
+    first, second = _redis_workers(2, local_ttl=60)
+
+    async def scenario():
+        await first.start()
+        await second.start()
+        await asyncio.sleep(0.05)  # let the subscriptions settle
+        values = iter([{"title": "Old"}, {"title": "New"}])
+
+        async def load():
+            return next(values)
+
+        one, two = first.namespace("competitions", ttl=60), second.namespace("competitions", ttl=60)
+        await one.get_or_load("id:c1", load)
+        cached = await two.get_or_load("id:c1", load)  # now a local copy on the second worker
+
+        await one.invalidate("id:c1")
+        await asyncio.sleep(0.05)  # pub/sub delivery
+        reloaded = await two.get_or_load("id:c1", load)
+        await first.close()
+        await second.close()
+        return cached, reloaded
+
+    assert run(scenario()) == ({"title": "Old"}, {"title": "New"})
+
+
+def test_cache_counter_store_shares_windows_across_workers(run):
+    first, second = _redis_workers(2)
+    rule = RateRule("orders", "POST", "/api/orders/create", capacity=3, per_seconds=60)
+
+    async def scenario():
+        stores = [CacheCounterStore(first), CacheCounterStore(second)]
+        results = [await stores[i % 2].take("orders|ip:203.0.113.7", rule) for i in range(4)]
+        other = await stores[0].take("orders|ip:198.51.100.1", rule)
+        return results, other
+
+    results, other = run(scenario())
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+    assert results[2][1] == 0 and 0 < results[3][2] <= 60
+    assert other[0] is True
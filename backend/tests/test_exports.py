@@ -0,0 +1,29 @@
+import csv
+import io
+
+from conftest import ADMIN_HEADERS, create_competition, register_user
+
+
+def test_csv_export_keeps_owner_columns_when_owner_cache_is_trimmed(server, client, run, monkeypatch):
+    # Two buckets per batch and an owner cache that overflows after the first batch
+    monkeypatch.setattr(server, "EXPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(server, "EXPORT_USER_CACHE_SIZE", 1)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        users = {name: await register_user(client, balance=10, name=name) for name in ("Ada", "Bob", "Cy")}
+        # Buckets in _id order: Ada, Bob | Ada, Cy
+        for name in ("Ada", "Bob", "Ada", "Cy"):
+            response = await client.post(
+                "/api/orders/create",
+                json={"competition_id": competition_id, "ticket_count": 1, "use_balance": True},
+                headers=users[name]["headers"],
+            )
+            assert response.status_code == 200, response.text
+        return await client.get(f"/api/admin/competitions/{competition_id}/tickets.csv", headers=ADMIN_HEADERS)
+
+    response = run(scenario())
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 4
+    assert all(row["user_name"] and row["user_email"] for row in rows), rows
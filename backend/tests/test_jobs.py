@@ -0,0 +1,117 @@
+from conftest import ADMIN_HEADERS, create_competition, register_user
+
+
+def test_cancel_retry_starts_refund_job_missing_after_a_crash(server, client, run):
+    async def scenario():
+        competition_id = await create_competition(client)
+        # An earlier call marked the competition cancelled and died before creating its job
+        await server.db.competitions.update_one({"competition_id": competition_id}, {"$set": {"status": "cancelled"}})
+        response = await client.post(f"/api/admin/competitions/{competition_id}/cancel", headers=ADMIN_HEADERS)
+        jobs = await server.db.admin_jobs.find({"dedupe_key": f"cancel:{competition_id}"}).to_list(10)
+        return response, jobs
+
+    response, jobs = run(scenario())
+    assert response.status_code == 200, response.text
+    assert response.json()["kind"] == "cancel_competition"
+    assert len(jobs) == 1
+
+
+def test_legacy_bucketing_moves_duplicate_numbers_aside_and_keeps_going(server, client, run):
+    async def scenario():
+        competition_id = await create_competition(client)
+        buyer = await register_user(client, balance=10)
+        response = await client.post(
+            "/api/orders/create",
+            json={"competition_id": competition_id, "ticket_count": 1, "use_balance": True},
+            headers=buyer["headers"],
+        )
+        assert response.status_code == 200, response.text
+        held = (await server.db.ticket_buckets.find_one({"competition_id": competition_id}))["numbers"][0]
+        free = next(n for n in range(1, 101) if n != held)
+
+        legacy = await register_user(client)
+        await server.db.tickets.insert_many([
+            {
+                "ticket_id": f"legacy_{i}",
+                "order_id": order_id,
+                "user_id": legacy["user_id"],
+                "competition_id": competition_id,
+                "ticket_number": number,
+                "created_at": "2024-01-01T00:00:00+00:00",
+            }
+            for i, (order_id, number) in enumerate([("legacy_a", held), ("legacy_a", free), ("legacy_b", free + 1000)])
+        ])
+        await server._bucket_legacy_tickets_job({"job_id": "job_legacy", "progress": {}})
+
+        buckets = await server.db.ticket_buckets.find({"order_id": {"$in": ["legacy_a", "legacy_b"]}}).to_list(10)
+        conflicts = await server.db.ticket_conflicts.find({}).to_list(10)
+        remaining = await server.db.tickets.count_documents({})
+        return held, free, buckets, conflicts, remaining
+
+    held, free, buckets, conflicts, remaining = run(scenario())
+    assert sorted(n for b in buckets for n in b["numbers"]) == [free, free + 1000]
+    assert [(c["ticket_id"], c["ticket_number"]) for c in conflicts] == [("legacy_0", held)]
+    assert remaining == 0
+
+
+def test_startup_fails_when_a_unique_index_cannot_be_built(server, run, monkeypatch):
+    monkeypatch.setattr(server, "INDEXES", [
+        ("index_probe", "key", {"unique": True}),
+        ("index_probe", "other", {}),
+    ])
+
+    async def scenario():
+        # Duplicates written before the index existed block its creation
+        await server.db.index_probe.insert_many([{"key": "a"}, {"key": "a"}])
+        try:
+            await server.ensure_indexes()
+        except RuntimeError as e:
+            error = e
+        else:
+            error = None
+        return error, await server.db.index_probe.index_information()
+
+    error, indexes = run(scenario())
+    assert error is not None and "index_probe" in str(error)
+    # The indexes that could be built still were
+    assert "other_1" in indexes
+
+
+def test_draws_and_new_entitlements_wait_for_legacy_tickets_to_be_bucketed(server, client, run):
+    async def scenario():
+        competition_id = await create_competition(client)
+        legacy = await register_user(client, balance=10)
+        await server.db.tickets.insert_many([
+            {
+                "ticket_id": f"legacy_{number}",
+                "order_id": "legacy_order",
+                "user_id": legacy["user_id"],
+                "competition_id": competition_id,
+                "ticket_number": number,
+                "created_at": "2024-01-01T00:00:00+00:00",
+            }
+            for number in (7, 8)
+        ])
+        draw = await client.post(
+            f"/api/admin/competition/{competition_id}/draw", json={"password": ADMIN_HEADERS["X-Admin-Password"]}
+        )
+        order = await client.post(
+            "/api/orders/create",
+            json={"competition_id": competition_id, "ticket_count": 1, "use_balance": True},
+            headers=legacy["headers"],
+        )
+        competition = await server.db.competitions.find_one({"competition_id": competition_id}, {"_id": 0})
+        await server._auto_draw(competition)
+        deferred = await server.db.competitions.find_one({"competition_id": competition_id}, {"_id": 0})
+
+        await server._bucket_legacy_tickets_job({"job_id": "job_legacy", "progress": {}})
+        drawn = await server.db.competitions.find_one({"competition_id": competition_id}, {"_id": 0})
+        winner = await server.db.winners.find_one({"competition_id": competition_id})
+        return draw, order, deferred, drawn, winner, legacy
+
+    draw, order, deferred, drawn, winner, legacy = run(scenario())
+    assert draw.status_code == order.status_code == 503
+    assert deferred["winner_id"] is None and deferred["draw_deferred"] is True
+    # Drawn once the migration finished, from the converted tickets
+    assert drawn["winner_id"] == winner["winner_id"] and "draw_deferred" not in drawn
+    assert winner["user_id"] == legacy["user_id"] and winner["ticket_number"] in (7, 8)
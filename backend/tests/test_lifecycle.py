@@ -0,0 +1,46 @@
+import asyncio
+
+from conftest import create_competition, register_user
+
+
+def test_lifecycle_loop_survives_a_bad_competition(server, client, run, monkeypatch):
+    monkeypatch.setattr(server, "AUTO_DRAW_ON_END", True)
+
+    async def buy(competition_id, user):
+        response = await client.post(
+            "/api/orders/create",
+            json={"competition_id": competition_id, "ticket_count": 1, "use_balance": True},
+            headers=user["headers"],
+        )
+        assert response.status_code == 200, response.text
+
+    async def scenario():
+        unreadable, orphaned, healthy = [await create_competition(client) for _ in range(3)]
+        gone, player = await register_user(client, balance=10), await register_user(client, balance=10)
+        await buy(orphaned, gone)
+        await buy(healthy, player)
+        await server.db.users.delete_one({"user_id": gone["user_id"]})
+
+        await server.db.competitions.update_one({"competition_id": unreadable}, {"$set": {"end_date": "soon"}})
+        await server.db.competitions.update_many(
+            {"competition_id": {"$in": [orphaned, healthy]}}, {"$set": {"end_date": "2020-01-01T00:00:00+00:00"}}
+        )
+
+        task = asyncio.create_task(server._lifecycle_loop())
+        await asyncio.sleep(0.2)
+        survived = not task.done()
+        task.cancel()
+        competitions = {
+            c["competition_id"]: c
+            async for c in server.db.competitions.find({"competition_id": {"$in": [unreadable, orphaned, healthy]}})
+        }
+        winners = {w["competition_id"]: w async for w in server.db.winners.find({})}
+        return survived, competitions, winners, (unreadable, orphaned, healthy)
+
+    survived, competitions, winners, (unreadable, orphaned, healthy) = run(scenario())
+    assert survived
+    assert competitions[unreadable]["status"] == "active"
+    for competition_id in (orphaned, healthy):
+        assert competitions[competition_id]["status"] == "ended"
+        assert competitions[competition_id]["winner_id"] == winners[competition_id]["winner_id"]
+    assert winners[orphaned]["user_email"] is None
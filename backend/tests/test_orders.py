@@ -0,0 +1,305 @@
+from conftest import ADMIN_HEADERS, create_competition, register_user
+
+
+def test_sweep_expires_stale_pending_orders_whose_session_expired(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        order_ids = []
+        for _ in range(3):
+            response = await client.post(
+                "/api/orders/create",
+                json={"competition_id": competition_id, "ticket_count": 2, "use_balance": False,
+                      "origin_url": "https://grab.example.com"},
+                headers=user["headers"],
+            )
+            assert response.status_code == 200, response.text
+            order_ids.append(response.json()["order_id"])
+        abandoned, open_checkout, recent = order_ids
+
+        await server.db.orders.update_many(
+            {"order_id": {"$in": [abandoned, open_checkout]}}, {"$set": {"created_at": "2020-01-01T00:00:00+00:00"}}
+        )
+        session_id = (await server.db.orders.find_one({"order_id": abandoned}))["stripe_session_id"]
+        stripe.sessions[session_id].status = "expired"
+
+        expired = await server.expire_stale_pending_orders()
+        statuses = {o["order_id"]: o["status"] async for o in server.db.orders.find({})}
+        entitlement = await server.db.ticket_entitlements.find_one(
+            {"user_id": user["user_id"], "competition_id": competition_id}
+        )
+        return expired, statuses, entitlement, order_ids
+
+    expired, statuses, entitlement, (abandoned, open_checkout, recent) = run(scenario())
+    assert expired == 1
+    assert statuses == {abandoned: "expired", open_checkout: "pending", recent: "pending"}
+    assert entitlement["reserved"] == 4
+
+
+def _sessions_for(stripe, idempotency_key):
+    # Checkout Sessions created under the user-scoped Stripe key create-order:<user_id>:<key>
+    return [s for s in stripe.sessions.values() if (s.idempotency_key or "").endswith(f":{idempotency_key}")]
+
+
+def _card_order(competition_id):
+    return {"competition_id": competition_id, "ticket_count": 1, "use_balance": False,
+            "origin_url": "https://grab.example.com"}
+
+
+def test_repeated_idempotency_key_replays_the_first_order(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        headers = {**user["headers"], "Idempotency-Key": "checkout-1"}
+        first = await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+        second = await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+        return first, second, await server.db.orders.count_documents({})
+
+    first, second, orders = run(scenario())
+    assert first.status_code == second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert orders == 1
+    assert len(_sessions_for(stripe, "checkout-1")) == 1
+
+
+def test_taken_over_idempotency_key_reuses_the_order_and_checkout_session(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        headers = {**user["headers"], "Idempotency-Key": "checkout-2"}
+        first = await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+        # The worker died after Stripe answered but before recording the response
+        await server.db.idempotency_keys.update_one(
+            {"key": f"{user['user_id']}:checkout-2"},
+            {"$set": {"status": "in_flight", "response": None, "lease_until": server.datetime(2020, 1, 1, tzinfo=server.timezone.utc)}},
+        )
+        await server.db.payment_transactions.delete_many({})
+        retry = await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+        counts = (
+            await server.db.orders.count_documents({}),
+            await server.db.payment_transactions.count_documents({}),
+        )
+        entitlement = await server.db.ticket_entitlements.find_one(
+            {"user_id": user["user_id"], "competition_id": competition_id}
+        )
+        return first, retry, counts, entitlement
+
+    first, retry, counts, entitlement = run(scenario())
+    assert retry.status_code == 200, retry.text
+    assert "Idempotent-Replayed" not in retry.headers
+    assert retry.json() == first.json()
+    assert counts == (1, 1)
+    assert len(_sessions_for(stripe, "checkout-2")) == 1
+    assert entitlement["reserved"] == 1
+
+
+def test_retry_after_a_temporary_refusal_is_answered_afresh(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+    admitted = []
+
+    async def admission(competition, user_id, token):
+        if not admitted:
+            raise server.HTTPException(status_code=403, detail="Still queued", headers={"Retry-After": "7"})
+
+    monkeypatch.setattr(server, "require_admission", admission)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        headers = {**user["headers"], "Idempotency-Key": "checkout-3"}
+        queued = await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+        admitted.append(True)
+        retry = await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+        return queued, retry
+
+    queued, retry = run(scenario())
+    assert queued.status_code == 403 and queued.headers["Retry-After"] == "7"
+    assert retry.status_code == 200, retry.text
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+def test_replayed_final_client_error_keeps_its_headers(server, client, run, monkeypatch):
+    async def refuse(competition, user_id, token):
+        raise server.HTTPException(status_code=400, detail="Not for sale here", headers={"X-Reason": "region"})
+
+    monkeypatch.setattr(server, "require_admission", refuse)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        headers = {**user["headers"], "Idempotency-Key": "checkout-4"}
+        return [await client.post("/api/orders/create", json=_card_order(competition_id), headers=headers)
+                for _ in range(2)]
+
+    first, replay = run(scenario())
+    assert first.status_code == replay.status_code == 400
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert first.headers["X-Reason"] == replay.headers["X-Reason"] == "region"
+
+
+def test_cancelling_a_competition_expires_its_open_checkout_sessions(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        order = (await client.post("/api/orders/create", json=_card_order(competition_id), headers=user["headers"])).json()
+        job = (await client.post(f"/api/admin/competitions/{competition_id}/cancel", headers=ADMIN_HEADERS)).json()
+        await server._running_jobs[job["job_id"]]
+        return await server.db.orders.find_one({"order_id": order["order_id"]})
+
+    order = run(scenario())
+    assert order["status"] == "cancelled"
+    assert stripe.sessions[order["stripe_session_id"]].status == "expired"
+
+
+def test_payment_for_a_cancelled_competition_is_refunded_not_fulfilled(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        order = (await client.post("/api/orders/create", json=_card_order(competition_id), headers=user["headers"])).json()
+        session_id = (await server.db.orders.find_one({"order_id": order["order_id"]}))["stripe_session_id"]
+        # The buyer pays just as the competition is cancelled, before its job reaches the order
+        await server.db.competitions.update_one({"competition_id": competition_id}, {"$set": {"status": "cancelled"}})
+        stripe.pay(session_id)
+
+        status = (await client.get(f"/api/checkout/status/{session_id}", headers=user["headers"])).json()
+        again = (await client.get(f"/api/checkout/status/{session_id}", headers=user["headers"])).json()
+        return (
+            status,
+            again,
+            await server.db.orders.find_one({"order_id": order["order_id"]}),
+            await server.db.ticket_buckets.count_documents({"order_id": order["order_id"]}),
+            (await server.db.competitions.find_one({"competition_id": competition_id}))["sold_tickets"],
+            stripe.sessions[session_id].payment_intent,
+        )
+
+    status, again, order, buckets, sold, payment_intent = run(scenario())
+    assert status["status"] == again["status"] == "refunded"
+    assert order["status"] == "refunded"
+    assert (buckets, sold) == (0, 0)
+    assert payment_intent in stripe.refunds
+
+
+def test_stale_sweep_moves_past_orders_it_cannot_check(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        gone, abandoned = [
+            (await client.post("/api/orders/create", json=_card_order(competition_id), headers=user["headers"])).json()
+            for _ in range(2)
+        ]
+        # The oldest order points at a session Stripe doesn't know
+        await server.db.orders.update_one(
+            {"order_id": gone["order_id"]},
+            {"$set": {"stripe_session_id": "cs_gone", "created_at": "2020-01-01T00:00:00+00:00"}},
+        )
+        await server.db.orders.update_one(
+            {"order_id": abandoned["order_id"]}, {"$set": {"created_at": "2020-01-02T00:00:00+00:00"}}
+        )
+        session_id = (await server.db.orders.find_one({"order_id": abandoned["order_id"]}))["stripe_session_id"]
+        stripe.sessions[session_id].status = "expired"
+
+        expired = [await server.expire_stale_pending_orders() for _ in range(server.PENDING_ORDER_MAX_SWEEP_ATTEMPTS + 1)]
+        orders = {o["order_id"]: o async for o in server.db.orders.find({})}
+        return expired, orders[gone["order_id"]], orders[abandoned["order_id"]]
+
+    expired, gone, abandoned = run(scenario())
+    assert expired[0] == 1 and abandoned["status"] == "expired"
+    assert gone["status"] == "pending"
+    # Given up on after the maximum number of attempts, not retried on every sweep
+    assert gone["stale_sweep_attempts"] == server.PENDING_ORDER_MAX_SWEEP_ATTEMPTS
+
+
+def test_order_is_priced_against_the_stored_balance_not_the_cached_one(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client, balance=2)
+        assert (await client.get("/api/auth/me", headers=user["headers"])).json()["balance"] == 2
+        # Spent elsewhere; the cached user still shows the old balance
+        await server.db.users.update_one({"user_id": user["user_id"]}, {"$set": {"balance": 0}})
+        response = await client.post(
+            "/api/orders/create", json={**_card_order(competition_id), "ticket_count": 3, "use_balance": True},
+            headers=user["headers"],
+        )
+        assert response.status_code == 200, response.text
+        return await server.db.orders.find_one({"order_id": response.json()["order_id"]})
+
+    order = run(scenario())
+    assert order["balance_used"] == 0
+    assert order["amount"] == 3
+
+
+def test_paid_order_whose_balance_was_spent_meanwhile_is_refunded(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client, balance=2)
+        order = (await client.post(
+            "/api/orders/create", json={**_card_order(competition_id), "ticket_count": 3, "use_balance": True},
+            headers=user["headers"],
+        )).json()
+        session_id = (await server.db.orders.find_one({"order_id": order["order_id"]}))["stripe_session_id"]
+        # The balance the order counted on is spent before the card payment lands
+        await server.db.users.update_one({"user_id": user["user_id"]}, {"$set": {"balance": 1}})
+        stripe.pay(session_id)
+
+        status = (await client.get(f"/api/checkout/status/{session_id}", headers=user["headers"])).json()
+        return (
+            status,
+            await server.db.orders.find_one({"order_id": order["order_id"]}),
+            (await server.db.users.find_one({"user_id": user["user_id"]}))["balance"],
+            await server.db.ticket_buckets.count_documents({"order_id": order["order_id"]}),
+            stripe.sessions[session_id].payment_intent,
+        )
+
+    status, order, balance, buckets, payment_intent = run(scenario())
+    assert order["balance_used"] == 2
+    assert status["status"] == "refunded" and order["status"] == "refunded"
+    assert (balance, buckets) == (1, 0)
+    assert payment_intent in stripe.refunds
+
+
+def test_failed_balance_order_leaves_sold_tickets_untouched(server, client, run, monkeypatch):
+    orders = server.db.orders
+    update_one = orders.update_one
+
+    async def failing_completion(query, update, *args, **kwargs):
+        if update.get("$set", {}).get("status") == "completed":
+            raise server.PyMongoError("primary stepped down")
+        return await update_one(query, update, *args, **kwargs)
+
+    monkeypatch.setattr(orders, "update_one", failing_completion)
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client, balance=5)
+        response = await client.post(
+            "/api/orders/create",
+            json={"competition_id": competition_id, "ticket_count": 2, "use_balance": True},
+            headers=user["headers"],
+        )
+        return (
+            response,
+            (await server.db.competitions.find_one({"competition_id": competition_id}))["sold_tickets"],
+            (await server.db.users.find_one({"user_id": user["user_id"]}))["balance"],
+            await server.db.ticket_buckets.count_documents({"competition_id": competition_id}),
+        )
+
+    response, sold, balance, buckets = run(scenario())
+    assert response.status_code == 500
+    assert (sold, balance, buckets) == (0, 5, 0)
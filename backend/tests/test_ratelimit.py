@@ -0,0 +1,56 @@
+import asyncio
+
+from ratelimit import LoadSheddingMiddleware, client_ip
+
+
+def _scope(*forwarded, client=("10.0.0.9", 4321)):
+    return {"headers": [(b"x-forwarded-for", value.encode()) for value in forwarded], "client": client}
+
+
+def test_client_ip_ignores_hops_the_client_sent():
+    # The client claims 1.2.3.4; Render appends the address it actually saw
+    assert client_ip(_scope("1.2.3.4, 203.0.113.7")) == "203.0.113.7"
+    assert client_ip(_scope("1.2.3.4", "203.0.113.7")) == "203.0.113.7"
+
+
+def test_client_ip_counts_trusted_proxies_from_the_right():
+    assert client_ip(_scope("1.2.3.4, 203.0.113.7, 10.1.1.1"), trusted_proxies=2) == "203.0.113.7"
+
+
+def test_client_ip_falls_back_to_the_peer():
+    assert client_ip(_scope()) == "10.0.0.9"
+    assert client_ip(_scope("1.2.3.4"), trusted_proxies=0) == "10.0.0.9"
+    # Fewer hops than trusted proxies means the chain was not built by them
+    assert client_ip(_scope("1.2.3.4"), trusted_proxies=2) == "10.0.0.9"
+
+
+def test_open_streams_do_not_shed_other_requests(run):
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if scope["path"].endswith("/queue/events"):
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    shedder = LoadSheddingMiddleware(app, max_in_flight=1, stream_suffixes=("/queue/events",), max_streams=1)
+
+    async def call(path):
+        statuses = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        await shedder({"type": "http", "path": path, "method": "GET", "headers": []}, None, send)
+        return statuses[0]
+
+    async def scenario():
+        waiting = asyncio.create_task(call("/api/competitions/c1/queue/events"))
+        await asyncio.sleep(0)
+        checkout = await call("/api/orders/create")
+        second_stream = await call("/api/competitions/c1/queue/events")
+        release.set()
+        return checkout, second_stream, await waiting
+
+    assert run(scenario()) == (200, 503, 200)
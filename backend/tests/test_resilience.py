@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, RetryBudget, Upstream
+
+
+class _Flaky:
+    """Upstream call failing with `error` for its first `failures` calls"""
+
+    def __init__(self, failures: int, error: BaseException = ConnectionError("reset")):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+def _upstream(**kwargs) -> Upstream:
+    return Upstream("test", timeout=1.0, base_delay=0, retry_on=(ConnectionError,), **kwargs)
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_after_a_good_trial(run):
+    upstream = _upstream(max_attempts=1, breaker=CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05))
+    flaky = _Flaky(failures=2)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await upstream.call(flaky)
+        # Open: rejected without reaching the upstream
+        with pytest.raises(CircuitOpenError) as rejected:
+            await upstream.call(flaky)
+        calls_while_open = flaky.calls
+        await asyncio.sleep(0.06)
+        # Half-open: one trial goes through, and its success closes the circuit
+        result = await upstream.call(flaky)
+        return rejected.value, calls_while_open, result
+
+    rejected, calls_while_open, result = run(scenario())
+    assert rejected.upstream == "test" and 0 < rejected.retry_after <= 0.05
+    assert calls_while_open == 2
+    assert result == "ok" and upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_half_open_trial_reopens_the_circuit(run):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    upstream = _upstream(max_attempts=1, breaker=breaker)
+    flaky = _Flaky(failures=2)
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await upstream.call(flaky)
+        await asyncio.sleep(0.06)
+        with pytest.raises(ConnectionError):
+            await upstream.call(flaky)
+        state = breaker.state
+        with pytest.raises(CircuitOpenError):
+            await upstream.call(flaky)
+        return state
+
+    assert run(scenario()) == CircuitBreaker.OPEN
+    assert flaky.calls == 2
+
+
+def test_retries_stop_when_the_budget_runs_out(run):
+    budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+    upstream = _upstream(max_attempts=5, budget=budget,
+                         breaker=CircuitBreaker("test", failure_threshold=100))
+    first, second = _Flaky(failures=10), _Flaky(failures=10)
+
+    async def scenario():
+        for flaky in (first, second):
+            with pytest.raises(ConnectionError):
+                await upstream.call(flaky)
+
+    run(scenario())
+    # One retry was in the budget; after that each call gets a single attempt
+    assert (first.calls, second.calls) == (2, 1)
+
+
+def test_answers_that_are_not_transient_are_neither_retried_nor_counted(run):
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    upstream = _upstream(max_attempts=3, breaker=breaker)
+    rejected = _Flaky(failures=1, error=ValueError("card declined"))
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await upstream.call(rejected)
+
+    run(scenario())
+    assert rejected.calls == 1
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
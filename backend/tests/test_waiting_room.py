@@ -0,0 +1,66 @@
+import time
+
+from conftest import ADMIN_HEADERS, create_competition, register_user
+
+
+def _open_room(client, competition_id):
+    return client.put(
+        f"/api/admin/competitions/{competition_id}/waiting-room",
+        json={"enabled": True, "admit_per_second": 1},
+        headers=ADMIN_HEADERS,
+    )
+
+
+async def _let_queue_drain(server, competition_id):
+    # Pretend the room last refilled a minute ago
+    await server.db.waiting_rooms.update_one({"_id": competition_id}, {"$set": {"updated": time.time() - 60}})
+
+
+def test_expired_admission_can_rejoin_the_queue(server, client, run):
+    async def scenario():
+        competition_id = await create_competition(client)
+        assert (await _open_room(client, competition_id)).status_code == 200
+        user = await register_user(client, balance=10)
+        queue = f"/api/competitions/{competition_id}/queue"
+
+        joined = (await client.post(queue, headers=user["headers"])).json()
+        await _let_queue_drain(server, competition_id)
+        admitted = (await client.get(queue, params={"token": joined["token"]})).json()
+        assert admitted["admitted"] is True
+
+        await server.db.waiting_room_entries.update_one(
+            {"token": joined["token"]}, {"$set": {"admitted_until": time.time() - 1}}
+        )
+        order = {"competition_id": competition_id, "ticket_count": 1, "use_balance": True}
+        headers = {**user["headers"], "X-Waiting-Room-Token": joined["token"]}
+        refused = await client.post("/api/orders/create", json=order, headers=headers)
+        assert refused.status_code == 403
+
+        rejoined = (await client.post(queue, headers=user["headers"])).json()
+        await _let_queue_drain(server, competition_id)
+        bought = await client.post("/api/orders/create", json=order, headers=headers)
+        return joined, rejoined, bought
+
+    joined, rejoined, bought = run(scenario())
+    assert rejoined["token"] == joined["token"]
+    assert rejoined["position"] > joined["position"]
+    assert bought.status_code == 200, bought.text
+
+
+def test_polling_the_queue_does_not_write_the_room(server, client, run):
+    async def scenario():
+        competition_id = await create_competition(client)
+        await _open_room(client, competition_id)
+        first, second = await register_user(client), await register_user(client)
+        queue = f"/api/competitions/{competition_id}/queue"
+        await client.post(queue, headers=first["headers"])
+        token = (await client.post(queue, headers=second["headers"])).json()["token"]
+
+        before = await server.db.waiting_rooms.find_one({"_id": competition_id})
+        statuses = [(await client.get(queue, params={"token": token})).json() for _ in range(3)]
+        after = await server.db.waiting_rooms.find_one({"_id": competition_id})
+        return before, after, statuses
+
+    before, after, statuses = run(scenario())
+    assert before == after
+    assert all(not s["admitted"] and s["position"] == 2 for s in statuses)
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import timedelta
+
+from conftest import create_competition, register_user
+from tools.fake_stripe import webhook_payload
+
+
+def _due_event(server, event_id: str, **fields) -> dict:
+    return {
+        "event_id": event_id,
+        "event": {"id": event_id, "type": "checkout.session.completed", "data": {"object": {"id": "cs_missing"}}},
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": server.datetime.now(server.timezone.utc) - timedelta(seconds=1),
+        **fields,
+    }
+
+
+def test_sweep_leaves_due_events_alone_while_the_queue_is_full(server, run, monkeypatch):
+    async def scenario():
+        await server.db.webhook_events.insert_many([_due_event(server, f"evt_{i}") for i in range(3)])
+        full = asyncio.Queue(maxsize=1)
+        full.put_nowait("evt_busy")
+        monkeypatch.setattr(server, "_webhook_queue", full)
+        skipped = await server.requeue_due_webhook_events()
+
+        roomy = asyncio.Queue(maxsize=2)
+        monkeypatch.setattr(server, "_webhook_queue", roomy)
+        queued = await server.requeue_due_webhook_events()
+        return skipped, full.qsize(), queued, roomy.qsize()
+
+    skipped, full_size, queued, roomy_size = run(scenario())
+    assert (skipped, full_size) == (0, 1)
+    # Only as many as there are free slots
+    assert (queued, roomy_size) == (2, 2)
+
+
+def test_failing_event_backs_off_then_is_dead_lettered(server, run, monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_MAX_ATTEMPTS", 3)
+
+    async def broken_handler(event):
+        raise RuntimeError("downstream unavailable")
+
+    monkeypatch.setattr(server, "_handle_stripe_event", broken_handler)
+
+    async def scenario():
+        await server.db.webhook_events.insert_one(_due_event(server, "evt_broken"))
+        delays, statuses = [], []
+        for _ in range(4):
+            await server._process_webhook_event("evt_broken")
+            record = await server.db.webhook_events.find_one({"event_id": "evt_broken"})
+            statuses.append((record["status"], record["attempts"]))
+            delays.append((record["next_attempt_at"] - server.datetime.now(server.timezone.utc)).total_seconds())
+            # Not due yet: a second attempt straight away is a no-op
+            await server._process_webhook_event("evt_broken")
+            assert (await server.db.webhook_events.find_one({"event_id": "evt_broken"}))["attempts"] == record["attempts"]
+            await server.db.webhook_events.update_one(
+                {"event_id": "evt_broken"},
+                {"$set": {"next_attempt_at": server.datetime.now(server.timezone.utc) - timedelta(seconds=1)}},
+            )
+        return delays, statuses, record
+
+    delays, statuses, record = run(scenario())
+    assert statuses == [("pending", 1), ("pending", 2), ("failed", 3), ("failed", 3)]
+    # 2s then 4s, each within the +/-25% jitter
+    assert 1.4 < delays[0] <= 2.5 and 2.9 < delays[1] <= 5.0
+    assert record["last_error"] == "RuntimeError: downstream unavailable"
+
+
+def test_redelivered_event_is_stored_once_and_closes_the_order(server, client, stripe, run, monkeypatch):
+    monkeypatch.setattr(stripe, "auto_pay", False)
+    monkeypatch.setattr(server, "_webhook_queue", asyncio.Queue(maxsize=10))
+
+    async def scenario():
+        competition_id = await create_competition(client)
+        user = await register_user(client)
+        order = (await client.post(
+            "/api/orders/create",
+            json={"competition_id": competition_id, "ticket_count": 2, "use_balance": False,
+                  "origin_url": "https://grab.example.com"},
+            headers=user["headers"],
+        )).json()
+        session_id = (await server.db.orders.find_one({"order_id": order["order_id"]}))["stripe_session_id"]
+        stripe.sessions[session_id].status = "expired"
+
+        body, headers = webhook_payload(session_id, "checkout.session.expired")
+        first = (await client.post("/api/webhook/stripe", content=body, headers=headers)).json()
+        again = (await client.post("/api/webhook/stripe", content=body, headers=headers)).json()
+        event_id = await server._webhook_queue.get()
+        await server._process_webhook_event(event_id)
+        return (
+            first,
+            again,
+            server._webhook_queue.qsize(),
+            await server.db.webhook_events.find_one({"event_id": event_id}),
+            await server.db.orders.find_one({"order_id": order["order_id"]}),
+        )
+
+    first, again, still_queued, record, order = run(scenario())
+    assert first == {"received": True, "verified": True}
+    assert again["duplicate"] is True and still_queued == 0
+    assert (record["status"], record["attempts"]) == ("done", 1)
+    assert order["status"] == "expired"
@@ -0,0 +1,4 @@
+"""Offline tooling for the API: in-memory Mongo/Stripe stand-ins, benchmarks,
+load tests and dataset generation. Run modules from backend/, e.g.
+`python -m tools.bench`.
+"""
@@ -0,0 +1,339 @@
+"""Offline benchmarks for the API's hot paths.
+
+    cd backend && python -m tools.bench [--mongo-url mongodb://localhost:27017] [--out bench.json]
+
+Runs against the in-memory FakeDatabase by default (or a throwaway database on
+a local mongod) with a fake Stripe, and prints one JSON document so results
+can be diffed across commits. Each benchmark reports latency percentiles and
+the number of DB round trips per call.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from tools import dataset
+from tools.harness import ADMIN_PASSWORD, asgi_client, load_server, reset_database, server_timing_db_calls
+
+from metrics import collect_db_stats
+
+server = None  # set by main(); tools.harness must import server.py first
+
+
+def _summary(name: str, params: dict, samples: List[float], db_calls: List[int], **extra) -> dict:
+    samples_ms = sorted(s * 1000 for s in samples)
+    q = statistics.quantiles(samples_ms, n=100, method="inclusive") if len(samples_ms) > 1 else samples_ms * 99
+    result = {
+        "name": name,
+        "params": params,
+        "iterations": len(samples),
+        "mean_ms": round(statistics.fmean(samples_ms), 3),
+        "p50_ms": round(q[49], 3),
+        "p95_ms": round(q[94], 3),
+        "max_ms": round(samples_ms[-1], 3),
+        "ops_per_sec": round(len(samples) / sum(samples), 1) if sum(samples) else None,
+        "db_calls_per_op": round(statistics.fmean(db_calls), 2) if db_calls else None,
+    }
+    result.update(extra)
+    return result
+
+
+async def _measure(fn: Callable[[], Awaitable[Optional[int]]], iterations: int, warmup: int = 2,
+                   setup: Optional[Callable[[], Awaitable[None]]] = None):
+    """Time `fn` (which returns its DB call count, if known); `setup` runs untimed before each call"""
+    samples, db_calls = [], []
+    for i in range(warmup + iterations):
+        if setup:
+            await setup()
+        with collect_db_stats() as stats:
+            start = time.perf_counter()
+            reported = await fn()
+            elapsed = time.perf_counter() - start
+        if i >= warmup:
+            samples.append(elapsed)
+            db_calls.append(reported if reported is not None else stats.calls)
+    return samples, db_calls
+
+
+# ---------------------------------------------------------------- seeding
+
+rng = random.Random(1)
+_competition_seq = 10_000  # ticket_number() namespace, clear of the background dataset's
+
+
+async def seed_users(count: int, balance: float = 0.0) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    users = [dataset.user_doc(rng, now, balance) for _ in range(count)]
+    await server.db.users.insert_many([dict(u) for u in users])
+    return users
+
+
+async def seed_competition(total_tickets: int, status: str = "active", **overrides) -> dict:
+    competition = dataset.competition_doc(rng, datetime.now(timezone.utc), total_tickets, status=status,
+                                          max_tickets_per_user=total_tickets, **overrides)
+    await server.db.competitions.insert_one(dict(competition))
+    return competition
+
+
+async def seed_tickets(competition: dict, users: List[dict], tickets: int, order_size: int = 1000):
+    """Sell `tickets` tickets in completed orders spread over `users`"""
+    global _competition_seq
+    _competition_seq += 1
+    now = datetime.now(timezone.utc)
+    orders, buckets = [], []
+    for first in range(0, tickets, order_size):
+        n = min(order_size, tickets - first)
+        order = dataset.order_doc(rng, rng.choice(users), competition, n, now)
+        orders.append(order)
+        buckets += dataset.ticket_buckets(order, [dataset.ticket_number(_competition_seq, first + i) for i in range(n)])
+    await server.db.orders.insert_many(orders)
+    await server.db.ticket_buckets.insert_many(buckets)
+    await server.db.competitions.update_one(
+        {"competition_id": competition["competition_id"]}, {"$inc": {"sold_tickets": tickets}}
+    )
+
+
+# ---------------------------------------------------------------- benchmarks
+
+async def bench_generate_tickets(order_sizes: List[int], iterations: int) -> List[dict]:
+    users = await seed_users(10)
+    results = []
+    for size in order_sizes:
+        competition = await seed_competition(10_000_000)
+        runs = max(3, min(iterations, 20_000 // size))
+
+        async def run():
+            await server.generate_tickets(
+                rng.choice(users)["user_id"], competition["competition_id"],
+                f"order_{uuid.uuid4().hex[:12]}", size, competition,
+            )
+
+        samples, calls = await _measure(run, runs)
+        results.append(_summary(
+            "generate_tickets", {"order_size": size}, samples, calls,
+            tickets_per_sec=round(size * len(samples) / sum(samples)),
+        ))
+    return results
+
+
+async def bench_draw(ticket_counts: List[int], iterations: int, http) -> List[dict]:
+    users = await seed_users(200)
+    results = []
+    for count in ticket_counts:
+        competition = await seed_competition(count)
+        await seed_tickets(competition, users, count)
+        competition_id = competition["competition_id"]
+
+        async def pick():
+            await server.pick_winning_ticket(competition_id)
+
+        samples, calls = await _measure(pick, iterations)
+        results.append(_summary("pick_winning_ticket", {"tickets": count}, samples, calls))
+
+        async def undraw():
+            await server.db.winners.delete_many({"competition_id": competition_id})
+            await server.db.competitions.update_one(
+                {"competition_id": competition_id},
+                {"$set": {"winner_id": None, "status": "active", "draw_date": None}},
+            )
+
+        async def draw():
+            response = await http.post(f"/api/admin/competition/{competition_id}/draw",
+                                       json={"password": ADMIN_PASSWORD})
+            response.raise_for_status()
+            return server_timing_db_calls(response)
+
+        samples, calls = await _measure(draw, iterations, setup=undraw)
+        results.append(_summary("draw_winner", {"tickets": count}, samples, calls))
+    return results
+
+
+def _request(headers: dict):
+    from starlette.requests import Request
+
+    return Request({
+        "type": "http", "method": "GET", "path": "/api/auth/me", "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    })
+
+
+async def bench_current_user(user_count: int, iterations: int) -> List[dict]:
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    users = await seed_users(user_count)
+    user = rng.choice(users)
+    token = server.create_jwt_token(user["user_id"], user["email"])
+    session_token = f"session_{uuid.uuid4().hex}"
+    await server.db.user_sessions.insert_one({
+        "user_id": user["user_id"], "session_token": session_token,
+        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+    })
+
+    bearer = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    async def via_bearer():
+        assert await server.get_current_user(_request({}), bearer)
+
+    async def via_session_cookie():
+        assert await server.get_current_user(_request({"Cookie": f"session_token={session_token}"}), None)
+
+    results = []
+    for name, fn in (("bearer_jwt", via_bearer), ("session_cookie", via_session_cookie)):
+        samples, calls = await _measure(fn, iterations)
+        results.append(_summary("get_current_user", {"auth": name, "users": user_count}, samples, calls))
+    return results
+
+
+async def bench_list_endpoints(competitions: int, iterations: int, http) -> List[dict]:
+    users = await seed_users(50)
+    now = datetime.now(timezone.utc)
+    comps = []
+    for _ in range(competitions):
+        status = rng.choice(["active", "active", "ended"])
+        drawn = {"winner_id": f"winner_{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}",
+                 "draw_date": now.isoformat()} if status == "ended" else {}
+        comps.append(await seed_competition(10_000, status=status, **drawn))
+    buyer = users[0]
+    for competition in comps[:10]:
+        await seed_tickets(competition, [buyer], 100, order_size=100)
+    winners = [
+        dataset.winner_doc(c, rng.choice(users), server.generate_ticket_number())
+        for c in comps[:50] if c["winner_id"]
+    ]
+    if winners:
+        await server.db.winners.insert_many(winners)
+
+    auth = {"Authorization": f"Bearer {server.create_jwt_token(buyer['user_id'], buyer['email'])}"}
+    admin = {"X-Admin-Password": ADMIN_PASSWORD}
+    endpoints = [
+        ("/api/competitions", {}),
+        ("/api/competitions?sort=ending_soon", {}),
+        ("/api/competitions/featured", {}),
+        (f"/api/competitions/{comps[0]['competition_id']}", {}),
+        ("/api/winners", {}),
+        ("/api/user/tickets", auth),
+        ("/api/user/entries", auth),
+        ("/api/admin/competitions", admin),
+    ]
+    results = []
+    for path, headers in endpoints:
+        size = 0
+
+        async def get():
+            nonlocal size
+            response = await http.get(path, headers=headers)
+            response.raise_for_status()
+            size = len(response.content)
+            return server_timing_db_calls(response)
+
+        samples, calls = await _measure(get, iterations)
+        results.append(_summary("list_endpoint", {"path": path, "competitions": competitions}, samples, calls,
+                                response_bytes=size))
+    return results
+
+
+async def bench_analytics(iterations: int, http) -> List[dict]:
+    # Runs last, so it sees everything the other benchmarks seeded
+    counts = {name: await server.db[name].count_documents({})
+              for name in ("users", "competitions", "orders", "ticket_buckets")}
+
+    async def get():
+        response = await http.get("/api/admin/analytics", headers={"X-Admin-Password": ADMIN_PASSWORD})
+        response.raise_for_status()
+        return server_timing_db_calls(response)
+
+    samples, calls = await _measure(get, iterations)
+    return [_summary("get_analytics", counts, samples, calls)]
+
+
+# ---------------------------------------------------------------- runner
+
+BENCHMARKS = ("generate_tickets", "draw", "current_user", "list_endpoints", "analytics")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    await reset_database(server)
+    if args.background_tickets:
+        # Realistic surrounding volume, so queries run against more than the benchmark's own rows
+        await dataset.load(server.db, dataset.DatasetSpec(
+            users=args.background_users, competitions=args.background_competitions,
+            tickets=args.background_tickets, seed=args.seed,
+        ))
+    selected = set(args.only.split(",")) if args.only else set(BENCHMARKS)
+    results = []
+    async with asgi_client(server) as http:
+        if "generate_tickets" in selected:
+            results += await bench_generate_tickets([int(n) for n in args.order_sizes.split(",")], args.iterations)
+        if "draw" in selected:
+            results += await bench_draw([int(n) for n in args.ticket_counts.split(",")], args.iterations, http)
+        if "current_user" in selected:
+            results += await bench_current_user(args.users, args.iterations)
+        if "list_endpoints" in selected:
+            results += await bench_list_endpoints(args.competitions, args.iterations, http)
+        if "analytics" in selected:
+            results += await bench_analytics(args.iterations, http)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "backend": "mongod" if args.mongo_url else "fake",
+            "db_latency_ms": args.db_latency_ms,
+            "background": {"users": args.background_users, "competitions": args.background_competitions,
+                           "tickets": args.background_tickets} if args.background_tickets else None,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    global server
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mongo-url", help="use a local mongod instead of the in-memory fake")
+    parser.add_argument("--db-name", default="grab_bench", help="database to (re)create on --mongo-url")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="simulated round-trip time for the fake")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--order-sizes", default="1,10,100,1000,5000")
+    parser.add_argument("--ticket-counts", default="1000,10000,100000")
+    parser.add_argument("--users", type=int, default=10000, help="users in the collection for get_current_user")
+    parser.add_argument("--competitions", type=int, default=200)
+    parser.add_argument("--background-tickets", type=int, default=0, help="load a tools.dataset dataset first")
+    parser.add_argument("--background-users", type=int, default=10000)
+    parser.add_argument("--background-competitions", type=int, default=100)
+    parser.add_argument("--only", help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    rng.seed(args.seed)
+    server, _ = load_server(args.mongo_url, args.db_name, db_latency=args.db_latency_ms / 1000)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+    server.log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Synthetic dataset generator for scale testing.
+
+    cd backend && python -m tools.dataset --mongo-url mongodb://localhost:27017 \\
+        --db-name grab_scale --users 200000 --competitions 500 --tickets 10000000 --drop
+
+Generates users, competitions, orders, ticket buckets, payment transactions
+and winners in the shapes server.py writes, with realistic skew: a few hot
+competitions take most of the sales and a small set of whale buyers place
+most of the large orders. Batches are written with `insert_many` from several
+concurrent tasks. The app creates its indexes on startup, so load first and
+start the API afterwards.
+
+The document builders are shared with tools.bench and tools.loadtest.
+"""
+import argparse
+import asyncio
+import random
+import string
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import bcrypt
+
+# Every generated user can log in with this password
+DATASET_PASSWORD = "dataset-password"
+_PASSWORD_HASH = None
+
+PRIZE_TYPES = ["cash", "car", "tech", "luxury"]
+_ALPHABET = string.ascii_uppercase + string.digits
+_NUMBER_SPACE = len(_ALPHABET) ** 8
+
+
+def _password_hash() -> str:
+    # One bcrypt round for the whole dataset instead of one per user
+    global _PASSWORD_HASH
+    if _PASSWORD_HASH is None:
+        _PASSWORD_HASH = bcrypt.hashpw(DATASET_PASSWORD.encode(), bcrypt.gensalt()).decode()
+    return _PASSWORD_HASH
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+
+# ---------------------------------------------------------------- shapes
+
+def user_doc(rng: random.Random, now: datetime, balance: float = 0.0, index: Optional[int] = None) -> dict:
+    suffix = uuid.UUID(int=rng.getrandbits(128)).hex[:12]
+    return {
+        "user_id": f"user_{suffix}",
+        "email": f"user{index if index is not None else suffix}@example.com",
+        "name": f"Dataset User {index if index is not None else suffix}",
+        "password": _password_hash(),
+        "picture": None,
+        "balance": balance,
+        "is_admin": False,
+        "created_at": _iso(now - timedelta(days=rng.uniform(0, 365))),
+    }
+
+
+def competition_doc(rng: random.Random, now: datetime, total_tickets: int, status: str = "active",
+                    sold_tickets: int = 0, **overrides) -> dict:
+    created = now - timedelta(days=rng.uniform(1, 90))
+    if status == "active":
+        end = now + timedelta(days=rng.uniform(1, 30))
+    else:
+        end = created + timedelta(days=rng.uniform(1, (now - created).days or 1))
+    doc = {
+        "competition_id": f"comp_{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}",
+        "title": f"Win a {rng.choice(PRIZE_TYPES)} prize",
+        "description": "Generated competition",
+        "prize_type": rng.choice(PRIZE_TYPES),
+        "prize_value": float(rng.choice([100, 500, 1000, 5000, 10000, 25000, 50000])),
+        "prize_image": "/api/images/placeholder.jpg",
+        "ticket_price": rng.choice([0.49, 0.99, 1.99, 2.99, 4.99]),
+        "total_tickets": total_tickets,
+        "sold_tickets": sold_tickets,
+        "max_tickets_per_user": max(10, min(total_tickets, 500)),
+        "end_date": _iso(end),
+        "status": status,
+        "is_instant_win": False,
+        "instant_win_prizes": [],
+        "facebook_live_url": None,
+        "winner_id": None,
+        "draw_date": None,
+        "created_at": _iso(created),
+    }
+    doc.update(overrides)
+    return doc
+
+
+def ticket_number(competition_seq: int, n: int) -> str:
+    """The n-th distinct ticket number of a competition.
+
+    An affine permutation of the 8-character space, so numbers look random,
+    never repeat within a competition, and need no bookkeeping.
+    """
+    value = (n * 2_654_435_761 + competition_seq * 97_531) % _NUMBER_SPACE
+    chars = []
+    for _ in range(8):
+        value, r = divmod(value, len(_ALPHABET))
+        chars.append(_ALPHABET[r])
+    return "".join(chars)
+
+
+def order_doc(rng: random.Random, user: dict, competition: dict, ticket_count: int, created_at: datetime,
+              status: str = "completed", stripe_paid: bool = True) -> dict:
+    order_id = f"order_{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}"
+    amount = round(ticket_count * competition["ticket_price"], 2)
+    return {
+        "order_id": order_id,
+        "user_id": user["user_id"],
+        "competition_id": competition["competition_id"],
+        "ticket_count": ticket_count,
+        "amount": amount if stripe_paid else 0.0,
+        "balance_used": 0.0 if stripe_paid else amount,
+        "status": status,
+        "stripe_session_id": f"cs_test_{uuid.UUID(int=rng.getrandbits(128)).hex}" if stripe_paid else None,
+        # Same ids server._bucket_ticket_id() gives bucketed tickets
+        "tickets": [f"ticket_{order_id.split('_', 1)[-1]}_{i}" for i in range(ticket_count)] if status == "completed" else [],
+        "created_at": _iso(created_at),
+    }
+
+
+def ticket_buckets(order: dict, numbers: List[str], bucket_size: int = 1000) -> List[dict]:
+    return [
+        {
+            "order_id": order["order_id"],
+            "user_id": order["user_id"],
+            "competition_id": order["competition_id"],
+            "first_index": first,
+            "ticket_count": len(numbers[first:first + bucket_size]),
+            "numbers": numbers[first:first + bucket_size],
+            "instant_wins": [],
+            "created_at": order["created_at"],
+        }
+        for first in range(0, len(numbers), bucket_size)
+    ]
+
+
+def transaction_doc(rng: random.Random, order: dict) -> dict:
+    return {
+        "transaction_id": f"txn_{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}",
+        "user_id": order["user_id"],
+        "order_id": order["order_id"],
+        "amount": order["amount"],
+        "currency": "gbp",
+        "status": "completed" if order["status"] == "completed" else "pending",
+        "stripe_session_id": order["stripe_session_id"],
+        "metadata": {
+            "order_id": order["order_id"],
+            "user_id": order["user_id"],
+            "competition_id": order["competition_id"],
+            "ticket_count": str(order["ticket_count"]),
+            "balance_used": str(order["balance_used"]),
+        },
+        "created_at": order["created_at"],
+        "updated_at": order["created_at"],
+    }
+
+
+def winner_doc(competition: dict, user: dict, number: str) -> dict:
+    return {
+        "winner_id": competition["winner_id"],
+        "competition_id": competition["competition_id"],
+        "user_id": user["user_id"],
+        "user_email": user["email"],
+        "user_name": user["name"],
+        "ticket_number": number,
+        "prize_type": competition["prize_type"],
+        "prize_value": competition["prize_value"],
+        "announced_at": competition["draw_date"],
+    }
+
+
+# ---------------------------------------------------------------- dataset
+
+@dataclass
+class DatasetSpec:
+    users: int = 1000
+    competitions: int = 50
+    tickets: int = 100_000
+    hot_competitions: int = 3
+    hot_share: float = 0.6  # share of all tickets sold by the hot competitions
+    whale_share: float = 0.01  # fraction of users who are whales
+    whale_tickets: float = 0.4  # share of tickets bought by whales
+    ended_share: float = 0.3  # fraction of the other competitions already ended and drawn
+    pending_share: float = 0.05  # orders abandoned at checkout
+    balance_share: float = 0.1  # completed orders paid from balance rather than Stripe
+    max_order: int = 100
+    seed: int = 1
+
+
+def _split(total: int, weights: List[float]) -> List[int]:
+    scale = sum(weights)
+    counts = [int(total * w / scale) for w in weights]
+    counts[0] += total - sum(counts)
+    return counts
+
+
+def generate(spec: DatasetSpec, batch_size: int = 1000) -> Iterator[Tuple[str, List[dict]]]:
+    """Yield (collection, batch of documents) covering the whole dataset"""
+    rng = random.Random(spec.seed)
+    now = datetime.now(timezone.utc)
+
+    users = [user_doc(rng, now, balance=round(rng.choice([0, 0, 0, 5, 10, 25]), 2), index=i)
+             for i in range(spec.users)]
+    whales = users[:max(1, int(spec.users * spec.whale_share))]
+    for i in range(0, len(users), batch_size):
+        yield "users", users[i:i + batch_size]
+
+    # Ticket volume per competition: hot ones split hot_share, the rest follow a Zipf tail
+    hot = min(spec.hot_competitions, spec.competitions)
+    cold = spec.competitions - hot
+    hot_tickets = int(spec.tickets * spec.hot_share) if cold else spec.tickets
+    sales = (_split(hot_tickets, [1.0] * hot) if hot else []) + \
+        (_split(spec.tickets - hot_tickets, [1 / (i + 1) for i in range(cold)]) if cold else [])
+
+    competitions = []
+    for i, sold in enumerate(sales):
+        ended = i >= hot and rng.random() < spec.ended_share
+        # Hot competitions are close to selling out; others have plenty left
+        total = max(sold, 10) if i < hot and rng.random() < 0.5 else max(int(sold * rng.uniform(1.2, 3.0)), 100)
+        status = "ended" if ended else ("sold_out" if sold >= total else "active")
+        comp = competition_doc(rng, now, total, status=status, sold_tickets=sold)
+        # Leave the user pool enough headroom under the per-user cap to absorb the sales
+        comp["max_tickets_per_user"] = max(comp["max_tickets_per_user"], -(-2 * sold // len(users)))
+        if ended and sold:
+            comp["winner_id"] = f"winner_{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}"
+            comp["draw_date"] = comp["end_date"]
+        competitions.append(comp)
+    for i in range(0, len(competitions), batch_size):
+        yield "competitions", [dict(c) for c in competitions[i:i + batch_size]]
+
+    orders, buckets, transactions, winners = [], [], [], []
+    held: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def flush(force=False):
+        for name, docs in (("orders", orders), ("ticket_buckets", buckets), ("payment_transactions", transactions)):
+            while docs and (force or len(docs) >= batch_size):
+                yield name, docs[:batch_size]
+                del docs[:batch_size]
+
+    for seq, comp in enumerate(competitions):
+        sold = comp["sold_tickets"]
+        cap = comp["max_tickets_per_user"]
+        winning_index = rng.randrange(sold) if comp["winner_id"] else -1
+        created = datetime.fromisoformat(comp["created_at"])
+        window = max((min(now, datetime.fromisoformat(comp["end_date"])) - created).total_seconds(), 1)
+        issued = 0
+        while issued < sold:
+            whale = rng.random() < spec.whale_tickets
+            user = rng.choice(whales if whale else users)
+            size = rng.randint(10, spec.max_order) if whale else min(int(rng.paretovariate(1.5)), spec.max_order)
+            size = min(size, sold - issued, cap - held[(user["user_id"], comp["competition_id"])])
+            if size <= 0:
+                continue
+            held[(user["user_id"], comp["competition_id"])] += size
+            placed = created + timedelta(seconds=rng.uniform(0, window))
+            paid_by_stripe = rng.random() >= spec.balance_share
+            order = order_doc(rng, user, comp, size, placed, stripe_paid=paid_by_stripe)
+            numbers = [ticket_number(seq, issued + n) for n in range(size)]
+            if issued <= winning_index < issued + size:
+                winners.append(winner_doc(comp, user, numbers[winning_index - issued]))
+            issued += size
+            orders.append(order)
+            buckets.extend(ticket_buckets(order, numbers))
+            if paid_by_stripe:
+                transactions.append(transaction_doc(rng, order))
+
+            # Abandoned checkouts: pending orders that never got tickets
+            if rng.random() < spec.pending_share:
+                abandoned = order_doc(rng, user, comp, size, placed, status="pending")
+                orders.append(abandoned)
+                transactions.append(transaction_doc(rng, abandoned))
+            yield from flush()
+    yield from flush(force=True)
+
+    for i in range(0, len(winners), batch_size):
+        yield "winners", winners[i:i + batch_size]
+
+
+async def load(db, spec: DatasetSpec, batch_size: int = 1000, concurrency: int = 8,
+               progress_every: float = 0) -> Dict[str, int]:
+    """Write the dataset into `db` with up to `concurrency` insert_many calls in flight"""
+    counts: Dict[str, int] = defaultdict(int)
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    started = last_report = time.monotonic()
+
+    async def write(collection: str, docs: List[dict]):
+        try:
+            await db[collection].insert_many(docs, ordered=False)
+            counts[collection] += len(docs)
+        finally:
+            slots.release()
+
+    for collection, docs in generate(spec, batch_size):
+        await slots.acquire()  # backpressure: never more than `concurrency` batches generated ahead
+        task = asyncio.create_task(write(collection, docs))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if progress_every and time.monotonic() - last_report >= progress_every:
+            last_report = time.monotonic()
+            print(f"[{last_report - started:6.1f}s] " + ", ".join(f"{k}={v}" for k, v in counts.items()), flush=True)
+    await asyncio.gather(*tasks)
+    return dict(counts)
+
+
+def main(argv=None):
+    defaults = DatasetSpec()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mongo-url", required=True)
+    parser.add_argument("--db-name", default="grab_scale")
+    parser.add_argument("--drop", action="store_true", help="drop the database first")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8, help="insert_many calls in flight")
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args(argv)
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    spec = DatasetSpec(**{name: getattr(args, name) for name in asdict(defaults)})
+
+    async def run():
+        client = AsyncIOMotorClient(args.mongo_url)
+        try:
+            if args.drop:
+                await client.drop_database(args.db_name)
+            start = time.monotonic()
+            counts = await load(client[args.db_name], spec, args.batch_size, args.concurrency, progress_every=5)
+            print(f"Loaded in {time.monotonic() - start:.1f}s: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
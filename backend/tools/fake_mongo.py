@@ -0,0 +1,1136 @@
+"""In-memory stand-in for the subset of Motor's async API that server.py uses.
+
+Good enough to run the app's hot paths without a mongod: query and update
+operators, update pipelines, aggregation, unique (multikey) indexes, and
+bulk writes. Documents live in a dict per collection. Equality lookups on
+indexed fields go through a hash index, so benchmarks scale roughly like the
+real thing instead of degrading into full scans.
+
+Every command goes through `FakeDatabase.command_hook(collection, command, seconds)`
+so tooling can count round trips, and an optional `latency` (seconds) is awaited
+per command to model network time. A `pymongo.timeout()` deadline is honoured
+like the server honours maxTimeMS: a command that would run past it fails
+with ExecutionTimeout.
+"""
+import asyncio
+import copy
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, _csot
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ExecutionTimeout, OperationFailure
+
+_MISSING = object()
+
+
+# ---------------------------------------------------------------- results
+
+@dataclass
+class InsertOneResult:
+    inserted_id: Any
+    acknowledged: bool = True
+
+
+@dataclass
+class InsertManyResult:
+    inserted_ids: List[Any]
+    acknowledged: bool = True
+
+
+@dataclass
+class UpdateResult:
+    matched_count: int
+    modified_count: int
+    upserted_id: Any = None
+    acknowledged: bool = True
+
+
+@dataclass
+class DeleteResult:
+    deleted_count: int
+    acknowledged: bool = True
+
+
+@dataclass
+class BulkWriteResult:
+    inserted_count: int = 0
+    matched_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+    upserted_count: int = 0
+    upserted_ids: Dict[int, Any] = field(default_factory=dict)
+    acknowledged: bool = True
+
+
+# ---------------------------------------------------------------- paths
+
+def _resolve(doc, path: str) -> List[Any]:
+    """All values at a dotted path, fanning out across arrays (multikey)"""
+    values = [doc]
+    for part in path.split("."):
+        nxt = []
+        for v in values:
+            if isinstance(v, dict):
+                if part in v:
+                    nxt.append(v[part])
+            elif isinstance(v, list):
+                if part.isdigit():
+                    if int(part) < len(v):
+                        nxt.append(v[int(part)])
+                else:
+                    nxt.extend(e[part] for e in v if isinstance(e, dict) and part in e)
+        values = nxt
+    return values
+
+
+def _get(doc, path: str, default=None):
+    cur = doc
+    for part in path.split("."):
+        if isinstance(cur, dict) and part in cur:
+            cur = cur[part]
+        elif isinstance(cur, list) and part.isdigit() and int(part) < len(cur):
+            cur = cur[int(part)]
+        else:
+            return default
+    return cur
+
+
+def _set(doc, path: str, value):
+    parts = path.split(".")
+    cur = doc
+    for part in parts[:-1]:
+        if isinstance(cur, list):
+            cur = cur[int(part)]
+            continue
+        if not isinstance(cur.get(part), (dict, list)):
+            cur[part] = {}
+        cur = cur[part]
+    if isinstance(cur, list):
+        cur[int(parts[-1])] = value
+    else:
+        cur[parts[-1]] = value
+
+
+def _unset(doc, path: str):
+    parts = path.split(".")
+    parent = _get(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+
+
+# ---------------------------------------------------------------- ordering
+
+_TYPE_ORDER = [
+    (type(None), 1), (bool, 8), (int, 2), (float, 2), (str, 3),
+    (dict, 4), (list, 5), (ObjectId, 7), (datetime, 9),
+]
+
+
+def _type_rank(v) -> int:
+    for t, rank in _TYPE_ORDER:
+        if type(v) is t:
+            return rank
+    return 6
+
+
+def _sort_key(v):
+    rank = _type_rank(v)
+    if rank == 1:
+        return (rank, 0)
+    if rank in (4, 5):
+        return (rank, repr(v))
+    return (rank, v)
+
+
+def _compare(a, b) -> Optional[int]:
+    """-1/0/1, or None when the values are not in the same type bracket"""
+    if _type_rank(a) != _type_rank(b):
+        return None
+    ka, kb = _sort_key(a), _sort_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+# ---------------------------------------------------------------- matching
+
+def _eq(a, b) -> bool:
+    # Mongo does not treat booleans as numbers
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+def _values_eq(values: List[Any], target) -> bool:
+    if target is None and not values:
+        return True
+    for v in values:
+        if _eq(v, target):
+            return True
+        if isinstance(v, list) and any(_eq(e, target) for e in v):
+            return True
+    return False
+
+
+def _flatten(values):
+    out = []
+    for v in values:
+        out.append(v)
+        if isinstance(v, list):
+            out.extend(v)
+    return out
+
+
+def _match_ops(values: List[Any], ops: dict, doc) -> bool:
+    for op, arg in ops.items():
+        if op == "$eq":
+            ok = _values_eq(values, arg)
+        elif op == "$ne":
+            ok = not _values_eq(values, arg)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = False
+            for v in _flatten(values):
+                c = _compare(v, arg)
+                if c is None:
+                    continue
+                if (op == "$gt" and c > 0) or (op == "$gte" and c >= 0) or (op == "$lt" and c < 0) or (op == "$lte" and c <= 0):
+                    ok = True
+                    break
+        elif op == "$in":
+            ok = any(_values_eq(values, a) for a in arg)
+        elif op == "$nin":
+            ok = not any(_values_eq(values, a) for a in arg)
+        elif op == "$exists":
+            ok = bool(values) == bool(arg)
+        elif op == "$not":
+            ok = not _match_ops(values, arg, doc)
+        elif op == "$size":
+            ok = any(isinstance(v, list) and len(v) == arg for v in values)
+        elif op == "$type":
+            names = {"string": str, "int": int, "double": float, "bool": bool, "object": dict,
+                     "array": list, "objectId": ObjectId, "date": datetime, "null": type(None)}
+            wanted = [names[a] for a in (arg if isinstance(arg, list) else [arg])]
+            ok = any(type(v) in wanted for v in values)
+        elif op == "$regex":
+            rx = re.compile(arg, re.I if "i" in ops.get("$options", "") else 0)
+            ok = any(isinstance(v, str) and rx.search(v) for v in values)
+        elif op == "$options":
+            continue
+        elif op == "$elemMatch":
+            ok = any(
+                isinstance(v, list) and any(
+                    _matches(e, arg) if isinstance(e, dict) else _match_ops([e], arg, doc) for e in v
+                )
+                for v in values
+            )
+        elif op == "$all":
+            ok = all(_values_eq(values, a) for a in arg)
+        else:
+            raise OperationFailure(f"fake_mongo: unsupported query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def _is_operator_dict(v) -> bool:
+    return isinstance(v, dict) and bool(v) and all(k.startswith("$") for k in v)
+
+
+def _matches(doc, query: dict) -> bool:
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(_matches(doc, q) for q in cond):
+                return False
+        elif key == "$nor":
+            if any(_matches(doc, q) for q in cond):
+                return False
+        elif key == "$expr":
+            if not _eval(cond, doc):
+                return False
+        else:
+            values = _resolve(doc, key)
+            if _is_operator_dict(cond):
+                if not _match_ops(values, cond, doc):
+                    return False
+            elif not _values_eq(values, cond):
+                return False
+    return True
+
+
+# ---------------------------------------------------------------- expressions
+
+def _eval(expr, doc, variables=None):
+    if isinstance(expr, str):
+        if expr.startswith("$$"):
+            name, _, rest = expr[2:].partition(".")
+            base = (variables or {}).get(name, doc if name in ("ROOT", "CURRENT") else None)
+            return _get(base, rest) if rest else base
+        if expr.startswith("$"):
+            return _get(doc, expr[1:])
+        return expr
+    if isinstance(expr, list):
+        return [_eval(e, doc, variables) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith("$"):
+        return {k: _eval(v, doc, variables) for k, v in expr.items()}
+
+    op, arg = next(iter(expr.items()))
+    if op == "$literal":
+        return arg
+
+    def ev(a):
+        return _eval(a, doc, variables)
+
+    args = [ev(a) for a in arg] if isinstance(arg, list) else None
+
+    if op == "$add":
+        return sum(a or 0 for a in args)
+    if op == "$subtract":
+        return (args[0] or 0) - (args[1] or 0)
+    if op == "$multiply":
+        out = 1
+        for a in args:
+            out *= a or 0
+        return out
+    if op == "$divide":
+        return args[0] / args[1]
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        c = _compare(args[0], args[1])
+        if c is None:
+            c = _type_rank(args[0]) - _type_rank(args[1])
+        return {"$eq": c == 0, "$ne": c != 0, "$gt": c > 0, "$gte": c >= 0, "$lt": c < 0, "$lte": c <= 0}[op]
+    if op == "$and":
+        return all(args)
+    if op == "$or":
+        return any(args)
+    if op == "$not":
+        return not (args[0] if args is not None else ev(arg))
+    if op == "$cond":
+        if isinstance(arg, dict):
+            return ev(arg["then"]) if ev(arg["if"]) else ev(arg["else"])
+        return ev(arg[1]) if ev(arg[0]) else ev(arg[2])
+    if op == "$ifNull":
+        for a in args:
+            if a is not None:
+                return a
+        return None
+    if op == "$min":
+        vals = [a for a in (args if args is not None else [ev(arg)]) if a is not None]
+        vals = [x for v in vals for x in (v if isinstance(v, list) else [v])]
+        return min(vals, key=_sort_key) if vals else None
+    if op == "$max":
+        vals = [a for a in (args if args is not None else [ev(arg)]) if a is not None]
+        vals = [x for v in vals for x in (v if isinstance(v, list) else [v])]
+        return max(vals, key=_sort_key) if vals else None
+    if op == "$size":
+        v = args[0] if args is not None else ev(arg)
+        return len(v or [])
+    if op == "$concat":
+        return "".join(a or "" for a in args)
+    if op == "$in":
+        return args[0] in (args[1] or [])
+    if op == "$arrayElemAt":
+        arr, i = args
+        return arr[i] if arr and -len(arr) <= i < len(arr) else None
+    if op == "$concatArrays":
+        return [x for a in args for x in (a or [])]
+    if op == "$toString":
+        v = args[0] if args is not None else ev(arg)
+        return None if v is None else str(v)
+    if op == "$round":
+        return round(args[0], args[1] if len(args) > 1 else 0)
+    raise OperationFailure(f"fake_mongo: unsupported expression operator {op}")
+
+
+# ---------------------------------------------------------------- updates
+
+def _apply_update(doc, update, is_insert: bool) -> None:
+    if isinstance(update, list):
+        for stage in update:
+            (name, spec), = stage.items()
+            if name in ("$set", "$addFields"):
+                computed = {k: _eval(v, doc) for k, v in spec.items()}
+                for k, v in computed.items():
+                    _set(doc, k, v)
+            elif name in ("$unset", "$project") and (isinstance(spec, (str, list)) or name == "$unset"):
+                for k in [spec] if isinstance(spec, str) else spec:
+                    _unset(doc, k)
+            else:
+                raise OperationFailure(f"fake_mongo: unsupported update pipeline stage {name}")
+        return
+
+    for op, spec in update.items():
+        if op == "$set":
+            for k, v in spec.items():
+                _set(doc, k, copy.deepcopy(v))
+        elif op == "$setOnInsert":
+            if is_insert:
+                for k, v in spec.items():
+                    _set(doc, k, copy.deepcopy(v))
+        elif op == "$unset":
+            for k in spec:
+                _unset(doc, k)
+        elif op == "$inc":
+            for k, v in spec.items():
+                _set(doc, k, (_get(doc, k) or 0) + v)
+        elif op == "$mul":
+            for k, v in spec.items():
+                _set(doc, k, (_get(doc, k) or 0) * v)
+        elif op in ("$min", "$max"):
+            for k, v in spec.items():
+                cur = _get(doc, k, _MISSING)
+                if cur is _MISSING or (op == "$min" and _sort_key(v) < _sort_key(cur)) or (op == "$max" and _sort_key(v) > _sort_key(cur)):
+                    _set(doc, k, v)
+        elif op in ("$push", "$addToSet"):
+            for k, v in spec.items():
+                arr = _get(doc, k)
+                if arr is None:
+                    arr = []
+                    _set(doc, k, arr)
+                items = v["$each"] if isinstance(v, dict) and "$each" in v else [v]
+                for item in items:
+                    if op == "$push" or item not in arr:
+                        arr.append(copy.deepcopy(item))
+                if op == "$push" and isinstance(v, dict) and "$slice" in v:
+                    n = v["$slice"]
+                    arr[:] = arr[n:] if n < 0 else arr[:n]
+        elif op == "$pull":
+            for k, v in spec.items():
+                arr = _get(doc, k)
+                if isinstance(arr, list):
+                    if isinstance(v, dict) and not _is_operator_dict(v):
+                        arr[:] = [e for e in arr if not (isinstance(e, dict) and _matches(e, v))]
+                    elif _is_operator_dict(v):
+                        arr[:] = [e for e in arr if not _match_ops([e], v, doc)]
+                    else:
+                        arr[:] = [e for e in arr if e != v]
+        elif op == "$currentDate":
+            for k in spec:
+                _set(doc, k, datetime.utcnow())
+        else:
+            raise OperationFailure(f"fake_mongo: unsupported update operator {op}")
+
+
+def _upsert_seed(query: dict) -> dict:
+    doc: Dict[str, Any] = {}
+    for k, v in query.items():
+        if k.startswith("$"):
+            if k == "$and":
+                for q in v:
+                    doc.update(_upsert_seed(q))
+            continue
+        if _is_operator_dict(v):
+            if "$eq" in v:
+                _set(doc, k, copy.deepcopy(v["$eq"]))
+            continue
+        _set(doc, k, copy.deepcopy(v))
+    return doc
+
+
+# ---------------------------------------------------------------- projection
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {k: 1 for k in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    inclusive = any(v for v in fields.values())
+    if inclusive:
+        out = {}
+        for k, v in fields.items():
+            if not v:
+                continue
+            val = _get(doc, k, _MISSING)
+            if val is not _MISSING:
+                _set(out, k, copy.deepcopy(val))
+    else:
+        out = copy.deepcopy(doc)
+        for k in fields:
+            _unset(out, k)
+    if include_id and "_id" in doc:
+        out["_id"] = doc["_id"]
+    elif not include_id:
+        out.pop("_id", None)
+    return out
+
+
+def _sort_docs(docs: List[dict], spec) -> List[dict]:
+    for key, direction in reversed(list(spec)):
+        docs.sort(key=lambda d, k=key: _sort_key(_get(d, k)), reverse=direction < 0)
+    return docs
+
+
+def _normalize_sort(key_or_list, direction=None):
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def _freeze(v):
+    if isinstance(v, dict):
+        return tuple((k, _freeze(x)) for k, x in v.items())
+    if isinstance(v, list):
+        return tuple(_freeze(x) for x in v)
+    return v
+
+
+# ---------------------------------------------------------------- aggregation
+
+_ACCUMULATORS = ("$sum", "$avg", "$min", "$max", "$push", "$addToSet", "$first", "$last", "$count")
+
+
+def _aggregate(docs: List[dict], pipeline: List[dict], db: "FakeDatabase") -> List[dict]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if _matches(d, spec)]
+        elif name == "$project":
+            if all(v in (0, 1, True, False) for v in spec.values()):
+                docs = [_project(d, spec) for d in docs]
+            else:
+                out = []
+                for d in docs:
+                    row = {} if spec.get("_id", 1) == 0 else {"_id": d.get("_id")}
+                    for k, v in spec.items():
+                        if k == "_id":
+                            continue
+                        row[k] = _get(d, k) if v in (1, True) else _eval(v, d)
+                    out.append(row)
+                docs = out
+        elif name in ("$addFields", "$set"):
+            out = []
+            for d in docs:
+                d = copy.deepcopy(d)
+                for k, v in spec.items():
+                    _set(d, k, _eval(v, d))
+                out.append(d)
+            docs = out
+        elif name == "$unset":
+            docs = [_project(d, {k: 0 for k in ([spec] if isinstance(spec, str) else spec)}) for d in docs]
+        elif name == "$unwind":
+            path = spec if isinstance(spec, str) else spec["path"]
+            keep_empty = isinstance(spec, dict) and spec.get("preserveNullAndEmptyArrays")
+            out = []
+            for d in docs:
+                arr = _get(d, path[1:])
+                if isinstance(arr, list) and arr:
+                    for item in arr:
+                        nd = copy.copy(d)
+                        _set(nd, path[1:], item)
+                        out.append(nd)
+                elif arr is not None and not isinstance(arr, list):
+                    out.append(d)
+                elif keep_empty:
+                    out.append(d)
+            docs = out
+        elif name == "$group":
+            groups: Dict[Any, dict] = {}
+            for d in docs:
+                key = _eval(spec["_id"], d)
+                fkey = _freeze(key)
+                g = groups.get(fkey)
+                if g is None:
+                    g = groups[fkey] = {"_id": key, "__n": {}}
+                for out_field, acc in spec.items():
+                    if out_field == "_id":
+                        continue
+                    (aop, aexpr), = acc.items()
+                    val = 1 if aop == "$count" else _eval(aexpr, d)
+                    if aop in ("$sum", "$count"):
+                        g[out_field] = g.get(out_field, 0) + (val if isinstance(val, (int, float)) and not isinstance(val, bool) else 0)
+                    elif aop == "$avg":
+                        if isinstance(val, (int, float)):
+                            g["__n"][out_field] = g["__n"].get(out_field, 0) + 1
+                            g[out_field] = g.get(out_field, 0) + val
+                    elif aop == "$min":
+                        if val is not None and (out_field not in g or _sort_key(val) < _sort_key(g[out_field])):
+                            g[out_field] = val
+                    elif aop == "$max":
+                        if val is not None and (out_field not in g or _sort_key(val) > _sort_key(g[out_field])):
+                            g[out_field] = val
+                    elif aop == "$push":
+                        g.setdefault(out_field, []).append(val)
+                    elif aop == "$addToSet":
+                        arr = g.setdefault(out_field, [])
+                        if val not in arr:
+                            arr.append(val)
+                    elif aop == "$first":
+                        g.setdefault(out_field, val)
+                    elif aop == "$last":
+                        g[out_field] = val
+                    else:
+                        raise OperationFailure(f"fake_mongo: unsupported accumulator {aop}")
+            out = []
+            for g in groups.values():
+                counts = g.pop("__n")
+                for f, n in counts.items():
+                    g[f] = g[f] / n
+                for out_field, acc in spec.items():
+                    if out_field != "_id" and out_field not in g:
+                        (aop, _), = acc.items()
+                        g[out_field] = [] if aop in ("$push", "$addToSet") else (0 if aop in ("$sum", "$count") else None)
+                out.append(g)
+            docs = out
+        elif name == "$sort":
+            docs = _sort_docs(list(docs), spec.items())
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$sample":
+            docs = random.sample(docs, min(spec["size"], len(docs)))
+        elif name == "$lookup":
+            foreign = db[spec["from"]]
+            out = []
+            for d in docs:
+                local = _get(d, spec["localField"])
+                d = copy.copy(d)
+                d[spec["as"]] = [
+                    copy.deepcopy(f) for f in foreign._candidates({spec["foreignField"]: local})
+                    if _matches(f, {spec["foreignField"]: local})
+                ]
+                out.append(d)
+            docs = out
+        elif name == "$replaceRoot":
+            docs = [_eval(spec["newRoot"], d) for d in docs]
+        else:
+            raise OperationFailure(f"fake_mongo: unsupported aggregation stage {name}")
+    return docs
+
+
+# ---------------------------------------------------------------- cursor
+
+class FakeCursor:
+    """Lazily evaluated cursor supporting Motor's chaining and to_list/async-for"""
+
+    def __init__(self, collection: "FakeCollection", producer: Callable[["FakeCursor"], List[dict]]):
+        self._collection = collection
+        self._producer = producer
+        self._sort: List = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[dict]] = None
+        self._pos = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, n: int):
+        self._skip = n
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def max_time_ms(self, ms):
+        return self
+
+    def hint(self, index):
+        return self
+
+    async def _ensure(self):
+        if self._results is None:
+            await self._collection._db._tick(self._collection.name, "find")
+            self._results = self._producer(self)
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        await self._ensure()
+        end = len(self._results) if length is None else self._pos + length
+        batch = self._results[self._pos:end]
+        self._pos += len(batch)
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self._ensure()
+        if self._pos >= len(self._results):
+            raise StopAsyncIteration
+        doc = self._results[self._pos]
+        self._pos += 1
+        return doc
+
+    async def next(self):
+        return await self.__anext__()
+
+    async def close(self):
+        self._results = []
+
+
+# ---------------------------------------------------------------- collection
+
+class FakeCollection:
+    def __init__(self, db: "FakeDatabase", name: str):
+        self._db = db
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._seq: Dict[Any, int] = {}
+        self._next_seq = 0
+        # field -> value -> set(_id) for equality lookups
+        self._eq_index: Dict[str, Dict[Any, set]] = {}
+        # name -> (keys, partial filter, key -> _id)
+        self._unique: Dict[str, tuple] = {}
+        self._index_specs: Dict[str, dict] = {"_id_": {"key": [("_id", 1)]}}
+
+    # -- options / plumbing
+
+    def with_options(self, **kwargs):
+        return self
+
+    @property
+    def full_name(self):
+        return f"{self._db.name}.{self.name}"
+
+    # -- indexes
+
+    async def create_index(self, keys, unique=False, name=None, partialFilterExpression=None, **kwargs):
+        spec = _normalize_sort(keys, 1)
+        name = name or "_".join(f"{k}_{d}" for k, d in spec)
+        self._index_specs[name] = {"key": spec, "unique": unique, **kwargs}
+        first = spec[0][0]
+        if first not in self._eq_index and first != "_id":
+            self._eq_index[first] = {}
+            for _id, doc in self._docs.items():
+                self._index_add(first, doc, _id)
+        if unique and name not in self._unique:
+            entries: Dict[tuple, Any] = {}
+            self._unique[name] = (spec, partialFilterExpression, entries)
+            for _id, doc in self._docs.items():
+                for key in self._unique_keys(spec, partialFilterExpression, doc):
+                    if key in entries and entries[key] != _id:
+                        del self._unique[name]
+                        raise DuplicateKeyError(f"E11000 duplicate key error index: {name}", 11000)
+                    entries[key] = _id
+        await self._db._tick(self.name, "createIndexes")
+        return name
+
+    async def create_indexes(self, models):
+        return [await self.create_index(m.document["key"], **{k: v for k, v in m.document.items() if k != "key"}) for m in models]
+
+    async def index_information(self):
+        return dict(self._index_specs)
+
+    async def drop_indexes(self):
+        self._eq_index.clear()
+        self._unique.clear()
+
+    def _index_add(self, fld: str, doc: dict, _id):
+        index = self._eq_index[fld]
+        for v in _resolve(doc, fld):
+            for item in (v if isinstance(v, list) else [v]):
+                index.setdefault(_freeze(item), set()).add(_id)
+
+    def _index_remove(self, fld: str, doc: dict, _id):
+        index = self._eq_index[fld]
+        for v in _resolve(doc, fld):
+            for item in (v if isinstance(v, list) else [v]):
+                ids = index.get(_freeze(item))
+                if ids:
+                    ids.discard(_id)
+
+    @staticmethod
+    def _unique_keys(spec, partial, doc) -> List[tuple]:
+        if partial and not _matches(doc, partial):
+            return []
+        parts = []
+        for k, _ in spec:
+            values = _resolve(doc, k)
+            if not values:
+                parts.append([None])
+            else:
+                flat = []
+                for v in values:
+                    flat.extend(v if isinstance(v, list) and v else [v])
+                parts.append(list(dict.fromkeys(_freeze(v) for v in flat)))
+        keys = [()]
+        for options in parts:
+            keys = [k + (o,) for k in keys for o in options]
+        return keys
+
+    def _check_unique(self, doc: dict, _id):
+        for name, (spec, partial, entries) in self._unique.items():
+            for key in self._unique_keys(spec, partial, doc):
+                owner = entries.get(key, _id)
+                if owner != _id:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {key}",
+                        11000,
+                    )
+        if _id in self._docs and doc is not self._docs[_id] and doc.get("_id") != _id:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: _id_", 11000)
+
+    def _store(self, doc: dict):
+        _id = doc["_id"]
+        old = self._docs.get(_id)
+        if old is not None:
+            self._unstore(old)
+        self._docs[_id] = doc
+        if _id not in self._seq:
+            self._seq[_id] = self._next_seq
+            self._next_seq += 1
+        for fld in self._eq_index:
+            self._index_add(fld, doc, _id)
+        for spec, partial, entries in self._unique.values():
+            for key in self._unique_keys(spec, partial, doc):
+                entries[key] = _id
+
+    def _unstore(self, doc: dict):
+        _id = doc["_id"]
+        for fld in self._eq_index:
+            self._index_remove(fld, doc, _id)
+        for spec, partial, entries in self._unique.values():
+            for key in self._unique_keys(spec, partial, doc):
+                if entries.get(key) == _id:
+                    del entries[key]
+
+    def _candidates(self, query: dict) -> List[dict]:
+        """Docs that may match: narrowed by an equality on an indexed field, in insertion order"""
+        best = None
+        for key, cond in query.items():
+            if key.startswith("$"):
+                continue
+            if key == "_id":
+                values = cond["$in"] if _is_operator_dict(cond) and "$in" in cond else (None if _is_operator_dict(cond) else [cond])
+                if values is not None:
+                    return [self._docs[v] for v in values if v in self._docs]
+                continue
+            if key not in self._eq_index:
+                continue
+            if _is_operator_dict(cond):
+                if "$in" in cond and None not in cond["$in"]:
+                    values = cond["$in"]
+                elif "$eq" in cond and cond["$eq"] is not None:
+                    values = [cond["$eq"]]
+                else:
+                    continue
+            elif cond is None or isinstance(cond, (dict, list)):
+                continue
+            else:
+                values = [cond]
+            ids = set()
+            for v in values:
+                ids |= self._eq_index[key].get(_freeze(v), set())
+            if best is None or len(ids) < len(best):
+                best = ids
+        if best is None:
+            return list(self._docs.values())
+        return [self._docs[i] for i in sorted(best, key=self._seq.__getitem__)]
+
+    def _find_docs(self, query: Optional[dict]) -> List[dict]:
+        query = query or {}
+        return [d for d in self._candidates(query) if _matches(d, query)]
+
+    # -- reads
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs) -> FakeCursor:
+        def produce(cursor: FakeCursor) -> List[dict]:
+            docs = self._find_docs(filter)
+            if cursor._sort:
+                docs = _sort_docs(list(docs), cursor._sort)
+            if cursor._skip:
+                docs = docs[cursor._skip:]
+            if cursor._limit:
+                docs = docs[:cursor._limit]
+            return [_project(d, projection) for d in docs]
+
+        cursor = FakeCursor(self, produce)
+        if sort:
+            cursor.sort(sort)
+        if skip:
+            cursor.skip(skip)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, *args, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        await self._db._tick(self.name, "find")
+        docs = self._find_docs(filter)
+        if sort:
+            docs = _sort_docs(list(docs), _normalize_sort(sort))
+        return _project(docs[0], projection) if docs else None
+
+    async def count_documents(self, filter, **kwargs):
+        await self._db._tick(self.name, "aggregate")
+        n = len(self._find_docs(filter))
+        if kwargs.get("skip"):
+            n = max(0, n - kwargs["skip"])
+        if kwargs.get("limit"):
+            n = min(n, kwargs["limit"])
+        return n
+
+    async def estimated_document_count(self, **kwargs):
+        await self._db._tick(self.name, "count")
+        return len(self._docs)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        await self._db._tick(self.name, "distinct")
+        out = []
+        for d in self._find_docs(filter):
+            for v in _resolve(d, key):
+                for item in (v if isinstance(v, list) else [v]):
+                    if item not in out:
+                        out.append(item)
+        return out
+
+    def aggregate(self, pipeline, **kwargs) -> FakeCursor:
+        def produce(cursor):
+            first = pipeline[0] if pipeline else {}
+            docs = self._find_docs(first["$match"]) if "$match" in first else list(self._docs.values())
+            rest = pipeline[1:] if "$match" in first else pipeline
+            return [copy.deepcopy(d) for d in _aggregate(list(docs), rest, self._db)]
+
+        cursor = FakeCursor(self, produce)
+        return cursor
+
+    # -- writes (synchronous cores shared with bulk_write)
+
+    def _insert(self, doc: dict) -> Any:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        stored = copy.deepcopy(doc)
+        self._check_unique(stored, stored["_id"])
+        if stored["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: _id_", 11000)
+        self._store(stored)
+        return stored["_id"]
+
+    def _update(self, filter, update, upsert=False, many=False, sort=None, replacement=False):
+        docs = self._find_docs(filter)
+        if sort:
+            docs = _sort_docs(list(docs), _normalize_sort(sort))
+        if not many:
+            docs = docs[:1]
+        modified = 0
+        for doc in docs:
+            new = copy.deepcopy(doc)
+            if replacement:
+                new = {"_id": doc["_id"], **copy.deepcopy(update)}
+            else:
+                _apply_update(new, update, is_insert=False)
+            if new != doc:
+                new["_id"] = doc["_id"]
+                self._check_unique(new, doc["_id"])
+                self._store(new)
+                modified += 1
+        if docs or not upsert:
+            return len(docs), modified, None, docs
+        seed = _upsert_seed(filter)
+        if replacement:
+            seed = {**({"_id": seed["_id"]} if "_id" in seed else {}), **copy.deepcopy(update)}
+        else:
+            _apply_update(seed, update, is_insert=True)
+        upserted_id = self._insert(seed)
+        return 0, 0, upserted_id, []
+
+    def _delete(self, filter, many: bool) -> int:
+        docs = self._find_docs(filter)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self._unstore(doc)
+            del self._docs[doc["_id"]]
+            del self._seq[doc["_id"]]
+        return len(docs)
+
+    # -- async write API
+
+    async def insert_one(self, document, **kwargs):
+        await self._db._tick(self.name, "insert")
+        return InsertOneResult(self._insert(document))
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self._db._tick(self.name, "insert")
+        ids, errors = [], []
+        for i, doc in enumerate(documents):
+            try:
+                ids.append(self._insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(ids), "writeConcernErrors": [],
+                                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(ids)
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        await self._db._tick(self.name, "update")
+        matched, modified, upserted_id, _ = self._update(filter, update, upsert=upsert)
+        return UpdateResult(matched, modified, upserted_id)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        await self._db._tick(self.name, "update")
+        matched, modified, upserted_id, _ = self._update(filter, update, upsert=upsert, many=True)
+        return UpdateResult(matched, modified, upserted_id)
+
+    async def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        await self._db._tick(self.name, "update")
+        matched, modified, upserted_id, _ = self._update(filter, replacement, upsert=upsert, replacement=True)
+        return UpdateResult(matched, modified, upserted_id)
+
+    async def delete_one(self, filter, **kwargs):
+        await self._db._tick(self.name, "delete")
+        return DeleteResult(self._delete(filter, many=False))
+
+    async def delete_many(self, filter, **kwargs):
+        await self._db._tick(self.name, "delete")
+        return DeleteResult(self._delete(filter, many=True))
+
+    async def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        await self._db._tick(self.name, "findAndModify")
+        before = self._find_docs(filter)
+        if sort:
+            before = _sort_docs(list(before), _normalize_sort(sort))
+        before = copy.deepcopy(before[0]) if before else None
+        _, _, upserted_id, docs = self._update(filter, update, upsert=upsert, sort=sort)
+        if return_document == ReturnDocument.AFTER:
+            _id = docs[0]["_id"] if docs else upserted_id
+            after = self._docs.get(_id) if _id is not None else None
+            return _project(after, projection) if after else None
+        return _project(before, projection) if before else None
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        await self._db._tick(self.name, "findAndModify")
+        docs = self._find_docs(filter)
+        if sort:
+            docs = _sort_docs(list(docs), _normalize_sort(sort))
+        if not docs:
+            return None
+        doc = docs[0]
+        self._unstore(doc)
+        del self._docs[doc["_id"]]
+        del self._seq[doc["_id"]]
+        return _project(doc, projection)
+
+    async def find_one_and_replace(self, filter, replacement, projection=None, upsert=False,
+                                   return_document=ReturnDocument.BEFORE, **kwargs):
+        await self._db._tick(self.name, "findAndModify")
+        before = self._find_docs(filter)
+        before = copy.deepcopy(before[0]) if before else None
+        _, _, upserted_id, docs = self._update(filter, replacement, upsert=upsert, replacement=True)
+        if return_document == ReturnDocument.AFTER:
+            _id = docs[0]["_id"] if docs else upserted_id
+            return _project(self._docs[_id], projection) if _id in self._docs else None
+        return _project(before, projection) if before else None
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._db._tick(self.name, "bulkWrite")
+        result = BulkWriteResult()
+        errors = []
+        for i, op in enumerate(requests):
+            kind = type(op).__name__
+            doc = op._doc if hasattr(op, "_doc") else None
+            try:
+                if kind == "InsertOne":
+                    self._insert(doc)
+                    result.inserted_count += 1
+                elif kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                    matched, modified, upserted_id, _ = self._update(
+                        op._filter, doc, upsert=bool(op._upsert),
+                        many=kind == "UpdateMany", replacement=kind == "ReplaceOne",
+                    )
+                    result.matched_count += matched
+                    result.modified_count += modified
+                    if upserted_id is not None:
+                        result.upserted_count += 1
+                        result.upserted_ids[i] = upserted_id
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    result.deleted_count += self._delete(op._filter, many=kind == "DeleteMany")
+                else:
+                    raise OperationFailure(f"fake_mongo: unsupported bulk op {kind}")
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [],
+                "nInserted": result.inserted_count, "nUpserted": result.upserted_count,
+                "nMatched": result.matched_count, "nModified": result.modified_count,
+                "nRemoved": result.deleted_count,
+                "upserted": [{"index": i, "_id": v} for i, v in result.upserted_ids.items()],
+            })
+        return result
+
+    async def drop(self):
+        self._docs.clear()
+        self._seq.clear()
+        for index in self._eq_index.values():
+            index.clear()
+        for _, _, entries in self._unique.values():
+            entries.clear()
+
+
+# ---------------------------------------------------------------- database
+
+class FakeDatabase:
+    """Async in-memory database; collections are created on first access"""
+
+    def __init__(self, name: str = "fake", latency: float = 0.0,
+                 command_hook: Optional[Callable[[str, str, float], None]] = None):
+        self.name = name
+        self.latency = latency
+        self.command_hook = command_hook
+        self.op_count = 0
+        self._collections: Dict[str, FakeCollection] = {}
+
+    async def _tick(self, collection: str, command: str):
+        self.op_count += 1
+        start = time.perf_counter()
+        remaining = _csot.remaining()
+        if remaining is not None and remaining <= self.latency:
+            await asyncio.sleep(max(0.0, remaining))
+            raise ExecutionTimeout("operation exceeded time limit", 50)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.command_hook:
+            self.command_hook(collection, command, time.perf_counter() - start)
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        coll = self._collections.get(name)
+        if coll is None:
+            coll = self._collections[name] = FakeCollection(self, name)
+        return coll
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> FakeCollection:
+        return self[name]
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def list_collection_names(self, **kwargs):
+        return [n for n, c in self._collections.items() if c._docs]
+
+    async def command(self, command, *args, **kwargs):
+        await self._tick("", command if isinstance(command, str) else next(iter(command)))
+        return {"ok": 1.0}
+
+    async def drop_collection(self, name: str):
+        await self[name].drop()
@@ -0,0 +1,137 @@
+"""Offline stand-in for the Stripe SDK calls server.py makes.
+
+`FakeStripe().install()` patches `stripe.checkout.Session.create/retrieve/expire`,
+`stripe.Refund.create` and `stripe.Webhook.construct_event` in place. Sessions live in memory; the SDK is
+blocking, so the optional `latency` is a `time.sleep` to keep the same effect
+on the event loop as the real client.
+"""
+import json
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+
+import stripe
+
+SIGNATURE = "t=0,v1=offline"
+
+
+class FakeStripe:
+    def __init__(self, latency: float = 0.0, auto_pay: bool = True):
+        self.latency = latency
+        # Sessions report "paid" on the first retrieve, as if the buyer paid instantly
+        self.auto_pay = auto_pay
+        self.sessions: Dict[str, SimpleNamespace] = {}
+        self._by_idempotency_key: Dict[str, SimpleNamespace] = {}
+        self.refunds: Dict[str, SimpleNamespace] = {}  # by payment_intent
+        self.calls: Dict[str, int] = {"create": 0, "retrieve": 0, "expire": 0, "refund": 0, "construct_event": 0}
+        self._saved = None
+
+    def install(self) -> "FakeStripe":
+        self._saved = (
+            stripe.checkout.Session.create,
+            stripe.checkout.Session.retrieve,
+            stripe.checkout.Session.expire,
+            stripe.Refund.create,
+            stripe.Webhook.construct_event,
+        )
+        stripe.checkout.Session.create = self._create
+        stripe.checkout.Session.retrieve = self._retrieve
+        stripe.checkout.Session.expire = self._expire
+        stripe.Refund.create = self._refund
+        stripe.Webhook.construct_event = self._construct_event
+        return self
+
+    def uninstall(self):
+        if self._saved:
+            (
+                stripe.checkout.Session.create,
+                stripe.checkout.Session.retrieve,
+                stripe.checkout.Session.expire,
+                stripe.Refund.create,
+                stripe.Webhook.construct_event,
+            ) = self._saved
+            self._saved = None
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _create(self, **params):
+        self.calls["create"] += 1
+        self._wait()
+        key = params.get("idempotency_key")
+        if key and key in self._by_idempotency_key:
+            return self._by_idempotency_key[key]
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        amount = sum(i["price_data"]["unit_amount"] * i["quantity"] for i in params.get("line_items", []))
+        session = SimpleNamespace(
+            id=session_id,
+            url=f"https://checkout.stripe.test/pay/{session_id}",
+            status="open",
+            payment_status="unpaid",
+            payment_intent=None,
+            amount_total=amount,
+            metadata=dict(params.get("metadata") or {}),
+            idempotency_key=params.get("idempotency_key"),
+        )
+        self.sessions[session_id] = session
+        if key:
+            self._by_idempotency_key[key] = session
+        return session
+
+    def _retrieve(self, session_id, **params):
+        self.calls["retrieve"] += 1
+        self._wait()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise stripe.error.InvalidRequestError(f"No such checkout.session: '{session_id}'", "id")
+        if self.auto_pay:
+            self.pay(session_id)
+        return session
+
+    def _expire(self, session_id, **params):
+        self.calls["expire"] += 1
+        self._wait()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise stripe.error.InvalidRequestError(f"No such checkout.session: '{session_id}'", "id")
+        if session.status != "open":
+            raise stripe.error.InvalidRequestError(f"Only open sessions can be expired ({session.status})", None)
+        session.status = "expired"
+        return session
+
+    def _refund(self, payment_intent=None, **params):
+        self.calls["refund"] += 1
+        self._wait()
+        if payment_intent not in {s.payment_intent for s in self.sessions.values() if s.payment_intent}:
+            raise stripe.error.InvalidRequestError(f"No such payment_intent: '{payment_intent}'", "payment_intent")
+        refund = self.refunds.get(payment_intent)
+        if refund is None:
+            refund = self.refunds[payment_intent] = SimpleNamespace(
+                id=f"re_test_{uuid.uuid4().hex}", payment_intent=payment_intent, status="succeeded"
+            )
+        return refund
+
+    def pay(self, session_id: str):
+        session = self.sessions[session_id]
+        session.status = "complete"
+        session.payment_status = "paid"
+        session.payment_intent = session.payment_intent or f"pi_test_{uuid.uuid4().hex}"
+
+    def _construct_event(self, payload, sig_header, secret, **kwargs):
+        self.calls["construct_event"] += 1
+        if sig_header != SIGNATURE:
+            raise stripe.error.SignatureVerificationError("Bad signature", sig_header)
+        return json.loads(payload)
+
+
+def webhook_payload(session_id: str, event_type: str = "checkout.session.completed",
+                    metadata: Optional[dict] = None) -> Tuple[bytes, dict]:
+    """Body and headers of a webhook delivery the fake accepts as signed"""
+    event = {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "type": event_type,
+        "data": {"object": {"id": session_id, "payment_status": "paid", "metadata": metadata or {}}},
+    }
+    return json.dumps(event).encode(), {"Stripe-Signature": SIGNATURE, "Content-Type": "application/json"}
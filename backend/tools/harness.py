@@ -0,0 +1,92 @@
+"""Import server.py wired to offline stand-ins.
+
+The app reads its configuration from the environment at import time, so
+`load_server()` pins the settings that would otherwise reach real services
+(MONGO_URL, Stripe keys) before importing it, then swaps `server.db` for a
+FakeDatabase unless a local mongod URL is given.
+"""
+import os
+import sys
+from pathlib import Path
+from typing import Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from tools.fake_mongo import FakeDatabase  # noqa: E402
+from tools.fake_stripe import FakeStripe  # noqa: E402
+
+ADMIN_PASSWORD = "offline-admin"
+
+
+def _record_command(collection: str, command: str, seconds: float):
+    # Same bookkeeping MongoCommandMetrics does for the real driver
+    from metrics import MONGO_COMMAND_DURATION, MONGO_COMMANDS, current_db_stats
+
+    MONGO_COMMAND_DURATION.labels(collection, command).observe(seconds)
+    MONGO_COMMANDS.labels(collection, command, "success").inc()
+    stats = current_db_stats()
+    if stats is not None:
+        stats.record(seconds)
+
+
+def load_server(mongo_url: Optional[str] = None, db_name: str = "grab_offline",
+                db_latency: float = 0.0, stripe_latency: float = 0.0) -> Tuple[object, FakeStripe]:
+    """Import server.py against a fake (or local) Mongo and a fake Stripe.
+
+    Returns (server module, FakeStripe). With `mongo_url`, `server.db` is the
+    real database `db_name` on that server; otherwise it is a FakeDatabase.
+    """
+    if "server" in sys.modules:
+        raise RuntimeError("server was already imported; load_server() must run first")
+
+    os.environ["MONGO_URL"] = mongo_url or "mongodb://127.0.0.1:27017"
+    os.environ["DB_NAME"] = db_name
+    os.environ["STRIPE_API_KEY"] = "sk_test_offline"
+    os.environ["STRIPE_WEBHOOK_SECRET"] = "whsec_offline"
+    os.environ["ADMIN_PASSWORD"] = ADMIN_PASSWORD
+    os.environ["ARCHIVE_INTERVAL_SECONDS"] = "0"
+    os.environ.setdefault("JWT_SECRET", "offline-jwt-secret")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("ACCESS_LOG_SAMPLE_RATE", "0")
+    os.environ.setdefault("DB_CALLS_WARN_THRESHOLD", "0")
+    # Every simulated client shares one IP; opt back in by setting RATE_LIMITS explicitly
+    os.environ.setdefault("RATE_LIMITS", "")
+    # Simulated load all lands on one process; don't shed it unless asked to
+    os.environ.setdefault("SHED_MAX_IN_FLIGHT", "100000")
+    os.environ.setdefault("SHED_MAX_LOOP_LAG_MS", "60000")
+    os.environ.setdefault("SHED_MAX_STREAMS", "100000")
+
+    import server
+
+    if not mongo_url:
+        server.db = FakeDatabase(db_name, latency=db_latency, command_hook=_record_command)
+    stripe = FakeStripe(latency=stripe_latency).install()
+    return server, stripe
+
+
+async def reset_database(server):
+    """Start from an empty database (and cache) with the app's indexes"""
+    await server.cache.flush()
+    if isinstance(server.db, FakeDatabase):
+        server.db = FakeDatabase(server.db.name, latency=server.db.latency, command_hook=server.db.command_hook)
+    else:
+        await server.client.drop_database(server.db.name)
+    await server.ensure_indexes()
+
+
+def asgi_client(server) -> httpx.AsyncClient:
+    """HTTP client calling the app in-process (no lifespan events)"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://offline.test")
+
+
+def server_timing_db_calls(response: httpx.Response) -> Optional[int]:
+    """DB round trips reported by the app's Server-Timing header"""
+    header = response.headers.get("server-timing", "")
+    marker = 'desc="'
+    if marker not in header:
+        return None
+    return int(header.split(marker, 1)[1].split(" ", 1)[0])
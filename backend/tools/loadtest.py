@@ -0,0 +1,400 @@
+"""Load test simulating a competition launch against one API worker.
+
+    cd backend && python -m tools.loadtest --duration 30 --rates order=40,status=40,list=200
+
+Starts the real app under uvicorn in a subprocess wired to the in-memory Mongo
+and Stripe fakes (or targets a running server with --target), registers a pool
+of buyers and one hot competition, then drives an open-loop mix of
+registrations, logins, listing reads, order creation, checkout-status polling
+and Stripe webhooks at the configured rates. Prints a JSON report with latency
+percentiles, error rates and DB round trips per route, checkouts per second,
+and an oversell check on the hot competition. --preload-tickets fills the
+offline worker with a tools.dataset dataset first.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from tools.dataset import DatasetSpec, load
+from tools.fake_stripe import webhook_payload
+from tools.harness import ADMIN_PASSWORD, BACKEND_DIR, server_timing_db_calls
+
+# register/login each hold the event loop for a full bcrypt round (~0.3s), so
+# even these rates show up in every other route's tail latency
+DEFAULT_RATES = "register=0.2,login=0.5,list=100,order=30,status=30,webhook=10"
+ORIGIN_URL = "http://loadtest.local"
+PASSWORD = "loadtest-password"
+
+
+class Stats:
+    """Per-operation latency, status and DB call samples"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.db_calls: Dict[str, List[int]] = defaultdict(list)
+        self.dropped: Dict[str, int] = defaultdict(int)
+        self.checkouts_completed = 0
+
+    def record(self, op: str, seconds: float, status: str, db_calls: Optional[int]):
+        self.latencies[op].append(seconds)
+        self.statuses[op][status] += 1
+        if db_calls is not None:
+            self.db_calls[op].append(db_calls)
+
+    def report(self, duration: float) -> dict:
+        out = {}
+        for op in sorted(self.statuses):
+            samples = sorted(s * 1000 for s in self.latencies[op])
+            total = sum(self.statuses[op].values())
+            # 4xx are expected outcomes (sold out, bad input) except 429, which like 503 means load was turned away
+            errors = sum(
+                n for status, n in self.statuses[op].items()
+                if status == "429" or not status.startswith(("2", "4"))
+            )
+            q = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+            out[op] = {
+                "requests": total,
+                "rps": round(total / duration, 1),
+                "p50_ms": round(q[49], 1) if q else None,
+                "p95_ms": round(q[94], 1) if q else None,
+                "p99_ms": round(q[98], 1) if q else None,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "statuses": dict(self.statuses[op]),
+                "db_calls_per_request": round(statistics.fmean(self.db_calls[op]), 2) if self.db_calls[op] else None,
+                "dropped": self.dropped[op],
+            }
+        return out
+
+
+class LaunchScenario:
+    def __init__(self, http: httpx.AsyncClient, stats: Stats, args):
+        self.http = http
+        self.stats = stats
+        self.args = args
+        self.buyers: List[dict] = []
+        self.pending: List[tuple] = []  # (session_id, buyer) awaiting checkout-status polling
+        self.paid_sessions: List[str] = []
+        self.competition_id: Optional[str] = None
+        self.competition_ids: List[str] = []
+
+    async def call(self, op: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(op, time.perf_counter() - start, type(e).__name__, None)
+            return None
+        self.stats.record(op, time.perf_counter() - start, str(response.status_code),
+                          server_timing_db_calls(response))
+        return response
+
+    # -- setup
+
+    async def register(self, op: str = "register") -> Optional[dict]:
+        email = f"lt_{uuid.uuid4().hex[:12]}@example.com"
+        response = await self.call(op, "POST", "/api/auth/register",
+                                   json={"email": email, "password": PASSWORD, "name": "Load Test"})
+        if response is None or response.status_code != 200:
+            return None
+        return {"email": email, "headers": {"Authorization": f"Bearer {response.json()['token']}"}}
+
+    async def setup(self):
+        admin = {"X-Admin-Password": self.args.admin_password}
+        end_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        for i in range(self.args.competitions):
+            hot = i == 0
+            response = await self.http.post("/api/admin/competitions", headers=admin, json={
+                "title": "Launch prize" if hot else f"Background prize {i}",
+                "description": "Load test competition",
+                "prize_type": "car" if hot else "cash",
+                "prize_value": 50000 if hot else random.randint(100, 5000),
+                "prize_image": "/api/images/loadtest.jpg",
+                "ticket_price": 1.0,
+                "total_tickets": self.args.total_tickets if hot else 100_000,
+                "max_tickets_per_user": self.args.max_per_user,
+                "end_date": end_date,
+            })
+            response.raise_for_status()
+            self.competition_ids.append(response.json()["competition_id"])
+        self.competition_id = self.competition_ids[0]
+
+        semaphore = asyncio.Semaphore(8)
+
+        async def make_buyer():
+            async with semaphore:
+                return await self.register("setup_register")
+
+        self.buyers = [b for b in await asyncio.gather(*(make_buyer() for _ in range(self.args.users))) if b]
+        if not self.buyers:
+            raise RuntimeError("could not register any load-test users")
+
+    # -- operations
+
+    async def op_register(self):
+        buyer = await self.register()
+        if buyer:
+            self.buyers.append(buyer)
+
+    async def op_login(self):
+        buyer = random.choice(self.buyers)
+        await self.call("login", "POST", "/api/auth/login", json={"email": buyer["email"], "password": PASSWORD})
+
+    async def op_list(self):
+        path = random.choice([
+            "/api/competitions",
+            "/api/competitions/featured",
+            f"/api/competitions/{self.competition_id}",
+            f"/api/competitions/{self.competition_id}",
+        ])
+        await self.call("list", "GET", path)
+
+    async def op_order(self):
+        buyer = random.choice(self.buyers)
+        response = await self.call("order", "POST", "/api/orders/create", headers=buyer["headers"], json={
+            "competition_id": self.competition_id,
+            "ticket_count": random.randint(1, self.args.max_order),
+            "origin_url": ORIGIN_URL,
+        })
+        if response is not None and response.status_code == 200:
+            redirect = response.json().get("redirect_url") or ""
+            self.pending.append((redirect.rsplit("/", 1)[-1], buyer))
+
+    async def op_status(self):
+        if not self.pending:
+            return
+        session_id, buyer = self.pending.pop(random.randrange(len(self.pending)))
+        response = await self.call("status", "GET", f"/api/checkout/status/{session_id}", headers=buyer["headers"])
+        if response is not None and response.status_code == 200 and response.json().get("status") == "completed":
+            self.stats.checkouts_completed += 1
+            self.paid_sessions.append(session_id)
+
+    async def op_webhook(self):
+        if not self.paid_sessions:
+            return
+        body, headers = webhook_payload(random.choice(self.paid_sessions))
+        await self.call("webhook", "POST", "/api/webhook/stripe", content=body, headers=headers)
+
+    # -- checks
+
+    async def oversell_check(self) -> dict:
+        # The admin listing reads the primary; the public endpoint may serve a cached copy
+        competitions = (await self.http.get(
+            "/api/admin/competitions", params={"password": self.args.admin_password},
+        )).json()
+        competition = next(c for c in competitions if c["competition_id"] == self.competition_id)
+        entrants = (await self.http.get(
+            f"/api/admin/competition/{self.competition_id}/entrants",
+            params={"password": self.args.admin_password},
+        )).json()
+        numbers = [n for entrant in entrants for n in entrant["tickets"]]
+        per_user = [len(entrant["tickets"]) for entrant in entrants]
+        total = competition["total_tickets"]
+        return {
+            "total_tickets": total,
+            "sold_tickets": competition["sold_tickets"],
+            "issued_tickets": len(numbers),
+            "status": competition["status"],
+            "oversold_by": max(0, len(numbers) - total, competition["sold_tickets"] - total),
+            "sold_counter_drift": competition["sold_tickets"] - len(numbers),
+            "duplicate_numbers": len(numbers) - len(set(numbers)),
+            "max_tickets_one_user": max(per_user, default=0),
+            "users_over_cap": sum(1 for n in per_user if n > competition["max_tickets_per_user"]),
+            "ok": (
+                len(numbers) <= total
+                and competition["sold_tickets"] <= total
+                and len(numbers) == len(set(numbers))
+                and all(n <= competition["max_tickets_per_user"] for n in per_user)
+            ),
+        }
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        name, sep, rate = item.strip().partition("=")
+        if sep:
+            rates[name] = float(rate)
+    return rates
+
+
+async def drive(scenario: LaunchScenario, rates: Dict[str, float], duration: float, max_in_flight: int):
+    """Open-loop arrivals: each operation fires as a Poisson process at its own rate"""
+    semaphore = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+    deadline = time.perf_counter() + duration
+
+    async def run_one(fn):
+        try:
+            await fn()
+        finally:
+            semaphore.release()
+
+    async def arrivals(op: str, rate: float):
+        fn = getattr(scenario, f"op_{op}")
+        next_at = time.perf_counter()
+        while True:
+            next_at += random.expovariate(rate)
+            if next_at >= deadline:
+                return
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            if semaphore.locked():
+                # Client-side saturation; counted rather than queued so the offered load stays honest
+                scenario.stats.dropped[op] += 1
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(run_one(fn))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*(arrivals(op, rate) for op, rate in rates.items() if rate > 0))
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(http: httpx.AsyncClient, process: Optional[subprocess.Popen], timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"API worker exited with status {process.returncode}")
+        try:
+            if (await http.get("/api/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API worker did not become ready")
+
+
+async def run(args) -> dict:
+    rates = parse_rates(args.rates)
+    unknown = set(rates) - {"register", "login", "list", "order", "status", "webhook"}
+    if unknown:
+        raise SystemExit(f"unknown operations in --rates: {', '.join(sorted(unknown))}")
+
+    process = None
+    target = args.target
+    if not target:
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "tools.loadtest", "--serve", str(port),
+             "--db-latency-ms", str(args.db_latency_ms), "--stripe-latency-ms", str(args.stripe_latency_ms),
+             "--preload-users", str(args.preload_users), "--preload-competitions", str(args.preload_competitions),
+             "--preload-tickets", str(args.preload_tickets), "--seed", str(args.seed)],
+            cwd=BACKEND_DIR,
+        )
+        target = f"http://127.0.0.1:{port}"
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    stats = Stats()
+    try:
+        async with httpx.AsyncClient(base_url=target, limits=limits, timeout=args.timeout) as http:
+            await _wait_ready(http, process)
+            scenario = LaunchScenario(http, stats, args)
+            await scenario.setup()
+
+            start = time.perf_counter()
+            await drive(scenario, rates, args.duration, args.max_in_flight)
+            elapsed = time.perf_counter() - start
+
+            # Settle checkouts still waiting on a status poll so the oversell check sees every paid order
+            while scenario.pending:
+                await scenario.op_status()
+            check = await scenario.oversell_check()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "target": args.target or "subprocess (fake mongo + fake stripe)",
+            "duration_s": args.duration,
+            "rates": rates,
+            "users": args.users,
+            "db_latency_ms": args.db_latency_ms,
+            "stripe_latency_ms": args.stripe_latency_ms,
+            "preload_tickets": args.preload_tickets,
+            "seed": args.seed,
+        },
+        "checkouts_per_sec": round(stats.checkouts_completed / elapsed, 2),
+        "checkouts_completed": stats.checkouts_completed,
+        "operations": stats.report(elapsed),
+        "oversell_check": check,
+    }
+
+
+def serve(port: int, db_latency_ms: float, stripe_latency_ms: float, preload: Optional[DatasetSpec] = None):
+    """Run one uvicorn worker with the offline stand-ins (the subprocess side)"""
+    import uvicorn
+
+    from tools.harness import load_server
+
+    server, _ = load_server(stripe_latency=stripe_latency_ms / 1000)
+    if preload is not None:
+        asyncio.run(load(server.db, preload))
+    server.db.latency = db_latency_ms / 1000
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--target", help="base URL of a running API instead of a local offline worker")
+    parser.add_argument("--admin-password", default=ADMIN_PASSWORD)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--rates", default=DEFAULT_RATES, help="requests/second per operation")
+    parser.add_argument("--users", type=int, default=50, help="buyers registered before the launch")
+    parser.add_argument("--competitions", type=int, default=20, help="competitions listed (first one is hot)")
+    parser.add_argument("--total-tickets", type=int, default=5000, help="tickets in the hot competition")
+    parser.add_argument("--max-per-user", type=int, default=100)
+    parser.add_argument("--max-order", type=int, default=10, help="largest ticket count per order")
+    parser.add_argument("--max-in-flight", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--stripe-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--preload-tickets", type=int, default=0,
+                        help="load a tools.dataset dataset of this many tickets into the offline worker first")
+    parser.add_argument("--preload-users", type=int, default=5000)
+    parser.add_argument("--preload-competitions", type=int, default=50)
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        preload = DatasetSpec(users=args.preload_users, competitions=args.preload_competitions,
+                              tickets=args.preload_tickets, seed=args.seed) if args.preload_tickets else None
+        serve(args.serve, args.db_latency_ms, args.stripe_latency_ms, preload)
+        return
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()